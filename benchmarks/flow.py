@@ -0,0 +1,73 @@
+"""
+Бенчмарк сценария Kirim/Chiqim: type → category → currency → amount → pay_type → comment → confirm.
+
+Апдейты подаются прямо в dp, Bot API и лист подменены (см. harness.py).
+Печатает операций в секунду, перцентили по шагам и число вызовов
+Postgres / Bot API / Sheets на одну операцию.
+
+Запуск из корня репозитория:
+    BENCH_POSTGRES_DB=kapital_bench python -m benchmarks.flow --flows 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.harness import Harness, db_snapshot, print_call_counts, print_step_timings
+
+
+async def user_loop(harness, user_id, flows, rng, done):
+    for _ in range(flows):
+        try:
+            await harness.kirim_chiqim_flow(user_id, rng)
+            done.append(1)
+        except Exception:
+            # Ошибка уже учтена в harness.errors; FSM пользователя сбросит следующий /start
+            pass
+
+
+async def main(args):
+    harness = Harness(api_latency=args.api_latency, sheets_latency=args.sheets_latency)
+    await harness.setup()
+    try:
+        user_ids = [100_000 + i for i in range(args.concurrency)]
+        await harness.approve_users(user_ids)
+        # Прогрев: кэши клавиатур, справочников и статусов, соединения пула
+        await harness.kirim_chiqim_flow(user_ids[0], random.Random(args.seed))
+        await harness.wait_outbox_drained()
+        harness.step_timings.clear()
+        harness.api.calls.clear()
+        harness.worksheet.calls.clear()
+        db_before = db_snapshot()
+
+        per_user, extra = divmod(args.flows, args.concurrency)
+        done = []
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            user_loop(harness, user_id, per_user + (1 if i < extra else 0), random.Random(args.seed + i), done)
+            for i, user_id in enumerate(user_ids)))
+        elapsed = time.perf_counter() - started
+        drain = await harness.wait_outbox_drained()
+
+        flows = len(done)
+        print(f"Операций: {flows} из {args.flows}, пользователей одновременно: {args.concurrency}")
+        print(f"Время: {elapsed:.2f}s  →  {flows / elapsed:.1f} операций/с")
+        print(f"Доставка в лист после последней операции: {drain:.2f}s, строк в листе: {len(harness.worksheet.rows)}")
+        print_step_timings(harness)
+        print_call_counts(harness, db_before, flows)
+    finally:
+        await harness.teardown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flows', type=int, default=200, help='сколько операций провести')
+    parser.add_argument('--concurrency', type=int, default=10, help='пользователей, проводящих операции одновременно')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка Bot API, сек.')
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help='задержка одного вызова Sheets, сек.')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,395 @@
+"""
+Общая обвязка для офлайн-бенчмарков: бот из bot.py с настоящими хендлерами,
+но с поддельными Bot API и листом Google Sheets и отдельной базой Postgres.
+
+База берётся из BENCH_POSTGRES_DB (по умолчанию kapital_bench), остальные
+параметры подключения — из обычных POSTGRES_*. Перед прогоном таблицы
+пользователей, операций, outbox и FSM в этой базе очищаются, поэтому
+не указывайте здесь рабочую базу.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+
+# bot.py читает токен при импорте; настоящий не нужен — Bot API подменяется
+os.environ['BOT_TOKEN'] = '123456:BENCHMARK-FAKE-TOKEN'
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+from aiogram.utils.exceptions import BadRequest  # noqa: E402
+
+from data import config  # noqa: E402
+from middlewares.throttling import ThrottlingMiddleware  # noqa: E402
+from utils.db_api.migrations import migrate  # noqa: E402
+from utils.misc.metrics import db_seconds  # noqa: E402
+from utils.misc.token_bucket import TokenBucket  # noqa: E402
+
+# Telegram отклоняет клавиатуру целиком, если callback_data любой кнопки длиннее 64 байт
+CALLBACK_DATA_LIMIT = 64
+
+BENCH_POSTGRES_DB = os.environ.get('BENCH_POSTGRES_DB', 'kapital_bench')
+
+# Таблицы, которые очищаются перед прогоном (справочники остаются)
+RESET_TABLES = ('users', 'transactions', 'sheet_outbox', 'fsm_storage', 'balances',
+                'broadcast_jobs', 'broadcast_recipients')
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def format_percentiles(samples):
+    return (f"p50={percentile(samples, 0.5) * 1000:7.1f}ms  p95={percentile(samples, 0.95) * 1000:7.1f}ms  "
+            f"p99={percentile(samples, 0.99) * 1000:7.1f}ms  max={max(samples, default=0) * 1000:7.1f}ms")
+
+
+class FakeBotAPI:
+    """
+    Bot API в памяти: отвечает на запросы бота так, как ответил бы Telegram,
+    запоминает последние сообщения каждого чата (с клавиатурами) и считает вызовы.
+    Клавиатуру с callback_data длиннее 64 байт отклоняет, как настоящий Telegram.
+    latency — искусственная задержка каждого запроса в секундах,
+    chat_latency — отдельная задержка для отдельных чатов («медленные» клиенты).
+    """
+
+    def __init__(self, latency=0.0, history=20):
+        self.latency = latency
+        self.chat_latency = {}
+        self.calls = Counter()
+        self.chats = defaultdict(lambda: deque(maxlen=history))  # chat_id -> последние сообщения
+        self._message_ids = itertools.count(1)
+
+    def install(self, bot):
+        bot.request = self.request
+
+    @staticmethod
+    def _reply_markup(data):
+        reply_markup = data.get('reply_markup')
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        for row in (reply_markup or {}).get('inline_keyboard', []):
+            for button in row:
+                if len(button.get('callback_data', '').encode('utf-8')) > CALLBACK_DATA_LIMIT:
+                    raise BadRequest('Button_data_invalid')
+        return reply_markup
+
+    def _message(self, data, message_id=None):
+        chat_id = int(data['chat_id'])
+        reply_markup = self._reply_markup(data)
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 123456, 'is_bot': True, 'first_name': 'Bot'},
+            'text': data.get('text', ''),
+            'reply_markup': reply_markup,
+        }
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        data = data or {}
+        latency = self.chat_latency.get(int(data.get('chat_id') or 0), self.latency)
+        if latency:
+            await asyncio.sleep(latency)
+        if method in ('sendMessage', 'copyMessage'):
+            message = self._message(data)
+            self.chats[message['chat']['id']].append(message)
+            return message
+        if method in ('editMessageText', 'editMessageReplyMarkup'):
+            chat = self.chats[int(data['chat_id'])]
+            for message in chat:
+                if message['message_id'] == int(data['message_id']):
+                    reply_markup = self._reply_markup(data)
+                    if 'text' in data:
+                        message['text'] = data['text']
+                    message['reply_markup'] = reply_markup
+                    return message
+            return self._message(data, message_id=int(data['message_id']))
+        if method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Bot', 'username': 'benchmark_bot'}
+        return True
+
+    def find_button(self, chat_id, prefix, exact=False):
+        """Самые свежие инлайн-кнопки в чате, callback_data которых начинается с prefix (или равна ему)"""
+        for message in reversed(self.chats[chat_id]):
+            markup = message.get('reply_markup') or {}
+            buttons = [button for row in markup.get('inline_keyboard', []) for button in row
+                       if (button.get('callback_data', '') == prefix if exact
+                           else button.get('callback_data', '').startswith(prefix))]
+            if buttons:
+                return message, buttons
+        return None, []
+
+
+class FakeWorksheet:
+    """
+    Лист gspread в памяти. Вызовы выполняются в потоках пула Sheets, поэтому
+    задержка имитируется time.sleep, а счётчики защищены замком.
+    """
+
+    def __init__(self, title='Kirim/chiqim', latency=0.2, balances=('0', '0')):
+        self.title = title
+        self.latency = latency
+        self.balances = list(balances)
+        self.rows = []
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _call(self, op):
+        with self._lock:
+            self.calls[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def append_rows(self, rows, **kwargs):
+        self._call('append_rows')
+        with self._lock:
+            first = len(self.rows) + 2  # первая строка листа — заголовок
+            self.rows.extend(rows)
+            last = len(self.rows) + 1
+        return {'updates': {'updatedRange': f"'{self.title}'!A{first}:K{last}", 'updatedRows': len(rows)}}
+
+    def append_row(self, row, **kwargs):
+        return self.append_rows([row], **kwargs)
+
+    def get(self, range_name):
+        self._call('get')
+        return [list(self.balances)]
+
+    def acell(self, label):
+        self._call('acell')
+        return SimpleNamespace(value=self.balances['CD'.index(label[0])] if label[0] in 'CD' else '')
+
+
+class UpdateFactory:
+    """Собирает Update так, как их присылает Telegram"""
+
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+        self._callback_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+    def message(self, user_id, text=None, contact=None):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if contact is not None:
+            message['contact'] = {'phone_number': contact, 'first_name': f'User{user_id}', 'user_id': user_id}
+        return types.Update(update_id=next(self._update_ids), message=message)
+
+    def callback(self, user_id, message, data):
+        return types.Update(update_id=next(self._update_ids), callback_query={
+            'id': str(next(self._callback_ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data,
+        })
+
+
+class Harness:
+    """
+    Поднимает бота из bot.py с подделками и прогоняет через dp апдейты
+    синтетических пользователей. Время каждого шага пишется в step_timings.
+    """
+
+    def __init__(self, api_latency=0.0, sheets_latency=0.2, real_send_limits=False, throttling=False, history=20):
+        self.api = FakeBotAPI(latency=api_latency, history=history)
+        self.worksheet = FakeWorksheet(latency=sheets_latency)
+        self.updates = UpdateFactory()
+        self.real_send_limits = real_send_limits
+        self.throttling = throttling
+        self.step_timings = defaultdict(list)
+        # Группы пользователей (например, «медленные») и время их шагов — чтобы сравнивать хвосты
+        self.user_groups = {}
+        self.group_timings = defaultdict(list)
+        self.errors = Counter()
+        self.bot_module = None
+
+    async def setup(self):
+        config.POSTGRES_DB = BENCH_POSTGRES_DB
+        import bot as bot_module
+        self.bot_module = bot_module
+        Bot.set_current(bot_module.bot)
+        Dispatcher.set_current(bot_module.dp)
+        self.api.install(bot_module.bot)
+        bot_module.sheets.worksheet = lambda name=None: self.worksheet
+        if not self.real_send_limits:
+            # Лимиты Telegram к подделке не относятся и только растягивали бы прогон
+            sender = bot_module.sender
+            sender.global_limiter = TokenBucket(1e6)
+            sender.chat_rate = sender.chat_burst = 1e6
+        if not self.throttling:
+            # Бенчмарк сценария гонит шаги без пауз — антифлуд отбросил бы почти всё
+            applications = bot_module.dp.middleware.applications
+            applications[:] = [m for m in applications if not isinstance(m, ThrottlingMiddleware)]
+
+        await bot_module.db.create()
+        await migrate(bot_module.db)
+        await bot_module.db.execute(f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY CASCADE")
+        bot_module.user_status_cache.clear()
+        bot_module.categories_changed()
+        bot_module.pay_types_changed()
+        await bot_module.running_balances.seed_if_empty(bot_module.sheet_balances)
+        if isinstance(bot_module.storage, bot_module.PostgresStorage):
+            bot_module.storage.start()
+        bot_module.sheets_outbox.start()
+
+    async def teardown(self):
+        bot_module = self.bot_module
+        await bot_module.sender.close()
+        await bot_module.sheets_outbox.stop()
+        await bot_module.sheets_writer.close()
+        bot_module.sheets_executor.shutdown()
+        await bot_module.storage.close()
+        await bot_module.db.close()
+
+    async def approve_users(self, user_ids):
+        await self.bot_module.db.executemany(
+            "INSERT INTO users (user_id, name, phone, status, reg_date) VALUES ($1, $2, $3, 'approved', '') "
+            "ON CONFLICT (user_id) DO UPDATE SET status='approved'",
+            [(user_id, f'User{user_id}', f'+99890{user_id % 10_000_000:07d}') for user_id in user_ids])
+        for user_id in user_ids:
+            self.bot_module.user_status_cache.invalidate(user_id)
+
+    async def feed(self, step, update, user_id=None):
+        started = time.perf_counter()
+        try:
+            await self.bot_module.dp.process_updates([update])
+        except Exception as e:
+            self.errors[f'{step}: {type(e).__name__}'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.step_timings[step].append(elapsed)
+            self.group_timings[self.user_groups.get(user_id, 'users')].append(elapsed)
+
+    async def send(self, step, user_id, text=None, contact=None):
+        await self.feed(step, self.updates.message(user_id, text=text, contact=contact), user_id)
+
+    async def press(self, step, user_id, prefix, rng=random, exact=False):
+        message, buttons = self.api.find_button(user_id, prefix, exact)
+        if not buttons:
+            self.errors[f'{step}: no "{prefix}" button'] += 1
+            raise LookupError(f'user {user_id}: no button with prefix {prefix!r}')
+        data = rng.choice(buttons)['callback_data']
+        await self.feed(step, self.updates.callback(user_id, message, data), user_id)
+
+    async def wait_button(self, user_id, prefix, timeout=10.0, exact=False):
+        """Ждёт кнопку, которая придёт через очередь исходящих сообщений (например, админу)"""
+        deadline = time.perf_counter() + timeout
+        while not self.api.find_button(user_id, prefix, exact)[1]:
+            if time.perf_counter() > deadline:
+                raise LookupError(f'user {user_id}: button {prefix!r} did not arrive in {timeout}s')
+            await asyncio.sleep(0.01)
+
+    async def kirim_chiqim_flow(self, user_id, rng=random, think_time=None, outcome='confirm_yes'):
+        """
+        Сценарий Form: type → category → currency → amount → pay_type → comment → confirm.
+        think_time(rng) — пауза пользователя между шагами (None — без пауз).
+        outcome: confirm_yes / confirm_no, или abandon — бросить после выбора категории.
+        """
+        async def think():
+            if think_time is not None:
+                await asyncio.sleep(think_time(rng))
+
+        await self.send('start', user_id, '/start')
+        await think()
+        await self.press('type', user_id, 'type_', rng)
+        await think()
+        # Если админ как раз изменил категории, бот обновит клавиатуру — выбираем заново
+        for _ in range(3):
+            await self.press('category', user_id, 'cat:', rng)
+            if self.api.find_button(user_id, 'currency_')[1]:
+                break
+        if outcome == 'abandon':
+            return
+        await think()
+        await self.press('currency', user_id, 'currency_', rng)
+        await think()
+        await self.send('amount', user_id, str(rng.randint(1, 5000) * 1000))
+        await think()
+        await self.press('pay_type', user_id, 'pay:', rng)
+        await think()
+        if rng.random() < 0.5:
+            await self.press('comment', user_id, 'skip_comment', rng)
+        else:
+            await self.send('comment', user_id, f'benchmark {rng.randint(1, 10 ** 6)}')
+        await think()
+        await self.press('confirm', user_id, outcome, rng)
+
+    async def register(self, user_id, admin_id, rng=random, think_time=None):
+        """Регистрация через хендлеры: /start → имя → контакт → одобрение админом"""
+        await self.send('register', user_id, '/start')
+        if think_time is not None:
+            await asyncio.sleep(think_time(rng))
+        await self.send('register', user_id, f'User {user_id}')
+        await self.send('register', user_id, contact=f'+99890{user_id % 10_000_000:07d}')
+        await self.wait_button(admin_id, f'approve_{user_id}', exact=True)
+        await self.press('approve', admin_id, f'approve_{user_id}', rng, exact=True)
+
+    async def outbox_pending(self):
+        return await self.bot_module.db.fetchval("SELECT COUNT(*) FROM sheet_outbox WHERE status='pending'")
+
+    async def wait_outbox_drained(self, timeout=120.0):
+        """Ждёт, пока фоновый воркер доставит все строки в лист; возвращает время ожидания"""
+        started = time.perf_counter()
+        while time.perf_counter() - started < timeout:
+            if not await self.outbox_pending():
+                break
+            self.bot_module.sheets_outbox.wakeup()
+            await asyncio.sleep(0.05)
+        return time.perf_counter() - started
+
+
+def db_call_counts(before, after):
+    """Разница снимков bot_db_seconds: {операция: число запросов}"""
+    counts = {}
+    for labels, (count, _) in after.items():
+        delta = count - before.get(labels, (0, 0))[0]
+        if delta:
+            counts[labels[0]] = delta
+    return counts
+
+
+def db_snapshot():
+    return db_seconds.snapshot()
+
+
+def print_call_counts(harness, db_before, flows):
+    db_counts = db_call_counts(db_before, db_snapshot())
+    print('\nВызовы на одну операцию:')
+    for title, counts in (('Postgres', db_counts), ('Bot API', harness.api.calls), ('Sheets', harness.worksheet.calls)):
+        total = sum(counts.values())
+        details = ', '.join(f'{name}={count}' for name, count in sorted(counts.items()))
+        print(f"  {title:<9} {total / max(flows, 1):6.2f}  ({details})")
+
+
+def print_step_timings(harness):
+    print('\nЗадержка шагов (обработка апдейта в dp):')
+    for step, samples in harness.step_timings.items():
+        print(f"  {step:<9} n={len(samples):<6} {format_percentiles(samples)}")
+    if harness.errors:
+        print('\nОшибки:')
+        for error, count in harness.errors.most_common():
+            print(f"  {count:>6}  {error}")
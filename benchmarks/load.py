@@ -0,0 +1,214 @@
+"""
+Нагрузочный прогон: сотни одновременных синтетических пользователей против хендлеров bot.py.
+
+Каждый пользователь регистрируется (админ одобряет заявку кнопкой), затем
+проводит операции с паузами «на подумать»; исход операции выбирается по
+--mix. Админ по ходу прогона переименовывает категории, так что у части
+пользователей клавиатуры устаревают. Число пользователей растёт ступенями
+(--stages); по каждой ступени печатаются операции в секунду, хвосты
+задержек, рост очередей (исходящие сообщения, пул Sheets, outbox)
+и отдельно задержки «медленных» клиентов, у которых Bot API отвечает
+с задержкой --slow-latency, — чтобы видеть, что они не тормозят остальных.
+
+Запуск из корня репозитория:
+    BENCH_POSTGRES_DB=kapital_bench python -m benchmarks.load --stages 50,100,200,400 --stage-duration 30
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+
+from benchmarks.harness import Harness, format_percentiles, percentile
+from data.config import ADMINS
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        outcome, weight = part.split('=')
+        mix[outcome.strip()] = float(weight)
+    unknown = set(mix) - {'confirm_yes', 'confirm_no', 'abandon'}
+    if unknown:
+        raise argparse.ArgumentTypeError(f'unknown outcomes: {", ".join(sorted(unknown))}')
+    return mix
+
+
+class Stage:
+    def __init__(self, users):
+        self.users = users
+        self.ops = Counter()
+        self.queues = defaultdict(list)  # очередь -> замеры за ступень
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+
+class LoadRun:
+    def __init__(self, args):
+        self.args = args
+        self.harness = Harness(api_latency=args.api_latency, sheets_latency=args.sheets_latency, throttling=True,
+                               history=1000)
+        self.admin_id = ADMINS[0]
+        self.stage = None
+        self.stages = []
+        self.stop = asyncio.Event()
+        self.tasks = []
+
+    def think_time(self, rng):
+        return rng.expovariate(1 / self.args.think_mean) if self.args.think_mean else 0.0
+
+    async def user(self, user_id, rng):
+        try:
+            await self.harness.register(user_id, self.admin_id, rng, self.think_time)
+        except Exception:
+            self.stage.ops['register_failed'] += 1
+            return
+        outcomes, weights = zip(*self.args.mix.items())
+        while not self.stop.is_set():
+            outcome = rng.choices(outcomes, weights)[0]
+            stage = self.stage
+            try:
+                await self.harness.kirim_chiqim_flow(user_id, rng, self.think_time, outcome)
+                stage.ops[outcome] += 1
+            except Exception:
+                stage.ops['failed'] += 1
+            if self.args.pause_mean:
+                await asyncio.sleep(rng.expovariate(1 / self.args.pause_mean))
+
+    async def admin(self, rng):
+        """Периодически переименовывает случайную категорию туда и обратно"""
+        bot_module = self.harness.bot_module
+        renamed = None
+        while not self.stop.is_set():
+            await asyncio.sleep(self.args.admin_interval)
+            try:
+                items = await bot_module.categories_index.items()
+                if renamed is None:
+                    item_id, old_name, stamp = rng.choice(items)
+                    new_name = f'{old_name} *'
+                    renamed = item_id
+                else:
+                    item_id, old_name, stamp = next(item for item in items if item[0] == renamed)
+                    new_name, renamed = old_name[:-2], None
+                await self.harness.send('admin', self.admin_id, '/edit_category')
+                button = bot_module.edit_category_cb.new(id=item_id, v=stamp)
+                await self.harness.press('admin', self.admin_id, button, rng, exact=True)
+                await self.harness.send('admin', self.admin_id, new_name)
+                self.stage.ops['admin_edit'] += 1
+            except Exception:
+                self.stage.ops['admin_failed'] += 1
+
+    async def sample_queues(self):
+        bot_module = self.harness.bot_module
+        while not self.stop.is_set():
+            queues = self.stage.queues
+            queues['send'].append(bot_module.sender.queued)
+            queues['sheets'].append(bot_module.sheets_executor.pending)
+            queues['outbox'].append(await self.harness.outbox_pending())
+            await asyncio.sleep(0.5)
+
+    def spawn(self, coro):
+        self.tasks.append(asyncio.ensure_future(coro))
+
+    async def run(self):
+        args = self.args
+        harness = self.harness
+        await harness.setup()
+        try:
+            await harness.approve_users(ADMINS)
+            harness.user_groups[self.admin_id] = 'admin'
+            slow_ids = set()
+            for i in range(args.slow_users):
+                user_id = 200_000 + i
+                slow_ids.add(user_id)
+                harness.user_groups[user_id] = 'slow'
+                harness.api.chat_latency[user_id] = args.slow_latency
+
+            self.stage = Stage(0)
+            self.spawn(self.sample_queues())
+            if args.admin_interval:
+                self.spawn(self.admin(random.Random(args.seed)))
+            active = 0
+            for users in args.stages:
+                harness.step_timings.clear()
+                harness.group_timings.clear()
+                self.stage = Stage(users)
+                self.stages.append(self.stage)
+                while active < users:
+                    self.spawn(self.user(200_000 + active, random.Random(args.seed + active)))
+                    active += 1
+                await asyncio.sleep(args.stage_duration)
+                self.stage.elapsed = time.perf_counter() - self.stage.started
+                self.report_stage(self.stage)
+
+            self.stop.set()
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            drain = await harness.wait_outbox_drained()
+            self.report_summary(drain)
+        finally:
+            await harness.teardown()
+
+    def report_stage(self, stage):
+        harness = self.harness
+        timings = [sample for samples in harness.step_timings.values() for sample in samples]
+        completed = stage.ops['confirm_yes'] + stage.ops['confirm_no'] + stage.ops['abandon']
+        stage.throughput = completed / stage.elapsed
+        stage.p99 = percentile(timings, 0.99)
+        print(f"\n=== {stage.users} пользователей, {stage.elapsed:.0f}s ===")
+        print(f"Операций: {completed} ({stage.throughput:.1f}/с), сохранено: {stage.ops['confirm_yes']}, "
+              f"ошибок: {stage.ops['failed']}, правок админа: {stage.ops['admin_edit']}")
+        print(f"Все шаги:  {format_percentiles(timings)}")
+        for step in ('start', 'category', 'amount', 'confirm', 'register', 'approve'):
+            if harness.step_timings.get(step):
+                print(f"  {step:<9} {format_percentiles(harness.step_timings[step])}")
+        for group in ('users', 'slow', 'admin'):
+            if harness.group_timings.get(group):
+                print(f"  [{group}]{' ' * (8 - len(group))}{format_percentiles(harness.group_timings[group])}")
+        for name, samples in stage.queues.items():
+            if samples:
+                print(f"  очередь {name:<7} max={max(samples):<6} в конце={samples[-1]}")
+
+    def report_summary(self, drain):
+        print(f"\nДоставка в лист после остановки: {drain:.1f}s, строк в листе: {len(self.harness.worksheet.rows)}")
+        saturation = None
+        base = self.stages[0].throughput / self.stages[0].users if self.stages and self.stages[0].users else 0
+        for stage in self.stages:
+            if stage.p99 > self.args.slo:
+                saturation = (stage.users, f'p99 шага {stage.p99 * 1000:.0f}ms > {self.args.slo * 1000:.0f}ms')
+                break
+            if base and stage.throughput / stage.users < base * 0.8:
+                saturation = (stage.users, 'операций на пользователя стало на 20% меньше, чем на первой ступени')
+                break
+        if saturation:
+            print(f"Насыщение: {saturation[0]} пользователей — {saturation[1]}")
+        else:
+            print('Насыщение не достигнуто')
+        if self.harness.errors:
+            print('\nОшибки:')
+            for error, count in self.harness.errors.most_common(10):
+                print(f"  {count:>6}  {error}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', type=lambda text: [int(n) for n in text.split(',')], default=[50, 100, 200],
+                        help='число одновременных пользователей на каждой ступени')
+    parser.add_argument('--stage-duration', type=float, default=30.0, help='длительность ступени, сек.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('confirm_yes=80,confirm_no=10,abandon=10'),
+                        help='доли исходов операции')
+    parser.add_argument('--think-mean', type=float, default=1.0, help='средняя пауза между шагами, сек.')
+    parser.add_argument('--pause-mean', type=float, default=5.0, help='средняя пауза между операциями, сек.')
+    parser.add_argument('--admin-interval', type=float, default=10.0, help='как часто админ правит категории (0 — никогда)')
+    parser.add_argument('--slow-users', type=int, default=5, help='сколько пользователей с медленным Bot API')
+    parser.add_argument('--slow-latency', type=float, default=2.0, help='задержка Bot API для медленных, сек.')
+    parser.add_argument('--api-latency', type=float, default=0.03, help='задержка Bot API для остальных, сек.')
+    parser.add_argument('--sheets-latency', type=float, default=0.3, help='задержка одного вызова Sheets, сек.')
+    parser.add_argument('--slo', type=float, default=1.0, help='допустимый p99 шага, сек.')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(LoadRun(parse_args()).run())
@@ -1,30 +1,77 @@
+import asyncio
 import logging
-from aiogram import Bot, Dispatcher, executor, types
+import html
+from aiogram import Dispatcher, executor, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher.filters import CommandStart
+from aiogram.utils.callback_data import CallbackData
 from datetime import datetime
+from decimal import Decimal
 import os
 from environs import Env
-import gspread
-from google.oauth2.service_account import Credentials
 import platform
 import sqlite3
-import psycopg2
-from psycopg2 import sql, IntegrityError
+from asyncpg import UniqueViolationError
 import re
 
+import middlewares
+from data import config
+from keyboards.inline.registry import KeyboardRegistry
+from keyboards.inline.support import (cancel_support, cancel_support_callback, get_support_manager,
+                                     operator_keyboard, support_callback)
+from data.catalogs import DEFAULT_CATEGORIES
+from data.config import ADMINS
+from utils.broadcast import Broadcaster
+from utils.db_api.balances import RunningBalances, format_amount
+from utils.db_api.catalog import CatalogIndex, sync_catalog
+from utils.db_api.fsm_storage import FSMFlushMiddleware, PostgresStorage
+from utils.db_api.migrations import check_schema
+from utils.db_api.postgres import db, db_op
+from utils.db_api.security_db import access_control
+from utils.misc.cache import TTLCache
+from utils.misc.executor import BoundedExecutor
+from utils.misc import rate_limit
+from utils.misc.metrics import (InstrumentedBot, MetricsMiddleware, record_handler_error, registry,
+                                start_metrics_server)
+from utils.misc.operator_pool import operator_pool
+from utils.misc.support_sessions import SUPPORT_LOCK, SUPPORT_STATE, claim_support_process, support_sessions
+from utils.sender import MessageScheduler
+from utils.sheets import BalanceCache, SheetsOutbox, SheetsQuota, SheetsSession, SheetsWriteQueue
+
 # Загрузка переменных окружения
 env = Env()
 env.read_env()
 API_TOKEN = env.str('BOT_TOKEN')
 
-logging.basicConfig(level=logging.INFO)
-
-bot = Bot(token=API_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(bot, storage=MemoryStorage())
+logging.basicConfig(level=config.LOG_LEVEL)
+
+bot = InstrumentedBot(token=API_TOKEN, parse_mode=ParseMode.HTML)
+# FSM в Postgres переживает рестарт и общий для нескольких процессов бота
+if config.FSM_STORAGE == 'postgres':
+    storage = PostgresStorage(db, ttl=config.FSM_TTL, cleanup_interval=config.FSM_CLEANUP_INTERVAL)
+else:
+    storage = MemoryStorage()
+dp = Dispatcher(bot, storage=storage)
+# Все исходящие сообщения: порядок внутри чата, общий и per-chat лимиты, повтор после flood wait
+sender = MessageScheduler(bot, global_rate=config.SEND_GLOBAL_RATE, chat_rate=config.SEND_CHAT_RATE,
+                          chat_burst=config.SEND_CHAT_BURST)
+if isinstance(storage, PostgresStorage):
+    dp.middleware.setup(FSMFlushMiddleware(storage))
+# Антифлуд раньше метрик: отброшенные апдейты не считаются вызовами хендлеров
+middlewares.setup(dp, sender)
+# Время и ошибки хендлеров — в /metrics
+dp.middleware.setup(MetricsMiddleware())
+
+@dp.errors_handler()
+async def count_handler_errors(update, exception):
+    record_handler_error(exception)
+
+# Фоновые рассылки с ограничением скорости и продолжением после рестарта
+broadcaster = Broadcaster(db, sender, rate=config.BROADCAST_RATE, concurrency=config.BROADCAST_CONCURRENCY,
+                          max_attempts=config.BROADCAST_MAX_ATTEMPTS)
 
 # Состояния
 class Form(StatesGroup):
@@ -35,6 +82,20 @@ class Form(StatesGroup):
     pay_type = State()
     comment = State()
 
+# Готовые клавиатуры, пересобираются только после изменения категорий/типов оплаты
+kb_registry = KeyboardRegistry()
+
+# В callback_data — id записи и метка версии её названия (укладывается в 64 байта)
+category_cb = CallbackData('cat', 'id', 'v')
+pay_type_cb = CallbackData('pay', 'id', 'v')
+# Админские кнопки удаления и переименования — так же по id
+del_pay_type_cb = CallbackData('del_tolov', 'id', 'v')
+edit_pay_type_cb = CallbackData('edit_tolov', 'id', 'v')
+del_category_cb = CallbackData('del_category', 'id', 'v')
+edit_category_cb = CallbackData('edit_category', 'id', 'v')
+categories_index = CatalogIndex(db, 'categories')
+pay_types_index = CatalogIndex(db, 'pay_types')
+
 # Кнопки выбора Kirim/Chiqim
 start_kb = InlineKeyboardMarkup(row_width=2)
 start_kb.add(
@@ -110,14 +171,23 @@ def get_category_with_emoji(category_name):
     emoji = category_emojis.get(category_name, "")
     return f"{emoji} {category_name}".strip()
 
-def get_categories_kb():
+async def build_categories_kb():
     kb = InlineKeyboardMarkup(row_width=2)
-    for name in get_categories():
-        cb = f"cat_{name}"
+    for item_id, name, stamp in await categories_index.items():
+        cb = category_cb.new(id=item_id, v=stamp)
         # Просто показываем название категории без эмодзи
         kb.add(InlineKeyboardButton(name, callback_data=cb))
     return kb
 
+kb_registry.register('categories', build_categories_kb)
+
+async def get_categories_kb():
+    return await kb_registry.get('categories')
+
+def categories_changed():
+    categories_index.invalidate()
+    kb_registry.invalidate('categories')
+
 # Тип оплаты
 pay_types = [
     ("Plastik", "pay_plastik"),
@@ -126,13 +196,22 @@ pay_types = [
     ("Bank", "pay_bank")
 ]
 
-def get_pay_types_kb():
+async def build_pay_types_kb():
     kb = InlineKeyboardMarkup(row_width=2)
-    for name in get_pay_types():
-        cb = f"pay_{name}"
+    for item_id, name, stamp in await pay_types_index.items():
+        cb = pay_type_cb.new(id=item_id, v=stamp)
         kb.add(InlineKeyboardButton(name, callback_data=cb))
     return kb
 
+kb_registry.register('pay_types', build_pay_types_kb)
+
+async def get_pay_types_kb():
+    return await kb_registry.get('pay_types')
+
+def pay_types_changed():
+    pay_types_index.invalidate()
+    kb_registry.invalidate('pay_types')
+
 # Кнопка пропуска для Izoh
 skip_kb = InlineKeyboardMarkup().add(InlineKeyboardButton("Пропустить", callback_data="skip_comment"))
 
@@ -149,77 +228,127 @@ SHEET_NAME = 'Kirim/chiqim'
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CREDENTIALS_FILE = 'credentials.json'
 
+# Все вызовы Sheets API проходят через общую квоту; записи идут раньше чтений остатков
+sheets_quota = SheetsQuota(reads_per_minute=config.SHEETS_READS_PER_MINUTE,
+                           writes_per_minute=config.SHEETS_WRITES_PER_MINUTE,
+                           max_wait=config.SHEETS_QUOTA_MAX_WAIT)
+# Одна сессия на весь процесс: авторизация и метаданные листа кэшируются
+sheets = SheetsSession(CREDENTIALS_FILE, SHEET_ID, SHEET_NAME, SCOPES, quota=sheets_quota)
+# gspread синхронный — выполняем его в отдельном ограниченном пуле, чтобы не блокировать event loop
+sheets_executor = BoundedExecutor(max_workers=config.SHEETS_MAX_WORKERS, max_queue=config.SHEETS_MAX_QUEUE, name='sheets')
+# Остатки C1:D1 читаются одним запросом и разделяются между одновременными подтверждениями
+sheet_balances = BalanceCache(sheets, sheets_executor, ttl=config.SHEETS_BALANCE_TTL)
+# Строки от одновременных подтверждений пишутся пачкой через append_rows
+sheets_writer = SheetsWriteQueue(sheets, sheets_executor, max_batch=config.SHEETS_BATCH_SIZE,
+                                 max_delay=config.SHEETS_BATCH_DELAY, on_flush=sheet_balances.invalidate)
+def notify_outbox_failed(outbox_id, error):
+    text = (f"❗️ <b>Строка #{outbox_id} не записана в Google Sheets</b> после {config.OUTBOX_MAX_ATTEMPTS} попыток:\n"
+            f"<code>{html.escape(str(error))[:500]}</code>\n"
+            'Остальные строки отправляются дальше. После исправления листа: /outbox_retry')
+    for admin_id in ADMINS:
+        sender.send_message(admin_id, text)
+
+# Сначала коммит в Postgres, затем фоновая доставка в лист — записи не теряются при сбоях Google
+sheets_outbox = SheetsOutbox(db, sheets_writer, batch_size=config.SHEETS_BATCH_SIZE,
+                             poll_interval=config.OUTBOX_POLL_INTERVAL,
+                             retry_base=config.OUTBOX_RETRY_BASE, retry_max=config.OUTBOX_RETRY_MAX,
+                             lease=config.OUTBOX_LEASE, max_attempts=config.OUTBOX_MAX_ATTEMPTS,
+                             on_failed=notify_outbox_failed)
+# Остатки по валютам ведём сами в Postgres; C1/D1 листа нужны только для сверки
+running_balances = RunningBalances(db)
+
+registry.gauge('bot_sheets_executor_pending', 'Google Sheets calls running or waiting for a worker',
+               lambda: sheets_executor.pending)
+registry.gauge('bot_send_queue_size', 'Outgoing messages waiting in the scheduler', lambda: sender.queued)
+registry.gauge('bot_support_sessions', 'Users currently connected to a support operator',
+               lambda: len(support_sessions))
+registry.gauge('bot_support_operators_free', 'Support operators ready for a new user', lambda: operator_pool.free)
+registry.gauge('bot_support_waiting', 'Users waiting for a free support operator', lambda: operator_pool.waiting)
+registry.gauge('bot_sheets_reads_last_minute', 'Google Sheets read calls in the last 60 seconds',
+               lambda: sheets_quota.usage()['read']['used'])
+registry.gauge('bot_sheets_writes_last_minute', 'Google Sheets write calls in the last 60 seconds',
+               lambda: sheets_quota.usage()['write']['used'])
+registry.gauge('bot_sheets_quota_scale', 'Share of configured Sheets quota in use after 429 backoff',
+               lambda: sheets_quota.scale)
+registry.gauge('bot_sheets_rate_limited_total', 'Google Sheets 429 responses', lambda: sheets_quota.rate_limited)
+
 def clean_emoji(text):
     # Удаляет только эмодзи/спецсимволы в начале строки, остальной текст не трогает
     return re.sub(r'^[^\w\s]+', '', text).strip()
 
-def add_to_google_sheet(data):
-    print("🚨🚨🚨 ФУНКЦИЯ add_to_google_sheet ВЫЗВАНА! 🚨🚨🚨")
-    print(f"🚨🚨🚨 Данные: {data} 🚨🚨🚨")
-    try:
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet(SHEET_NAME)
-        # Jadval ustunlari: Kun, Summa, Nomi, Kirim-Chiqim, To'lov turi, Kategoriyalar, Izoh, Vaqt
-        from datetime import datetime
-        now = datetime.now()
-        # Формат даты: 7/30/2025
-        if platform.system() == 'Windows':
-            date_str = now.strftime('%-m/%-d/%Y')  # Убираем ведущие нули
-        else:
-            date_str = now.strftime('%-m/%-d/%Y')  # Убираем ведущие нули
-        time_str = now.strftime('%H:%M')
-        user_name = get_user_name(data.get('user_id', data.get('user_id', '')))
-        print(f"DEBUG: user_id = {data.get('user_id')}, user_name = '{user_name}'")
-        debug_users_table()  # Показываем содержимое базы данных
-        # Определяем, куда записать сумму в зависимости от выбранной валюты
-        currency = data.get('currency', 'Sum')
-        dollar_amount = ''
-        sum_amount = ''
-        
-        if currency == 'Dollar':
-            dollar_amount = data.get('amount', '')
-        else:
-            sum_amount = data.get('amount', '')
-        
-        row = [
-            date_str,      # Kun (A) - дата
-            time_str,      # Vaqt (B) - время
-            dollar_amount,                    # $ (C) - доллары
-            sum_amount,                       # Summa (D) - суммы
-            clean_emoji(data.get('type', '')), # Kirim-Chiqim (E)
-            data.get('pay_type', ''),         # To'lov turi (F)
-            clean_emoji(data.get('category', '')), # Kotegoriyalar (G)
-            '',                               # Loyihalar (H) - пусто
-            data.get('comment', ''),          # Izoh (I)
-            '',                               # Oylik ko'rsatkich (J) - пусто
-            user_name                         # User (K) - имя пользователя
-        ]
-        print(f"DEBUG: Row data: {row}")
-        worksheet.append_row(row)
-        print(f"✅ Данные успешно записаны в Google Sheets")
-        
-        # Получаем остатки из первой строки
-        try:
-            # Читаем значения из первой строки (C1 и D1)
-            dollar_balance = worksheet.acell('C1').value or '0'
-            sum_balance = worksheet.acell('D1').value or '0'
-            
-            # Форматируем остатки
-            balance_text = f"💰 <b>Остатки:</b>\n"
-            balance_text += f"💵 <b>Доллары:</b> {dollar_balance}\n"
-            balance_text += f"💸 <b>Суммы:</b> {sum_balance}"
-            
-            return balance_text
-        except Exception as e:
-            print(f"❌ Ошибка при получении остатков: {e}")
-            return None
-            
-    except Exception as e:
-        print(f"❌ Ошибка при записи в Google Sheets: {e}")
-        # Можно добавить логирование ошибки
-        return None
+async def build_sheet_row(data, now):
+    # Jadval ustunlari: Kun, Summa, Nomi, Kirim-Chiqim, To'lov turi, Kategoriyalar, Izoh, Vaqt
+    # Формат даты: 7/30/2025
+    if platform.system() == 'Windows':
+        date_str = now.strftime('%-m/%-d/%Y')  # Убираем ведущие нули
+    else:
+        date_str = now.strftime('%-m/%-d/%Y')  # Убираем ведущие нули
+    time_str = now.strftime('%H:%M')
+    # Имя уже могло быть получено вызывающим (process_confirm) — второй раз не запрашиваем
+    user_name = data.get('user_name') or await get_user_name(data.get('user_id', ''))
+    logging.debug("Sheet row for user_id=%s, user_name=%r", data.get('user_id'), user_name)
+    # Определяем, куда записать сумму в зависимости от выбранной валюты
+    currency = data.get('currency', 'Sum')
+    dollar_amount = ''
+    sum_amount = ''
+    
+    if currency == 'Dollar':
+        dollar_amount = data.get('amount', '')
+    else:
+        sum_amount = data.get('amount', '')
+    
+    row = [
+        date_str,      # Kun (A) - дата
+        time_str,      # Vaqt (B) - время
+        dollar_amount,                    # $ (C) - доллары
+        sum_amount,                       # Summa (D) - суммы
+        clean_emoji(data.get('type', '')), # Kirim-Chiqim (E)
+        data.get('pay_type', ''),         # To'lov turi (F)
+        clean_emoji(data.get('category', '')), # Kotegoriyalar (G)
+        '',                               # Loyihalar (H) - пусто
+        data.get('comment', ''),          # Izoh (I)
+        '',                               # Oylik ko'rsatkich (J) - пусто
+        user_name                         # User (K) - имя пользователя
+    ]
+    logging.debug("Sheet row data: %s", row)
+    return row
+
+async def save_transaction(conn, data, now):
+    # Локальная копия каждой строки Kirim/Chiqim — для отчётов и сверок без чтения из Sheets.
+    # Возвращает False, если операция с этим dedupe_key уже была записана.
+    transaction_id = await conn.fetchval(
+        'INSERT INTO transactions (dedupe_key, user_id, type, category, currency, amount, pay_type, comment, created_at) '
+        'VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9) ON CONFLICT (dedupe_key) DO NOTHING RETURNING id',
+        data['dedupe_key'], data.get('user_id'), clean_emoji(data.get('type', '')), clean_emoji(data.get('category', '')),
+        data.get('currency', 'Sum'), Decimal(data.get('amount', '0')), data.get('pay_type', ''), data.get('comment', ''), now)
+    return transaction_id is not None
+
+def format_balance_text(balances):
+    balance_text = f"💰 <b>Остатки:</b>\n"
+    balance_text += f"💵 <b>Доллары:</b> {format_amount(balances['Dollar'])}\n"
+    balance_text += f"💸 <b>Суммы:</b> {format_amount(balances['Sum'])}"
+    return balance_text
+
+@db_op
+async def add_to_google_sheet(data):
+    """
+    Сохраняет операцию локально (transactions, остатки, outbox) и возвращает текст с остатками.
+    В лист строку доставляет фоновый воркер outbox. Ошибка записи в Postgres пробрасывается наружу.
+    """
+    logging.debug("Saving operation: %s", data)
+    now = datetime.now()
+    row = await build_sheet_row(data, now)
+    # Операция, остатки и её строка для Sheets коммитятся вместе
+    async with db.transaction() as conn:
+        if await save_transaction(conn, data, now):
+            sign = 1 if data.get('type') == 'Kirim' else -1
+            await running_balances.apply(conn, data.get('currency', 'Sum'), sign * Decimal(data.get('amount', '0')))
+        await sheets_outbox.enqueue(row, data['dedupe_key'], conn=conn)
+    sheets_outbox.wakeup()
+    logging.debug("Operation %s saved, sheet row queued", data['dedupe_key'])
+    
+    # Остатки берём из локальной таблицы — без обращения к Google
+    return format_balance_text(await running_balances.get())
 
 def format_summary(data):
     tur_emoji = '🟢' if data.get('type') == 'Kirim' else '🔴'
@@ -239,152 +368,76 @@ def format_summary(data):
         f"<b>Vaqt:</b> {dt}"
     )
 
-# --- Админы ---
-ADMINS = [5657091547, 5048593195]  # Здесь можно добавить id других админов через запятую
-
-# --- Инициализация БД ---
-def get_db_conn():
-    return psycopg2.connect(
-        dbname=env.str('POSTGRES_DB', 'kapital'),
-        user=env.str('POSTGRES_USER', 'postgres'),
-        password=env.str('POSTGRES_PASSWORD', 'postgres'),
-        host=env.str('POSTGRES_HOST', 'localhost'),
-        port=env.str('POSTGRES_PORT', '5432')
-    )
-
-def init_db():
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        user_id BIGINT UNIQUE,
-        name TEXT,
-        phone TEXT,
-        status TEXT,
-        reg_date TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS pay_types (
-        id SERIAL PRIMARY KEY,
-        name TEXT UNIQUE
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS categories (
-        id SERIAL PRIMARY KEY,
-        name TEXT UNIQUE
-    )''')
-    # Заполняем дефолтные значения, если таблицы пусты
-    c.execute('SELECT COUNT(*) FROM pay_types')
-    if c.fetchone()[0] == 0:
-        for name in ["Plastik", "Naxt", "Perevod", "Bank"]:
-            c.execute('INSERT INTO pay_types (name) VALUES (%s)', (name,))
-    c.execute('SELECT COUNT(*) FROM categories')
-    if c.fetchone()[0] == 0:
-        for name in ["Мижозлардан", "Аренда техника и инструменты", "Бетон тайёрлаб бериш", "Геология ва лойиха ишлари", "Геология ишлари", "Диз топливо для техники", "Дорожные расходы", "Заправка", "Коммунал и интернет", "Кунлик ишчи", "Объем усталар", "Перевод", "Ойлик ишчилар", "Олиб чикиб кетилган мусор", "Перечесления Расход", "Питание", "Прочие расходы", "Ремонт техники и запчасти", "Сотиб олинган материал", "Карз", "Сотиб олинган снос уйлар", "Валюта операция", "Хизмат (Прочие расходы)", "Хоз товары и инвентарь", "SXF Kapital", "Хожи Ака", "Эхсон", "Хомийлик"]:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
-    conn.commit()
-    conn.close()
-
-init_db()
-
 # --- Проверка статуса пользователя ---
-def get_user_status(user_id):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT status FROM users WHERE user_id=%s', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
+# Статус нужен на каждом сообщении (фильтр block_unapproved), поэтому держим его в памяти.
+# Кэш сбрасывается при любом изменении статуса через функции ниже.
+user_status_cache = TTLCache(maxsize=config.USER_STATUS_CACHE_SIZE, ttl=config.USER_STATUS_CACHE_TTL)
+_NO_STATUS = object()
+
+@db_op
+async def get_user_status(user_id):
+    status = user_status_cache.get(user_id, _NO_STATUS)
+    if status is _NO_STATUS:
+        status = await db.fetchval('SELECT status FROM users WHERE user_id=$1', user_id)
+        user_status_cache.set(user_id, status)
+    return status
 
 # --- Регистрация пользователя ---
-def register_user(user_id, name, phone):
+@db_op
+async def register_user(user_id, name, phone):
     from datetime import datetime
-    print(f"DEBUG: register_user called with user_id={user_id}, name='{name}', phone='{phone}'")
-    conn = get_db_conn()
-    c = conn.cursor()
     try:
-        c.execute('INSERT INTO users (user_id, name, phone, status, reg_date) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (user_id) DO NOTHING',
-                  (user_id, name, phone, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        conn.commit()
-        print(f"DEBUG: User registered successfully in database")
-    except IntegrityError:
-        print(f"DEBUG: User already exists in database")
-        conn.rollback()
+        result = await db.execute('INSERT INTO users (user_id, name, phone, status, reg_date) VALUES ($1, $2, $3, $4, $5) ON CONFLICT (user_id) DO NOTHING',
+                                  user_id, name, phone, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        # Повторная регистрация не ошибка: ON CONFLICT DO NOTHING вставляет 0 строк
+        if result == 'INSERT 0 0':
+            logging.debug("User %s already exists", user_id)
+        else:
+            logging.info("User %s registered", user_id)
     except Exception as e:
-        print(f"DEBUG: Error registering user: {e}")
-        conn.rollback()
-    conn.close()
+        logging.error("Could not register user %s: %s", user_id, e)
+    user_status_cache.invalidate(user_id)
+    access_control.user_status_changed(user_id, 'pending')
 
 # --- Обновление статуса пользователя ---
-def update_user_status(user_id, status):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('UPDATE users SET status=%s WHERE user_id=%s', (status, user_id))
-    conn.commit()
-    conn.close()
-
-# --- Проверка содержимого базы данных ---
-def debug_users_table():
-    print("DEBUG: Checking users table contents:")
-    conn = get_db_conn()
-    c = conn.cursor()
-    try:
-        c.execute('SELECT user_id, name, phone, status, reg_date FROM users ORDER BY id DESC LIMIT 5')
-        rows = c.fetchall()
-        for row in rows:
-            print(f"  User: ID={row[0]}, Name='{row[1]}', Phone='{row[2]}', Status='{row[3]}', Date='{row[4]}'")
-    except Exception as e:
-        print(f"DEBUG: Error reading users table: {e}")
-    conn.close()
+@db_op
+async def update_user_status(user_id, status):
+    await db.execute('UPDATE users SET status=$1 WHERE user_id=$2', status, user_id)
+    user_status_cache.invalidate(user_id)
+    access_control.user_status_changed(user_id, status)
 
 # --- Получение имени пользователя для Google Sheets ---
-def get_user_name(user_id):
-    print(f"DEBUG: get_user_name called with user_id = {user_id}")
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT name FROM users WHERE user_id=%s', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    result = row[0] if row else ''
-    print(f"DEBUG: get_user_name result = '{result}'")
-    return result
+@db_op
+async def get_user_name(user_id):
+    name = await db.fetchval('SELECT name FROM users WHERE user_id=$1', user_id)
+    return name if name is not None else ''
 
 # --- Получение актуальных списков ---
-def get_pay_types():
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT name FROM pay_types')
-    result = [row[0] for row in c.fetchall()]
-    conn.close()
-    return result
-
-def get_categories():
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT name FROM categories')
-    result = [row[0] for row in c.fetchall()]
-    conn.close()
-    return result
+@db_op
+async def get_pay_types():
+    return [row['name'] for row in await db.fetch('SELECT name FROM pay_types')]
+
+@db_op
+async def get_categories():
+    return [row['name'] for row in await db.fetch('SELECT name FROM categories')]
 
 # --- Старт с регистрацией ---
 @dp.message_handler(commands=['start'])
 async def start(msg: types.Message, state: FSMContext):
     user_id = msg.from_user.id
-    status = get_user_status(user_id)
+    status = await get_user_status(user_id)
     if status == 'approved':
+        await broadcaster.unblock(user_id)
         await state.finish()
         text = "<b>Qaysi turdagi operatsiya?</b>"
-        kb = InlineKeyboardMarkup(row_width=2)
-        kb.add(
-            InlineKeyboardButton('🟢 Kirim', callback_data='type_kirim'),
-            InlineKeyboardButton('🔴 Chiqim', callback_data='type_chiqim')
-        )
-        await msg.answer(text, reply_markup=kb)
+        await sender.send_message(msg.chat.id, text, reply_markup=start_kb)
         await Form.type.set()
     elif status == 'pending':
-        await msg.answer('⏳ Sizning arizangiz ko‘rib chiqilmoqda. Iltimos, kuting.')
+        await sender.send_message(msg.chat.id, '⏳ Sizning arizangiz ko‘rib chiqilmoqda. Iltimos, kuting.')
     elif status == 'denied':
-        await msg.answer('❌ Sizga botdan foydalanishga ruxsat berilmagan.')
+        await sender.send_message(msg.chat.id, '❌ Sizga botdan foydalanishga ruxsat berilmagan.')
     else:
-        await msg.answer('Ismingizni kiriting:')
+        await sender.send_message(msg.chat.id, 'Ismingizni kiriting:')
         await state.set_state('register_name')
 
 # --- FSM для регистрации ---
@@ -398,7 +451,7 @@ async def process_register_name(msg: types.Message, state: FSMContext):
     await state.update_data(name=msg.text.strip())
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     kb.add(types.KeyboardButton("📱 Telefon raqamni yuborish", request_contact=True))
-    await msg.answer('Telefon raqamingizni yuboring:', reply_markup=kb)
+    await sender.send_message(msg.chat.id, 'Telefon raqamingizni yuboring:', reply_markup=kb)
     await state.set_state('register_phone')
 
 @dp.message_handler(state='register_phone', content_types=types.ContentTypes.CONTACT)
@@ -407,8 +460,8 @@ async def process_register_phone(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     user_id = msg.from_user.id
     name = data.get('name', '')
-    register_user(user_id, name, phone)
-    await msg.answer('⏳ Arizangiz adminga yuborildi. Iltimos, kuting.', reply_markup=types.ReplyKeyboardRemove())
+    await register_user(user_id, name, phone)
+    await sender.send_message(msg.chat.id, '⏳ Arizangiz adminga yuborildi. Iltimos, kuting.', reply_markup=types.ReplyKeyboardRemove())
     # Уведомление админа
     for admin_id in ADMINS:
         kb = InlineKeyboardMarkup(row_width=2)
@@ -416,7 +469,7 @@ async def process_register_phone(msg: types.Message, state: FSMContext):
             InlineKeyboardButton('✅ Ha', callback_data=f'approve_{user_id}'),
             InlineKeyboardButton('❌ Yoq', callback_data=f'deny_{user_id}')
         )
-        await bot.send_message(admin_id, f'🆕 Yangi foydalanuvchi ro‘yxatdan o‘tdi:\nID: <code>{user_id}</code>\nIsmi: <b>{name}</b>\nTelefon: <code>{phone}</code>', reply_markup=kb)
+        sender.send_message(admin_id, f'🆕 Yangi foydalanuvchi ro‘yxatdan o‘tdi:\nID: <code>{user_id}</code>\nIsmi: <b>{name}</b>\nTelefon: <code>{phone}</code>', reply_markup=kb)
     await state.finish()
 
 # --- Обработка одобрения/запрета админом ---
@@ -428,19 +481,22 @@ async def process_admin_approve(call: types.CallbackQuery, state: FSMContext):
     action, user_id = call.data.split('_')
     user_id = int(user_id)
     if action == 'approve':
-        update_user_status(user_id, 'approved')
-        await bot.send_message(user_id, '✅ Sizga botdan foydalanishga ruxsat berildi! /start')
+        await update_user_status(user_id, 'approved')
+        sender.send_message(user_id, '✅ Sizga botdan foydalanishga ruxsat berildi! /start')
         await call.message.edit_text('✅ Foydalanuvchi tasdiqlandi.')
     else:
-        update_user_status(user_id, 'denied')
-        await bot.send_message(user_id, '❌ Sizga botdan foydalanishga ruxsat berilmagan.')
+        await update_user_status(user_id, 'denied')
+        sender.send_message(user_id, '❌ Sizga botdan foydalanishga ruxsat berilmagan.')
         await call.message.edit_text('❌ Foydalanuvchi rad etildi.')
     await call.answer()
 
 # --- Ограничение доступа для всех остальных хендлеров ---
-@dp.message_handler(lambda msg: get_user_status(msg.from_user.id) != 'approved', state='*')
+async def is_not_approved(msg: types.Message):
+    return await get_user_status(msg.from_user.id) != 'approved'
+
+@dp.message_handler(is_not_approved, state='*')
 async def block_unapproved(msg: types.Message, state: FSMContext):
-    await msg.answer('⏳ Sizning arizangiz ko‘rib chiqilmoqda yoki sizga ruxsat berilmagan.')
+    await sender.send_message(msg.chat.id, '⏳ Sizning arizangiz ko‘rib chiqilmoqda yoki sizga ruxsat berilmagan.')
     await state.finish()
 
 # Старт
@@ -448,12 +504,7 @@ async def block_unapproved(msg: types.Message, state: FSMContext):
 async def start(msg: types.Message, state: FSMContext):
     await state.finish()
     text = "<b>Qaysi turdagi operatsiya?</b>"
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(
-        InlineKeyboardButton('🟢 Kirim', callback_data='type_kirim'),
-        InlineKeyboardButton('🔴 Chiqim', callback_data='type_chiqim')
-    )
-    await msg.answer(text, reply_markup=kb)
+    await sender.send_message(msg.chat.id, text, reply_markup=start_kb)
     await Form.type.set()
 
 # Kirim/Ciqim выбор
@@ -461,16 +512,21 @@ async def start(msg: types.Message, state: FSMContext):
 async def process_type(call: types.CallbackQuery, state: FSMContext):
     t = 'Kirim' if call.data == 'type_kirim' else 'Ciqim'
     await state.update_data(type=t)
-    await call.message.edit_text("<b>Kotegoriyani tanlang:</b>", reply_markup=get_categories_kb())
+    await call.message.edit_text("<b>Kotegoriyani tanlang:</b>", reply_markup=await get_categories_kb())
     await Form.category.set()
     await call.answer()
 
 
 
 # Категория
-@dp.callback_query_handler(lambda c: c.data.startswith('cat_'), state=Form.category)
-async def process_category(call: types.CallbackQuery, state: FSMContext):
-    cat = call.data[4:]
+@dp.callback_query_handler(category_cb.filter(), state=Form.category)
+async def process_category(call: types.CallbackQuery, state: FSMContext, callback_data: dict):
+    cat = await categories_index.resolve(callback_data['id'], callback_data['v'])
+    if cat is None:
+        # Кнопка из старой клавиатуры: категорию удалили или переименовали
+        await call.answer('⚠️ Kategoriyalar yangilandi, qaytadan tanlang.', show_alert=True)
+        await call.message.edit_reply_markup(reply_markup=await get_categories_kb())
+        return
     await state.update_data(category=cat)
     # Сразу переходим к выбору валюты
     kb = InlineKeyboardMarkup(row_width=2)
@@ -495,13 +551,17 @@ async def process_currency(call: types.CallbackQuery, state: FSMContext):
 @dp.message_handler(lambda m: m.text.replace('.', '', 1).isdigit(), state=Form.amount)
 async def process_amount(msg: types.Message, state: FSMContext):
     await state.update_data(amount=msg.text)
-    await msg.answer("<b>To'lov turini tanlang:</b>", reply_markup=get_pay_types_kb())
+    await sender.send_message(msg.chat.id, "<b>To'lov turini tanlang:</b>", reply_markup=await get_pay_types_kb())
     await Form.pay_type.set()
 
 # Тип оплаты
-@dp.callback_query_handler(lambda c: c.data.startswith('pay_'), state=Form.pay_type)
-async def process_pay_type(call: types.CallbackQuery, state: FSMContext):
-    pay = call.data[4:]
+@dp.callback_query_handler(pay_type_cb.filter(), state=Form.pay_type)
+async def process_pay_type(call: types.CallbackQuery, state: FSMContext, callback_data: dict):
+    pay = await pay_types_index.resolve(callback_data['id'], callback_data['v'])
+    if pay is None:
+        await call.answer("⚠️ To'lov turlari yangilandi, qaytadan tanlang.", show_alert=True)
+        await call.message.edit_reply_markup(reply_markup=await get_pay_types_kb())
+        return
     await state.update_data(pay_type=pay)
     await call.message.edit_text("<b>Izoh kiriting (yoki пропустите):</b>", reply_markup=skip_kb)
     await Form.comment.set()
@@ -518,7 +578,7 @@ async def skip_comment_btn(call: types.CallbackQuery, state: FSMContext):
     
     text = format_summary(data)
     
-    await call.message.answer(text, reply_markup=confirm_kb)
+    await sender.send_message(call.message.chat.id, text, reply_markup=confirm_kb)
     await state.set_state('confirm')
     await call.answer()
 
@@ -533,11 +593,12 @@ async def process_comment(msg: types.Message, state: FSMContext):
     
     text = format_summary(data)
 
-    await msg.answer(text, reply_markup=confirm_kb)
+    await sender.send_message(msg.chat.id, text, reply_markup=confirm_kb)
     await state.set_state('confirm')
 
 # Обработка кнопок Да/Нет
 @dp.callback_query_handler(lambda c: c.data in ['confirm_yes', 'confirm_no'], state='confirm')
+@rate_limit(2, 'confirm')
 async def process_confirm(call: types.CallbackQuery, state: FSMContext):
     if call.data == 'confirm_yes':
         data = await state.get_data()
@@ -554,16 +615,21 @@ async def process_confirm(call: types.CallbackQuery, state: FSMContext):
         data['vaqt'] = time_str
         # Гарантируем, что user_id всегда есть
         data['user_id'] = call.from_user.id
+        # Повторное нажатие «Ha» на том же сообщении не создаст вторую строку
+        data['dedupe_key'] = f"{call.from_user.id}:{call.message.message_id}"
+        chat_id = call.message.chat.id
         try:
-            balance_text = add_to_google_sheet(data)
-            await call.message.answer('✅ Данные успешно отправлены в Google Sheets!')
+            # Имя нужно и для строки листа, и для уведомления админов — берём один раз
+            data['user_name'] = await get_user_name(call.from_user.id)
+            balance_text = await add_to_google_sheet(data)
+            sender.send_message(chat_id, '✅ Данные сохранены и отправляются в Google Sheets!')
             
             # Отправляем остатки пользователю
             if balance_text:
-                await call.message.answer(balance_text)
+                sender.send_message(chat_id, balance_text)
 
             # Уведомление для админов
-            user_name = get_user_name(call.from_user.id) or call.from_user.full_name
+            user_name = data['user_name'] or call.from_user.full_name
             summary_text = format_summary(data)
             admin_notification_text = f"Foydalanuvchi <b>{user_name}</b> tomonidan kiritilgan yangi ma'lumot:\n\n{summary_text}"
             
@@ -572,60 +638,132 @@ async def process_confirm(call: types.CallbackQuery, state: FSMContext):
                 admin_notification_text += f"\n\n{balance_text}"
             
             for admin_id in ADMINS:
-                try:
-                    await bot.send_message(admin_id, admin_notification_text)
-                except Exception as e:
-                    logging.error(f"Could not send notification to admin {admin_id}: {e}")
+                sender.send_message(admin_id, admin_notification_text)
 
         except Exception as e:
-            await call.message.answer(f'⚠️ Ошибка при отправке в Google Sheets: {e}')
+            sender.send_message(chat_id, f'⚠️ Ошибка при сохранении операции: {e}')
         await state.finish()
     else:
-        await call.message.answer('❌ Операция отменена.')
+        sender.send_message(call.message.chat.id, '❌ Операция отменена.')
         await state.finish()
     # Возврат к стартовому шагу
     text = "<b>Qaysi turdagi operatsiya?</b>"
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(
-        InlineKeyboardButton('🟢 Kirim', callback_data='type_kirim'),
-        InlineKeyboardButton('🔴 Chiqim', callback_data='type_chiqim')
-    )
-    await call.message.answer(text, reply_markup=kb)
+    sender.send_message(call.message.chat.id, text, reply_markup=start_kb)
     await Form.type.set()
     await call.answer()
 
+# --- Поддержка: пользователь <-> оператор ---
+# Пока сессия открыта, сообщения обеих сторон пересылает SupportMiddleware
+async def offer_to_operator(user_id, operator_id):
+    name = await get_user_name(user_id) or user_id
+    sender.send_message(operator_id, f"🆘 <b>{name}</b> (<code>{user_id}</code>) yordam so'rayapti.",
+                        reply_markup=operator_keyboard(user_id))
+
+def support_claim_expired(operator_id, user_id):
+    # Оператор не ответил на запрос вовремя — он уже передан следующему в очереди
+    sender.send_message(user_id, "😔 Operator javob bermadi. /support ni qayta bosing.")
+
+operator_pool.on_expire = support_claim_expired
+support_waits = set()  # фоновые ожидания свободного оператора
+
+async def wait_for_operator(user_id):
+    operator_id = await operator_pool.wait(user_id, timeout=config.SUPPORT_WAIT_TIMEOUT)
+    if operator_id is None:
+        sender.send_message(user_id, "😔 Hozir barcha operatorlar band. Keyinroq urinib ko'ring.")
+        return
+    await offer_to_operator(user_id, operator_id)
+
+@dp.message_handler(commands=['support'], state='*')
+async def support_cmd(msg: types.Message, state: FSMContext):
+    user_id = msg.from_user.id
+    if user_id in operator_pool:
+        await sender.send_message(msg.chat.id, 'Siz operatorsiz.')
+        return
+    await state.finish()
+    if len(operator_pool) == 0:
+        # Поддержку обслуживает другой процесс или она выключена — ждать здесь некого
+        await sender.send_message(msg.chat.id, "😔 Qo'llab-quvvatlash hozir ishlamayapti. Keyinroq urinib ko'ring.")
+        return
+    if operator_pool.operator_of(user_id) is not None:
+        await sender.send_message(msg.chat.id, "⏳ So'rovingiz operatorga yuborilgan, javobini kuting.")
+        return
+    position = operator_pool.position(user_id)
+    if position is not None:
+        await sender.send_message(msg.chat.id, f"⏳ Siz navbatdasiz: {position}-o'rin.")
+        return
+    operator_id = await get_support_manager(user_id)
+    if operator_id is not None:
+        await offer_to_operator(user_id, operator_id)
+        await sender.send_message(msg.chat.id, "⏳ So'rovingiz operatorga yuborildi, javobini kuting.")
+        return
+    # Свободных нет — встаём в очередь; освободившийся оператор достанется первому в ней
+    position = operator_pool.enqueue(user_id)
+    task = asyncio.ensure_future(wait_for_operator(user_id))
+    support_waits.add(task)
+    task.add_done_callback(support_waits.discard)
+    await sender.send_message(msg.chat.id, f"⏳ Barcha operatorlar band. Siz navbatdasiz: {position}-o'rin.")
+
+@dp.callback_query_handler(support_callback.filter(), state='*')
+async def support_accept(call: types.CallbackQuery, callback_data: dict):
+    operator_id = call.from_user.id
+    user_id = int(callback_data['user_id'])
+    if operator_pool.user_of(operator_id) != user_id or user_id in support_sessions:
+        await call.answer("So'rov eskirgan.", show_alert=True)
+        await call.message.edit_reply_markup()
+        return
+    await support_sessions.open(user_id, operator_id)
+    await call.message.edit_text("✅ Foydalanuvchi bilan bog'landingiz. Xabarlaringiz unga yuboriladi.",
+                                 reply_markup=cancel_support(user_id))
+    sender.send_message(user_id, "✅ Operator bog'landi. Savolingizni yozing.",
+                        reply_markup=cancel_support(operator_id))
+    await call.answer()
+
+@dp.callback_query_handler(cancel_support_callback.filter(), state='*')
+async def support_cancel(call: types.CallbackQuery, callback_data: dict):
+    my_id = call.from_user.id
+    second_id = int(callback_data['user_id'])
+    if support_sessions.peer(my_id) == second_id:
+        await support_sessions.close(my_id)
+        await call.message.edit_reply_markup()
+        await sender.send_message(call.message.chat.id, 'Suhbat yakunlandi.')
+        sender.send_message(second_id, 'Suhbat yakunlandi.')
+    elif operator_pool.user_of(my_id) == second_id and second_id not in support_sessions:
+        # Оператор отказался от запроса; release() сразу передаёт его следующему в очереди
+        operator_pool.release(my_id)
+        await call.message.edit_text('❌ Rad etildi.')
+        sender.send_message(second_id, "😔 Operator hozir band. Keyinroq /support ni bosing.")
+    else:
+        await call.message.edit_reply_markup()
+    await call.answer()
+
 # --- Команды для админа ---
 @dp.message_handler(commands=['add_tolov'], state='*')
 async def add_paytype_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    await msg.answer('Yangi To‘lov turi nomini yuboring:')
+    await sender.send_message(msg.chat.id, 'Yangi To‘lov turi nomini yuboring:')
     await state.set_state('add_paytype')
 
 @dp.message_handler(state='add_paytype', content_types=types.ContentTypes.TEXT)
 async def add_paytype_save(msg: types.Message, state: FSMContext):
     name = msg.text.strip()
-    conn = get_db_conn()
-    c = conn.cursor()
     try:
-        c.execute('INSERT INTO pay_types (name) VALUES (%s)', (name,))
-        conn.commit()
-        await msg.answer(f'✅ Yangi To‘lov turi qo‘shildi: {name}')
-    except IntegrityError:
-        await msg.answer('❗️ Bu nom allaqachon mavjud.')
-        conn.rollback()
-    conn.close()
+        await db.execute('INSERT INTO pay_types (name) VALUES ($1)', name)
+        pay_types_changed()
+        await sender.send_message(msg.chat.id, f'✅ Yangi To‘lov turi qo‘shildi: {name}')
+    except UniqueViolationError:
+        await sender.send_message(msg.chat.id, '❗️ Bu nom allaqachon mavjud.')
     await state.finish()
 
 @dp.message_handler(commands=['add_category'], state='*')
 async def add_category_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    await msg.answer('Yangi kategoriya nomini yuboring:')
+    await sender.send_message(msg.chat.id, 'Yangi kategoriya nomini yuboring:')
     await state.set_state('add_category')
 
 def split_emoji_and_text(text):
@@ -639,63 +777,74 @@ def split_emoji_and_text(text):
 @dp.message_handler(state='add_category', content_types=types.ContentTypes.TEXT)
 async def add_category_save(msg: types.Message, state: FSMContext):
     emoji, name = split_emoji_and_text(msg.text.strip())
-    conn = get_db_conn()
-    c = conn.cursor()
     try:
-        c.execute('INSERT INTO categories (name, emoji) VALUES (%s, %s)', (name, emoji))
-        conn.commit()
-        await msg.answer(f'✅ Yangi kategoriya qo‘shildi: {emoji} {name}'.strip())
-    except IntegrityError:
-        await msg.answer('❗️ Bu nom allaqachon mavjud.')
-        conn.rollback()
-    conn.close()
+        await db.execute('INSERT INTO categories (name, emoji) VALUES ($1, $2)', name, emoji)
+        categories_changed()
+        await sender.send_message(msg.chat.id, f'✅ Yangi kategoriya qo‘shildi: {emoji} {name}'.strip())
+    except UniqueViolationError:
+        await sender.send_message(msg.chat.id, '❗️ Bu nom allaqachon mavjud.')
     await state.finish()
 
 # --- Удаление и изменение To'lov turi ---
+async def build_admin_catalog_kb(index, cb, icon):
+    kb = InlineKeyboardMarkup(row_width=1)
+    for item_id, name, stamp in await index.items():
+        kb.add(InlineKeyboardButton(f'{icon} {name}', callback_data=cb.new(id=item_id, v=stamp)))
+    return kb
+
+async def resolve_admin_choice(call, index, callback_data, kb):
+    """Название выбранной записи; для устаревшей кнопки — None и свежая клавиатура"""
+    name = await index.resolve(callback_data['id'], callback_data['v'])
+    if name is None:
+        await call.answer('⚠️ Ro‘yxat yangilandi, qaytadan tanlang.', show_alert=True)
+        await call.message.edit_reply_markup(reply_markup=await kb())
+    return name
+
+async def del_tolov_kb():
+    return await build_admin_catalog_kb(pay_types_index, del_pay_type_cb, '❌')
+
+async def edit_tolov_kb():
+    return await build_admin_catalog_kb(pay_types_index, edit_pay_type_cb, '✏️')
+
 @dp.message_handler(commands=['del_tolov'], state='*')
 async def del_tolov_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_pay_types():
-        kb.add(InlineKeyboardButton(f'❌ {name}', callback_data=f'del_tolov_{name}'))
-    await msg.answer('O‘chirish uchun To‘lov turini tanlang:', reply_markup=kb)
+    await sender.send_message(msg.chat.id, 'O‘chirish uchun To‘lov turini tanlang:', reply_markup=await del_tolov_kb())
 
-@dp.callback_query_handler(lambda c: c.data.startswith('del_tolov_'))
-async def del_tolov_cb(call: types.CallbackQuery):
+@dp.callback_query_handler(del_pay_type_cb.filter())
+async def del_tolov_choice(call: types.CallbackQuery, callback_data: dict):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
-    name = call.data[len('del_tolov_'):]
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM pay_types WHERE name=%s', (name,))
-    conn.commit()
-    conn.close()
+    name = await resolve_admin_choice(call, pay_types_index, callback_data, del_tolov_kb)
+    if name is None:
+        return
+    await db.execute('DELETE FROM pay_types WHERE id=$1', int(callback_data['id']))
+    pay_types_changed()
     await call.message.edit_text(f'❌ To‘lov turi o‘chirildi: {name}')
     await call.answer()
 
 @dp.message_handler(commands=['edit_tolov'], state='*')
 async def edit_tolov_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_pay_types():
-        kb.add(InlineKeyboardButton(f'✏️ {name}', callback_data=f'edit_tolov_{name}'))
-    await msg.answer('Tahrirlash uchun To‘lov turini tanlang:', reply_markup=kb)
+    await sender.send_message(msg.chat.id, 'Tahrirlash uchun To‘lov turini tanlang:', reply_markup=await edit_tolov_kb())
 
-@dp.callback_query_handler(lambda c: c.data.startswith('edit_tolov_'))
-async def edit_tolov_cb(call: types.CallbackQuery, state: FSMContext):
+@dp.callback_query_handler(edit_pay_type_cb.filter())
+async def edit_tolov_choice(call: types.CallbackQuery, state: FSMContext, callback_data: dict):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
-    old_name = call.data[len('edit_tolov_'):]
-    await state.update_data(edit_tolov_old=old_name)
-    await call.message.answer(f'Yangi nomini yuboring (eski: {old_name}):')
+    old_name = await resolve_admin_choice(call, pay_types_index, callback_data, edit_tolov_kb)
+    if old_name is None:
+        return
+    await state.update_data(edit_tolov_id=int(callback_data['id']), edit_tolov_old=old_name)
+    await sender.send_message(call.message.chat.id, f'Yangi nomini yuboring (eski: {old_name}):')
     await state.set_state('edit_tolov_new')
     await call.answer()
 
@@ -704,59 +853,60 @@ async def edit_tolov_save(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     old_name = data.get('edit_tolov_old')
     new_name = msg.text.strip()
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('UPDATE pay_types SET name=%s WHERE name=%s', (new_name, old_name))
-    conn.commit()
-    conn.close()
-    await msg.answer(f'✏️ To‘lov turi o‘zgartirildi: {old_name} → {new_name}')
+    try:
+        await db.execute('UPDATE pay_types SET name=$1 WHERE id=$2', new_name, data.get('edit_tolov_id'))
+        pay_types_changed()
+        await sender.send_message(msg.chat.id, f'✏️ To‘lov turi o‘zgartirildi: {old_name} → {new_name}')
+    except UniqueViolationError:
+        await sender.send_message(msg.chat.id, '❗️ Bu nom allaqachon mavjud.')
     await state.finish()
 
 # --- Удаление и изменение Kotegoriyalar ---
+async def del_category_kb():
+    return await build_admin_catalog_kb(categories_index, del_category_cb, '❌')
+
+async def edit_category_kb():
+    return await build_admin_catalog_kb(categories_index, edit_category_cb, '✏️')
+
 @dp.message_handler(commands=['del_category'], state='*')
 async def del_category_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_categories():
-        kb.add(InlineKeyboardButton(f'❌ {name}', callback_data=f'del_category_{name}'))
-    await msg.answer('O‘chirish uchun kategoriya tanlang:', reply_markup=kb)
+    await sender.send_message(msg.chat.id, 'O‘chirish uchun kategoriya tanlang:', reply_markup=await del_category_kb())
 
-@dp.callback_query_handler(lambda c: c.data.startswith('del_category_'))
-async def del_category_cb(call: types.CallbackQuery):
+@dp.callback_query_handler(del_category_cb.filter())
+async def del_category_choice(call: types.CallbackQuery, callback_data: dict):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
-    name = call.data[len('del_category_'):]
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM categories WHERE name=%s', (name,))
-    conn.commit()
-    conn.close()
+    name = await resolve_admin_choice(call, categories_index, callback_data, del_category_kb)
+    if name is None:
+        return
+    await db.execute('DELETE FROM categories WHERE id=$1', int(callback_data['id']))
+    categories_changed()
     await call.message.edit_text(f'❌ Kategoriya o‘chirildi: {name}')
     await call.answer()
 
 @dp.message_handler(commands=['edit_category'], state='*')
 async def edit_category_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_categories():
-        kb.add(InlineKeyboardButton(f'✏️ {name}', callback_data=f'edit_category_{name}'))
-    await msg.answer('Tahrirlash uchun kategoriya tanlang:', reply_markup=kb)
+    await sender.send_message(msg.chat.id, 'Tahrirlash uchun kategoriya tanlang:', reply_markup=await edit_category_kb())
 
-@dp.callback_query_handler(lambda c: c.data.startswith('edit_category_'))
-async def edit_category_cb(call: types.CallbackQuery, state: FSMContext):
+@dp.callback_query_handler(edit_category_cb.filter())
+async def edit_category_choice(call: types.CallbackQuery, state: FSMContext, callback_data: dict):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
-    old_name = call.data[len('edit_category_'):]
-    await state.update_data(edit_category_old=old_name)
-    await call.message.answer(f'Yangi nomini yuboring (eski: {old_name}):')
+    old_name = await resolve_admin_choice(call, categories_index, callback_data, edit_category_kb)
+    if old_name is None:
+        return
+    await state.update_data(edit_category_id=int(callback_data['id']), edit_category_old=old_name)
+    await sender.send_message(call.message.chat.id, f'Yangi nomini yuboring (eski: {old_name}):')
     await state.set_state('edit_category_new')
     await call.answer()
 
@@ -765,33 +915,26 @@ async def edit_category_save(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     old_name = data.get('edit_category_old')
     new_name = msg.text.strip()
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('UPDATE categories SET name=%s WHERE name=%s', (new_name, old_name))
-    conn.commit()
-    conn.close()
-    await msg.answer(f'✏️ Kategoriya o‘zgartirildi: {old_name} → {new_name}')
+    try:
+        await db.execute('UPDATE categories SET name=$1 WHERE id=$2', new_name, data.get('edit_category_id'))
+        categories_changed()
+        await sender.send_message(msg.chat.id, f'✏️ Kategoriya o‘zgartirildi: {old_name} → {new_name}')
+    except UniqueViolationError:
+        await sender.send_message(msg.chat.id, '❗️ Bu nom allaqachon mavjud.')
     await state.finish()
 
 @dp.message_handler(commands=['debug_db'], state='*')
 async def debug_db_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
         # Проверяем таблицу users
-        c.execute("SELECT COUNT(*) FROM users")
-        users_count = c.fetchone()[0]
-        
-        c.execute("SELECT user_id, name, phone, status, reg_date FROM users ORDER BY id DESC LIMIT 5")
-        recent_users = c.fetchall()
+        users_count = await db.fetchval("SELECT COUNT(*) FROM users")
         
-        conn.close()
+        recent_users = await db.fetch("SELECT user_id, name, phone, status, reg_date FROM users ORDER BY id DESC LIMIT 5")
         
         text = f"<b>База данных:</b>\n"
         text += f"Всего пользователей: {users_count}\n\n"
@@ -803,20 +946,20 @@ async def debug_db_cmd(msg: types.Message, state: FSMContext):
         else:
             text += "Пользователей нет\n"
             
-        await msg.answer(text)
+        await sender.send_message(msg.chat.id, text)
         
     except Exception as e:
-        await msg.answer(f"❌ Ошибка при проверке БД: {e}")
+        await sender.send_message(msg.chat.id, f"❌ Ошибка при проверке БД: {e}")
 
 @dp.message_handler(commands=['test_user'], state='*')
 async def test_user_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()
     
     user_id = msg.from_user.id
-    user_name = get_user_name(user_id)
+    user_name = await get_user_name(user_id)
     
     text = f"<b>Тест функции get_user_name:</b>\n"
     text += f"Ваш user_id: {user_id}\n"
@@ -827,111 +970,62 @@ async def test_user_cmd(msg: types.Message, state: FSMContext):
     else:
         text += "❌ Имя пользователя НЕ найдено в базе"
     
-    await msg.answer(text)
+    await sender.send_message(msg.chat.id, text)
 
 @dp.message_handler(commands=['recreate_db'], state='*')
 async def recreate_db_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Удаляем старую таблицу categories
-        c.execute('DROP TABLE IF EXISTS categories')
-        
-        # Создаем новую таблицу categories без столбца emoji
-        c.execute('''CREATE TABLE categories (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE
-        )''')
-        
-        # Заполняем дефолтными значениями
-        for name in ["Мижозлардан", "Аренда техника и инструменты", "Бетон тайёрлаб бериш", "Геология ва лойиха ишлари", "Геология ишлари", "Диз топливо для техники", "Дорожные расходы", "Заправка", "Коммунал и интернет", "Кунлик ишчи", "Объем усталар", "Перевод", "Ойлик ишчилар", "Олиб чикиб кетилган мусор", "Перечесления Расход", "Питание", "Прочие расходы", "Ремонт техники и запчасти", "Сотиб олинган материал", "Карз", "Сотиб олинган снос уйлар", "Валюта операция", "Хизмат (Прочие расходы)", "Хоз товары и инвентарь", "SXF Kapital", "Хожи Ака", "Эхсон", "Хомийлик"]:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
-        
-        conn.commit()
-        conn.close()
+        async with db.transaction() as conn:
+            # Удаляем старую таблицу categories
+            await conn.execute('DROP TABLE IF EXISTS categories')
+            
+            # Создаем новую таблицу categories без столбца emoji
+            await conn.execute('''CREATE TABLE categories (
+                id SERIAL PRIMARY KEY,
+                name TEXT UNIQUE
+            )''')
+            
+            # Заполняем дефолтными значениями
+            await sync_catalog(conn, 'categories', DEFAULT_CATEGORIES)
+        categories_changed()
         
-        await msg.answer('✅ База данных пересоздана! Таблица categories обновлена.')
+        await sender.send_message(msg.chat.id, '✅ База данных пересоздана! Таблица categories обновлена.')
         
     except Exception as e:
-        await msg.answer(f'❌ Ошибка при пересоздании БД: {e}')
+        await sender.send_message(msg.chat.id, f'❌ Ошибка при пересоздании БД: {e}')
 
 @dp.message_handler(commands=['sync_categories'], state='*')
 async def sync_categories_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Очищаем таблицу categories
-        c.execute('DELETE FROM categories')
-        
-        # Добавляем актуальные категории
-        categories = [
-            "Мижозлардан",
-            "Аренда техника и инструменты",
-            "Бетон тайёрлаб бериш",
-            "Геология ва лойиха ишлари",
-            "Геология ишлари",
-            "Диз топливо для техники",
-            "Дорожные расходы",
-            "Заправка",
-            "Коммунал и интернет",
-            "Кунлик ишчи",
-            "Объем усталар",
-            "Перевод",
-            "Ойлик ишчилар",
-            "Олиб чикиб кетилган мусор",
-            "Перечесления Расход",
-            "Питание",
-            "Прочие расходы",
-            "Ремонт техники и запчасти",
-            "Сотиб олинган материал",
-            "Карз",
-            "Сотиб олинган снос уйлар",
-            "Валюта операция",
-            "Хизмат (Прочие расходы)",
-            "Хоз товары и инвентарь",
-            "SXF Kapital",
-            "Хожи Ака",
-            "Эхсон",
-            "Хомийлик"
-        ]
-        
-        for name in categories:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
-        
-        conn.commit()
-        conn.close()
+        async with db.transaction() as conn:
+            result = await sync_catalog(conn, 'categories', DEFAULT_CATEGORIES)
+        if result.changed:
+            categories_changed()
         
-        await msg.answer('✅ Категории синхронизированы!')
+        await sender.send_message(msg.chat.id, '✅ Категории синхронизированы!\n\n' + result.summary())
         
     except Exception as e:
-        await msg.answer(f'❌ Ошибка при синхронизации: {e}')
+        await sender.send_message(msg.chat.id, f'❌ Ошибка при синхронизации: {e}')
 
 @dp.message_handler(commands=['show_categories'], state='*')
 async def show_categories_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        c.execute('SELECT name FROM categories ORDER BY id')
-        categories = c.fetchall()
-        conn.close()
+        categories = await db.fetch('SELECT name FROM categories ORDER BY id')
         
         if categories:
             text = '<b>Текущие категории в базе данных:</b>\n\n'
@@ -940,15 +1034,15 @@ async def show_categories_cmd(msg: types.Message, state: FSMContext):
         else:
             text = '❌ Категории не найдены в базе данных'
         
-        await msg.answer(text)
+        await sender.send_message(msg.chat.id, text)
         
     except Exception as e:
-        await msg.answer(f'❌ Ошибка при получении категорий: {e}')
+        await sender.send_message(msg.chat.id, f'❌ Ошибка при получении категорий: {e}')
 
 @dp.message_handler(commands=['load_categories_from_file'], state='*')
 async def load_categories_from_file_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()
     
@@ -957,75 +1051,54 @@ async def load_categories_from_file_cmd(msg: types.Message, state: FSMContext):
         with open('categories.txt', 'r', encoding='utf-8') as f:
             categories = [line.strip() for line in f if line.strip()]
         
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Очищаем таблицу categories
-        c.execute('DELETE FROM categories')
-        
-        # Добавляем категории из файла
-        for name in categories:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
+        async with db.transaction() as conn:
+            result = await sync_catalog(conn, 'categories', categories)
+        if result.changed:
+            categories_changed()
         
-        conn.commit()
-        conn.close()
-        
-        await msg.answer(f'✅ Загружено {len(categories)} категорий из файла categories.txt')
+        await sender.send_message(msg.chat.id, f'✅ Загружено {len(categories)} категорий из файла categories.txt\n\n' + result.summary())
         
     except FileNotFoundError:
-        await msg.answer('❌ Файл categories.txt не найден')
+        await sender.send_message(msg.chat.id, '❌ Файл categories.txt не найден')
     except Exception as e:
-        await msg.answer(f'❌ Ошибка при загрузке категорий: {e}')
+        await sender.send_message(msg.chat.id, f'❌ Ошибка при загрузке категорий: {e}')
 
 @dp.message_handler(commands=['reboot'], state='*')
 async def reboot_cmd(msg: types.Message, state: FSMContext):
     await state.finish()  # Останавливаем FSM состояние
     text = "<b>Qaysi turdagi operatsiya?</b>"
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(
-        InlineKeyboardButton('🟢 Kirim', callback_data='type_kirim'),
-        InlineKeyboardButton('🔴 Chiqim', callback_data='type_chiqim')
-    )
-    await msg.answer(text, reply_markup=kb)
+    await sender.send_message(msg.chat.id, text, reply_markup=start_kb)
     await Form.type.set()
 
 @dp.message_handler(commands=['userslist'], state='*')
 async def users_list_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name, phone, reg_date FROM users WHERE status='approved'")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.fetch("SELECT user_id, name, phone, reg_date FROM users WHERE status='approved'")
     if not rows:
-        await msg.answer('Hali birorta ham tasdiqlangan foydalanuvchi yo‘q.')
+        await sender.send_message(msg.chat.id, 'Hali birorta ham tasdiqlangan foydalanuvchi yo‘q.')
         return
     text = '<b>Tasdiqlangan foydalanuvchilar:</b>\n'
     for i, (user_id, name, phone, reg_date) in enumerate(rows, 1):
         text += f"\n{i}. <b>{name}</b>\nID: <code>{user_id}</code>\nTelefon: <code>{phone}</code>\nRo‘yxatdan o‘tgan: {reg_date}\n"
-    await msg.answer(text)
+    await sender.send_message(msg.chat.id, text)
 
 @dp.message_handler(commands=['block_user'], state='*')
 async def block_user_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name FROM users WHERE status='approved'")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.fetch("SELECT user_id, name FROM users WHERE status='approved'")
     if not rows:
-        await msg.answer('Hali birorta ham tasdiqlangan foydalanuvchi yo‘q.')
+        await sender.send_message(msg.chat.id, 'Hali birorta ham tasdiqlangan foydalanuvchi yo‘q.')
         return
     kb = InlineKeyboardMarkup(row_width=1)
     for user_id, name in rows:
         kb.add(InlineKeyboardButton(f'🚫 {name} ({user_id})', callback_data=f'blockuser_{user_id}'))
-    await msg.answer('Bloklash uchun foydalanuvchini tanlang:', reply_markup=kb)
+    await sender.send_message(msg.chat.id, 'Bloklash uchun foydalanuvchini tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('blockuser_'))
 async def block_user_cb(call: types.CallbackQuery):
@@ -1033,32 +1106,25 @@ async def block_user_cb(call: types.CallbackQuery):
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
     user_id = int(call.data[len('blockuser_'):])
-    update_user_status(user_id, 'denied')
-    try:
-        await bot.send_message(user_id, '❌ Sizga botdan foydalanishga ruxsat berilmagan. (Admin tomonidan bloklandi)')
-    except Exception:
-        pass
+    await update_user_status(user_id, 'denied')
+    sender.send_message(user_id, '❌ Sizga botdan foydalanishga ruxsat berilmagan. (Admin tomonidan bloklandi)')
     await call.message.edit_text(f'🚫 Foydalanuvchi bloklandi: {user_id}')
     await call.answer()
 
 @dp.message_handler(commands=['approve_user'], state='*')
 async def approve_user_cmd(msg: types.Message, state: FSMContext):
     if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
         return
     await state.finish()  # Сброс состояния
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name FROM users WHERE status='denied'")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.fetch("SELECT user_id, name FROM users WHERE status='denied'")
     if not rows:
-        await msg.answer('Hali birorta ham bloklangan foydalanuvchi yo‘q.')
+        await sender.send_message(msg.chat.id, 'Hali birorta ham bloklangan foydalanuvchi yo‘q.')
         return
     kb = InlineKeyboardMarkup(row_width=1)
     for user_id, name in rows:
         kb.add(InlineKeyboardButton(f'✅ {name} ({user_id})', callback_data=f'approveuser_{user_id}'))
-    await msg.answer('Qayta tasdiqlash uchun foydalanuvchini tanlang:', reply_markup=kb)
+    await sender.send_message(msg.chat.id, 'Qayta tasdiqlash uchun foydalanuvchini tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('approveuser_'))
 async def approve_user_cb(call: types.CallbackQuery):
@@ -1066,37 +1132,155 @@ async def approve_user_cb(call: types.CallbackQuery):
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
     user_id = int(call.data[len('approveuser_'):])
-    update_user_status(user_id, 'approved')
-    try:
-        await bot.send_message(user_id, '✅ Sizga botdan foydalanishga yana ruxsat berildi! /start')
-    except Exception:
-        pass
+    await update_user_status(user_id, 'approved')
+    sender.send_message(user_id, '✅ Sizga botdan foydalanishga yana ruxsat berildi! /start')
     await call.message.edit_text(f'✅ Foydalanuvchi qayta tasdiqlandi: {user_id}')
     await call.answer()
 
+async def notify_balance_drift(drift):
+    if not drift:
+        for admin_id in ADMINS:
+            sender.send_message(admin_id, '✅ Остатки бота снова совпадают с Google Sheets.')
+        return
+    text = '⚠️ <b>Остатки бота расходятся с Google Sheets:</b>\n'
+    for currency, (local, sheet) in drift.items():
+        text += f"{currency}: бот {format_amount(local)}, лист {format_amount(sheet)}\n"
+    text += 'Принять значения из листа: /sync_balances'
+    for admin_id in ADMINS:
+        sender.send_message(admin_id, text)
+
+@dp.message_handler(commands=['sync_balances'], state='*')
+async def sync_balances_cmd(msg: types.Message, state: FSMContext):
+    if msg.from_user.id not in ADMINS:
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
+        return
+    await state.finish()
+    try:
+        sheet_balances.invalidate()
+        balances = await running_balances.reset_from_sheet(sheet_balances)
+        await sender.send_message(msg.chat.id, '✅ Остатки синхронизированы с Google Sheets.\n\n' + format_balance_text(balances))
+    except Exception as e:
+        await sender.send_message(msg.chat.id, f'❌ Ошибка при синхронизации остатков: {e}')
+
+# --- Авторизация групп (для SecurityMiddleware) ---
+@dp.message_handler(commands=['allow_group'], chat_type=[types.ChatType.GROUP, types.ChatType.SUPERGROUP], state='*')
+async def allow_group_cmd(msg: types.Message, state: FSMContext):
+    if msg.from_user.id not in ADMINS:
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
+        return
+    await db.execute('INSERT INTO authorized_groups (chat_id, title, added_by) VALUES ($1, $2, $3) '
+                     'ON CONFLICT (chat_id) DO UPDATE SET title=EXCLUDED.title',
+                     msg.chat.id, msg.chat.title, msg.from_user.id)
+    access_control.group_authorized(msg.chat.id)
+    await sender.send_message(msg.chat.id, '✅ Guruh avtorizatsiya qilindi.')
+
+@dp.message_handler(commands=['revoke_group'], chat_type=[types.ChatType.GROUP, types.ChatType.SUPERGROUP], state='*')
+async def revoke_group_cmd(msg: types.Message, state: FSMContext):
+    if msg.from_user.id not in ADMINS:
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
+        return
+    await db.execute('DELETE FROM authorized_groups WHERE chat_id=$1', msg.chat.id)
+    access_control.group_revoked(msg.chat.id)
+    await sender.send_message(msg.chat.id, '🚫 Guruh avtorizatsiyasi bekor qilindi.')
+
+@dp.message_handler(commands=['sheets_quota'], state='*')
+async def sheets_quota_cmd(msg: types.Message, state: FSMContext):
+    if msg.from_user.id not in ADMINS:
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
+        return
+    await state.finish()
+    usage = sheets_quota.usage()
+    text = '<b>Квота Google Sheets (за последнюю минуту):</b>\n'
+    text += f"📖 Чтения: {usage['read']['used']}/{usage['read']['limit']}, ждут: {usage['read']['waiting']}\n"
+    text += f"✍️ Записи: {usage['write']['used']}/{usage['write']['limit']}, ждут: {usage['write']['waiting']}\n"
+    text += f"📉 Лимиты: {usage['scale']:.0%} от настроенных, ответов 429: {usage['rate_limited']}\n"
+    if usage['paused_for']:
+        text += f"⏸ Пауза после 429: ещё {usage['paused_for']:.0f} сек.\n"
+    pending = await db.fetchval("SELECT COUNT(*) FROM sheet_outbox WHERE status='pending'")
+    text += f"📬 Строк ждут отправки в лист: {pending}"
+    failed = await db.fetchval("SELECT COUNT(*) FROM sheet_outbox WHERE status='failed'")
+    if failed:
+        text += f"\n❗️ Не записаны после {config.OUTBOX_MAX_ATTEMPTS} попыток: {failed} (повторить: /outbox_retry)"
+    await sender.send_message(msg.chat.id, text)
+
+@dp.message_handler(commands=['outbox_retry'], state='*')
+async def outbox_retry_cmd(msg: types.Message, state: FSMContext):
+    if msg.from_user.id not in ADMINS:
+        await sender.send_message(msg.chat.id, 'Faqat admin uchun!')
+        return
+    requeued = await sheets_outbox.requeue_failed()
+    await sender.send_message(msg.chat.id, f"🔁 Строк возвращено в очередь отправки: {requeued}")
+
 async def set_user_commands(dp):
     commands = [
         types.BotCommand("start", "Botni boshlash"),
         types.BotCommand("reboot", "Qayta boshlash - FSM ni to'xtatish"),
+        types.BotCommand("support", "Operator bilan bog'lanish"),
         # Здесь можно добавить другие публичные команды
     ]
     await dp.bot.set_my_commands(commands)
 
 async def notify_all_users(bot):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users WHERE status='approved'")
-    rows = c.fetchall()
-    conn.close()
-    for (user_id,) in rows:
-        try:
-            await bot.send_message(user_id, "Iltimos, /start ni bosing va botdan foydalanishni davom eting!")
-        except Exception:
-            pass  # Пользователь мог заблокировать бота или быть недоступен
+    # Рассылка идёт в фоне и не задерживает запуск; прерванная рестартом — продолжается
+    await broadcaster.resume()
+    await broadcaster.start('startup', "Iltimos, /start ni bosing va botdan foydalanishni davom eting!")
 
 if __name__ == '__main__':
     from aiogram import executor
+    from aiogram.utils.executor import Executor
+    from utils.webhook import BackgroundWebhookHandler, wait_pending_updates
+    metrics_runner = None
     async def on_startup(dp):
+        global metrics_runner
+        if config.METRICS_PORT:
+            metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+        await db.create()
+        await check_schema(db)
+        if config.SUPPORT_IDS:
+            # Сессии и пул операторов — в памяти процесса: второй процесс с поддержкой не стартует
+            await claim_support_process(db)
+        if config.SECURITY_ENABLED:
+            await access_control.load()
+        if isinstance(storage, PostgresStorage):
+            storage.start()
+            support_sessions.restore(await storage.find_state(SUPPORT_STATE))
+        sheets_outbox.start()
+        try:
+            await running_balances.seed_if_empty(sheet_balances)
+        except Exception as e:
+            logging.error(f"Could not seed balances from Google Sheets: {e}")
+        running_balances.start_reconciliation(sheet_balances, config.BALANCE_RECONCILE_INTERVAL, notify_balance_drift)
         await set_user_commands(dp)
         await notify_all_users(dp.bot)
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup) 
+    async def on_startup_polling(dp):
+        # getUpdates не работает при установленном вебхуке; накопившиеся апдейты не сбрасываем
+        await dp.bot.delete_webhook(drop_pending_updates=False)
+        await on_startup(dp)
+    async def on_startup_webhook(dp):
+        await on_startup(dp)
+        await dp.bot.set_webhook(config.WEBHOOK_HOST + config.WEBHOOK_PATH,
+                                 secret_token=config.WEBHOOK_SECRET or None,
+                                 max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                                 drop_pending_updates=False)
+    async def on_shutdown(dp):
+        # Вебхук не удаляем: апдейты во время деплоя дождутся нового процесса у Telegram
+        await wait_pending_updates()
+        await broadcaster.stop()
+        await sender.close()
+        await running_balances.stop()
+        await sheets_outbox.stop()
+        await sheets_writer.close()
+        sheets_executor.shutdown()
+        await storage.close()
+        await db.release_lock(SUPPORT_LOCK)
+        await db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+    if config.BOT_MODE == 'webhook':
+        webhook_executor = Executor(dp, skip_updates=False)
+        webhook_executor.on_startup(on_startup_webhook)
+        webhook_executor.on_shutdown(on_shutdown)
+        webhook_executor.set_webhook(config.WEBHOOK_PATH, request_handler=BackgroundWebhookHandler)
+        webhook_executor.run_app(host=config.WEBAPP_HOST, port=config.WEBAPP_PORT)
+    else:
+        executor.start_polling(dp, skip_updates=False, on_startup=on_startup_polling, on_shutdown=on_shutdown)
@@ -0,0 +1,32 @@
+# Справочники по умолчанию: заполняют пустую базу (миграция 2) и /sync_categories
+DEFAULT_PAY_TYPES = ["Plastik", "Naxt", "Perevod", "Bank"]
+DEFAULT_CATEGORIES = [
+    "Мижозлардан",
+    "Аренда техника и инструменты",
+    "Бетон тайёрлаб бериш",
+    "Геология ва лойиха ишлари",
+    "Геология ишлари",
+    "Диз топливо для техники",
+    "Дорожные расходы",
+    "Заправка",
+    "Коммунал и интернет",
+    "Кунлик ишчи",
+    "Объем усталар",
+    "Перевод",
+    "Ойлик ишчилар",
+    "Олиб чикиб кетилган мусор",
+    "Перечесления Расход",
+    "Питание",
+    "Прочие расходы",
+    "Ремонт техники и запчасти",
+    "Сотиб олинган материал",
+    "Карз",
+    "Сотиб олинган снос уйлар",
+    "Валюта операция",
+    "Хизмат (Прочие расходы)",
+    "Хоз товары и инвентарь",
+    "SXF Kapital",
+    "Хожи Ака",
+    "Эхсон",
+    "Хомийлик"
+]
@@ -0,0 +1,101 @@
+from environs import Env
+
+# Загрузка переменных окружения
+env = Env()
+env.read_env()
+
+# --- Админы ---
+ADMINS = env.list('ADMINS', [5657091547, 5048593195], subcast=int)  # id админов через запятую
+
+# --- PostgreSQL ---
+POSTGRES_DB = env.str('POSTGRES_DB', 'kapital')
+POSTGRES_USER = env.str('POSTGRES_USER', 'postgres')
+POSTGRES_PASSWORD = env.str('POSTGRES_PASSWORD', 'postgres')
+POSTGRES_HOST = env.str('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = env.int('POSTGRES_PORT', 5432)
+
+# Пул соединений
+DB_POOL_MIN_SIZE = env.int('DB_POOL_MIN_SIZE', 2)
+DB_POOL_MAX_SIZE = env.int('DB_POOL_MAX_SIZE', 10)
+DB_ACQUIRE_TIMEOUT = env.float('DB_ACQUIRE_TIMEOUT', 5.0)  # сек. ожидания свободного соединения
+DB_COMMAND_TIMEOUT = env.float('DB_COMMAND_TIMEOUT', 10.0)  # сек. на один запрос
+DB_HEALTH_CHECK_INTERVAL = env.float('DB_HEALTH_CHECK_INTERVAL', 30.0)  # пинг соединений, простаивавших дольше
+DB_MAX_INACTIVE_LIFETIME = env.float('DB_MAX_INACTIVE_LIFETIME', 300.0)  # закрывать простаивающие соединения
+
+# Кэш статусов пользователей (approved/pending/denied)
+USER_STATUS_CACHE_TTL = env.float('USER_STATUS_CACHE_TTL', 60.0)
+USER_STATUS_CACHE_SIZE = env.int('USER_STATUS_CACHE_SIZE', 5000)
+
+# --- Google Sheets ---
+SHEETS_MAX_WORKERS = env.int('SHEETS_MAX_WORKERS', 4)  # одновременных запросов к Sheets API
+SHEETS_MAX_QUEUE = env.int('SHEETS_MAX_QUEUE', 50)  # сколько запросов может ждать своей очереди
+SHEETS_BATCH_SIZE = env.int('SHEETS_BATCH_SIZE', 50)  # максимум строк в одном append_rows
+SHEETS_BATCH_DELAY = env.float('SHEETS_BATCH_DELAY', 0.3)  # сек. ожидания соседних строк перед записью
+
+# Outbox: доставка подтверждённых операций в Sheets
+OUTBOX_POLL_INTERVAL = env.float('OUTBOX_POLL_INTERVAL', 5.0)
+OUTBOX_RETRY_BASE = env.float('OUTBOX_RETRY_BASE', 2.0)  # первая пауза после ошибки, дальше удваивается
+OUTBOX_RETRY_MAX = env.float('OUTBOX_RETRY_MAX', 300.0)
+OUTBOX_LEASE = env.float('OUTBOX_LEASE', 300.0)  # сек. строка закреплена за отправляющим процессом
+OUTBOX_MAX_ATTEMPTS = env.int('OUTBOX_MAX_ATTEMPTS', 5)  # отказов листа, после которых строка помечается failed
+SHEETS_BALANCE_TTL = env.float('SHEETS_BALANCE_TTL', 2.0)  # сек. кэша остатков C1:D1 между записями
+
+# Квота Sheets API (по умолчанию у Google — 60 чтений и 60 записей в минуту на сервисный аккаунт)
+SHEETS_READS_PER_MINUTE = env.int('SHEETS_READS_PER_MINUTE', 60)
+SHEETS_WRITES_PER_MINUTE = env.int('SHEETS_WRITES_PER_MINUTE', 60)
+SHEETS_QUOTA_MAX_WAIT = env.float('SHEETS_QUOTA_MAX_WAIT', 60.0)  # сек. ожидания квоты, дальше — ошибка и повтор через outbox
+
+# Сверка локальных остатков с C1/D1 листа
+BALANCE_RECONCILE_INTERVAL = env.float('BALANCE_RECONCILE_INTERVAL', 600.0)
+
+# --- FSM storage ---
+FSM_STORAGE = env.str('FSM_STORAGE', 'postgres')  # postgres | memory (локальный запуск без БД)
+FSM_TTL = env.int('FSM_TTL', 7 * 24 * 3600)  # сек. после последнего изменения, затем сессия удаляется
+FSM_CLEANUP_INTERVAL = env.int('FSM_CLEANUP_INTERVAL', 3600)
+
+# --- Режим работы: polling или webhook ---
+BOT_MODE = env.str('BOT_MODE', 'polling')
+WEBHOOK_HOST = env.str('WEBHOOK_HOST', '')  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = env.str('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = env.str('WEBHOOK_SECRET', '')  # проверяется по заголовку X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = env.int('WEBHOOK_MAX_CONNECTIONS', 40)
+WEBAPP_HOST = env.str('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = env.int('WEBAPP_PORT', 8080)
+# Без публичного https-адреса Telegram не примет вебхук — падаем сразу, а не после старта
+if BOT_MODE == 'webhook' and not WEBHOOK_HOST.startswith('https://'):
+    raise ValueError("BOT_MODE=webhook requires WEBHOOK_HOST with the public https:// address of the bot")
+
+# --- Рассылки ---
+BROADCAST_RATE = env.float('BROADCAST_RATE', 20.0)  # сообщений в секунду, остаток общего лимита — ответам пользователям
+BROADCAST_CONCURRENCY = env.int('BROADCAST_CONCURRENCY', 10)
+BROADCAST_MAX_ATTEMPTS = env.int('BROADCAST_MAX_ATTEMPTS', 3)
+
+# --- Исходящие сообщения ---
+SEND_GLOBAL_RATE = env.float('SEND_GLOBAL_RATE', 30.0)  # сообщений в секунду на весь бот
+SEND_CHAT_RATE = env.float('SEND_CHAT_RATE', 1.0)  # сообщений в секунду в один чат
+SEND_CHAT_BURST = env.int('SEND_CHAT_BURST', 3)  # сколько сообщений в чат можно отправить подряд без паузы
+
+# --- Логи и метрики ---
+LOG_LEVEL = env.str('LOG_LEVEL', 'INFO').upper()  # DEBUG включает подробные логи сохранения операций
+# По умолчанию /metrics выключен; 9100 занят node_exporter, берите, например, 9108
+METRICS_HOST = env.str('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = env.int('METRICS_PORT', 0)  # 0 — не поднимать /metrics
+
+# --- Антифлуд (скользящие окна) ---
+THROTTLE_USER_CALLS = env.int('THROTTLE_USER_CALLS', 20)  # апдейтов от одного пользователя за окно
+THROTTLE_USER_WINDOW = env.float('THROTTLE_USER_WINDOW', 10.0)
+THROTTLE_HANDLER_CALLS = env.int('THROTTLE_HANDLER_CALLS', 3)  # вызовов одного хендлера за окно (если нет @rate_limit)
+THROTTLE_HANDLER_WINDOW = env.float('THROTTLE_HANDLER_WINDOW', 1.0)
+THROTTLE_MAX_BUCKETS = env.int('THROTTLE_MAX_BUCKETS', 10000)  # окон в памяти, старые вытесняются
+
+# --- Безопасность (SecurityMiddleware) ---
+SECURITY_ENABLED = env.bool('SECURITY_ENABLED', False)
+AUTO_LEAVE_GROUPS = env.bool('AUTO_LEAVE_GROUPS', False)  # выходить из неавторизованных групп
+SECURITY_REFRESH_INTERVAL = env.float('SECURITY_REFRESH_INTERVAL', 300.0)  # сек. между перечитываниями снимка доступа
+SECURITY_NEGATIVE_TTL = env.float('SECURITY_NEGATIVE_TTL', 60.0)  # сек. помнить, что группа не авторизована
+
+# --- Поддержка ---
+# id операторов через запятую; пусто — поддержка выключена. С поддержкой бот работает одним процессом
+SUPPORT_IDS = env.list('SUPPORT_IDS', ADMINS, subcast=int)
+SUPPORT_CLAIM_TIMEOUT = env.float('SUPPORT_CLAIM_TIMEOUT', 300.0)  # сек. держать оператора за пользователем до начала сессии
+SUPPORT_WAIT_TIMEOUT = env.float('SUPPORT_WAIT_TIMEOUT', 600.0)  # сек. пользователь ждёт свободного оператора в очереди
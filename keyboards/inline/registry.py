@@ -0,0 +1,43 @@
+import asyncio
+
+
+class KeyboardRegistry:
+    """
+    Готовые InlineKeyboardMarkup, собранные один раз и хранящиеся в памяти.
+
+    Клавиатура пересобирается только после invalidate() — его вызывают
+    админ-команды, которые меняют данные, из которых она строится.
+    Сборка, начатая до последнего invalidate(), в кэш не попадает.
+    """
+
+    def __init__(self):
+        self._builders = {}
+        self._markups = {}
+        self._locks = {}
+        self._generations = {}  # name -> число invalidate()
+
+    def register(self, name, builder):
+        """builder — корутина без аргументов, возвращающая InlineKeyboardMarkup"""
+        self._builders[name] = builder
+        self.invalidate(name)
+
+    async def get(self, name):
+        markup = self._markups.get(name)
+        if markup is not None:
+            return markup
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            # Пока ждали, другой запрос мог уже собрать клавиатуру
+            markup = self._markups.get(name)
+            if markup is None:
+                generation = self._generations.get(name, 0)
+                markup = await self._builders[name]()
+                # Если пока собирали был invalidate() — клавиатура уже устарела, не кэшируем
+                if generation == self._generations.get(name, 0):
+                    self._markups[name] = markup
+            return markup
+
+    def invalidate(self, *names):
+        for name in names or list(self._builders):
+            self._generations[name] = self._generations.get(name, 0) + 1
+            self._markups.pop(name, None)
@@ -1,10 +1,17 @@
 from aiogram import Dispatcher
 
-from loader import dp
+from data import config
 from .throttling import ThrottlingMiddleware
 from .support_middleware import SupportMiddleware
 
 
-if __name__ == "middlewares":
-    dp.middleware.setup(ThrottlingMiddleware())
-    dp.middleware.setup(SupportMiddleware())
+def setup(dp: Dispatcher, sender):
+    dp.middleware.setup(ThrottlingMiddleware(
+        user_calls=config.THROTTLE_USER_CALLS, user_window=config.THROTTLE_USER_WINDOW,
+        handler_calls=config.THROTTLE_HANDLER_CALLS, handler_window=config.THROTTLE_HANDLER_WINDOW,
+        max_buckets=config.THROTTLE_MAX_BUCKETS))
+    if config.SECURITY_ENABLED:
+        from tgbotmuvofiqiyat.middlewares.security_middleware import SecurityMiddleware
+        dp.middleware.setup(SecurityMiddleware())
+    # Пересылка сообщений в открытых сессиях поддержки (/support в bot.py)
+    dp.middleware.setup(SupportMiddleware(sender))
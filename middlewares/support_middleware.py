@@ -1,10 +1,8 @@
-import logging
-
 from aiogram import types
 from aiogram.dispatcher.handler import CancelHandler
 from aiogram.dispatcher.middlewares import BaseMiddleware
 
-from loader import dp
+from utils.misc.support_sessions import support_sessions
 
 
 # Создадим миддлварь, в котором полностью будет  проходить обработка сообщений
@@ -12,19 +10,20 @@ from loader import dp
 # Отсюда сообщения в хендлеры даже направляться не будут
 class SupportMiddleware(BaseMiddleware):
 
-    async def on_pre_process_message(self, message: types.Message, data: dict):
-        # Для начала достанем состояние текущего пользователя,
-        # так как state: FSMContext нам сюда не прилетит
-        state = dp.current_state(chat=message.from_user.id, user=message.from_user.id)
+    def __init__(self, sender, sessions=support_sessions):
+        super().__init__()
+        self.sender = sender
+        self.sessions = sessions
 
-        # Получим строчное значение стейта и сравним его
-        state_str = str(await state.get_state())
-        if state_str == "in_support":
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        # Собеседника ищем в индексе сессий, а не в FSM-хранилище:
+        # для всех, кто не на связи с поддержкой, это просто промах по словарю
+        second_id = self.sessions.peer(message.from_user.id)
+        if second_id is None:
+            return
 
-            # Заберем айди второго пользователя и отправим ему сообщение
-            data = await state.get_data()
-            second_id = data.get("second_id")
-            await message.copy_to(second_id)
+        # Через общий планировщик: лимиты Bot API и повтор после flood wait, как у остальных отправок
+        await self.sender.submit(second_id, lambda: message.copy_to(second_id))
 
-            # Не пропустим дальше обработку в хендлеры
-            raise CancelHandler()
+        # Не пропустим дальше обработку в хендлеры
+        raise CancelHandler()
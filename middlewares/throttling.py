@@ -1,44 +1,109 @@
-import asyncio
+import time
+from collections import OrderedDict, deque
 
-from aiogram import types, Dispatcher
-from aiogram.dispatcher import DEFAULT_RATE_LIMIT
+from aiogram import types
 from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.utils.exceptions import Throttled
 
-from db import db
-from translation import _
+from utils.misc.metrics import registry
+
+THROTTLED_TEXT = "Juda ko'p so'rovlar!"
+
+throttled_total = registry.counter('bot_throttled_total', 'Updates dropped by the rate limiter', ('key',))
+
+
+class SlidingWindowBuckets:
+    """
+    Скользящие окна по ключам: не больше calls событий за последние window секунд.
+
+    Для каждого ключа хранятся только времена последних calls событий, а самих
+    ключей — не больше maxsize: давно не использованные вытесняются (LRU),
+    так что память не растёт с числом пользователей.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> [deque времён, уведомлён ли пользователь в этом окне]
+
+    def hit(self, key, calls, window):
+        """
+        Учитывает событие. Возвращает None, если оно укладывается в лимит,
+        иначе True для первого отказа в окне (пора предупредить пользователя) и False для остальных.
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket[0].maxlen != calls:
+            bucket = self._buckets[key] = [deque(maxlen=calls), False]
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        times = bucket[0]
+        while times and times[0] <= now - window:
+            times.popleft()
+        if len(times) < calls:
+            times.append(now)
+            bucket[1] = False
+            return None
+        first, bucket[1] = not bucket[1], True
+        return first
+
+    def __len__(self):
+        return len(self._buckets)
 
 
 class ThrottlingMiddleware(BaseMiddleware):
     """
-    Simple middleware
+    Ограничение частоты запросов от одного пользователя.
+
+    Действуют два окна: общее на пользователя (все сообщения и нажатия)
+    и отдельное на пару пользователь + хендлер. Лимит хендлера задаётся
+    декоратором utils.misc.rate_limit, остальные хендлеры получают лимит
+    по умолчанию. Лишние апдейты до хендлера не доходят, а пользователь
+    один раз за окно получает предупреждение.
     """
 
-    def __init__(self, limit=DEFAULT_RATE_LIMIT, key_prefix='antiflood_'):
-        self.rate_limit = limit
+    def __init__(self, user_calls=20, user_window=10.0, handler_calls=3, handler_window=1.0,
+                 max_buckets=10000, key_prefix='antiflood'):
+        super().__init__()
+        self.user_calls = user_calls
+        self.user_window = user_window
+        self.handler_calls = handler_calls
+        self.handler_window = handler_window
         self.prefix = key_prefix
-        super(ThrottlingMiddleware, self).__init__()
+        self.buckets = SlidingWindowBuckets(max_buckets)
+
+    def _check(self, user_id):
+        """None — пропустить апдейт, иначе (key, нужно ли предупредить)"""
+        first = self.buckets.hit((user_id, self.prefix), self.user_calls, self.user_window)
+        if first is not None:
+            return self.prefix, first
+        handler = current_handler.get(None)
+        if handler is None:
+            return None
+        key = getattr(handler, 'throttling_key', handler.__name__)
+        calls = getattr(handler, 'throttling_calls', self.handler_calls)
+        window = getattr(handler, 'throttling_rate_limit', self.handler_window)
+        first = self.buckets.hit((user_id, key), calls, window)
+        if first is not None:
+            return key, first
+        return None
 
     async def on_process_message(self, message: types.Message, data: dict):
-        handler = current_handler.get()
-        dispatcher = Dispatcher.get_current()
-        if handler:
-            limit = getattr(handler, "throttling_rate_limit", self.rate_limit)
-            key = getattr(handler, "throttling_key", f"{self.prefix}_{handler.__name__}")
-        else:
-            limit = self.rate_limit
-            key = f"{self.prefix}_message"
-        try:
-            await dispatcher.throttle(key, rate=limit)
-        except Throttled as t:
-            await self.message_throttled(message, t)
+        throttled = self._check(message.from_user.id)
+        if throttled is not None:
+            key, first = throttled
+            throttled_total.inc(key)
+            if first:
+                await message.reply(THROTTLED_TEXT)
             raise CancelHandler()
 
-    async def message_throttled(self, message: types.Message, throttled: Throttled):
-        if throttled.exceeded_count <= 2:
-            try:
-                lang = db.get_lang(message.from_user.id)
-                await message.reply(_("Juda ko'p so'rovlar!",lang))
-            except Exception as ex:
-                await message.reply("Juda ko'p so'rovlar!")
\ No newline at end of file
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        throttled = self._check(call.from_user.id)
+        if throttled is not None:
+            key, first = throttled
+            throttled_total.inc(key)
+            # Отвечаем на каждый отброшенный callback, иначе у кнопки крутятся часики;
+            # текст — только при первом отказе в окне
+            await call.answer(THROTTLED_TEXT if first else None)
+            raise CancelHandler()
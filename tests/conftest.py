@@ -0,0 +1,56 @@
+import os
+import time
+
+import pytest
+
+# Окружение для импорта bot.py без Telegram и Postgres: токен поддельный,
+# FSM в памяти, /metrics не поднимается. SecurityMiddleware включён,
+# чтобы тесты проходили через него так же, как в бою.
+os.environ.setdefault('BOT_TOKEN', '123456:TEST-FAKE-TOKEN')
+os.environ.setdefault('FSM_STORAGE', 'memory')
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('SECURITY_ENABLED', 'true')
+
+
+@pytest.fixture
+def bot_module(monkeypatch):
+    import bot as bot_module
+    from utils.db_api.security_db import access_control
+
+    statuses = {}
+
+    # Вместо Postgres — статусы пользователей в словаре
+    async def get_user_status(user_id):
+        return statuses.get(user_id)
+
+    async def get_user_name(user_id):
+        return None
+
+    async def register_user(user_id, name, phone):
+        statuses[user_id] = 'pending'
+        access_control.user_status_changed(user_id, 'pending')
+
+    async def load_snapshot():
+        access_control._approved = frozenset(user_id for user_id, status in statuses.items() if status == 'approved')
+        access_control._groups = frozenset()
+        access_control._loaded_at = time.monotonic()
+
+    monkeypatch.setattr(bot_module, 'get_user_status', get_user_status)
+    monkeypatch.setattr(bot_module, 'get_user_name', get_user_name)
+    monkeypatch.setattr(bot_module, 'register_user', register_user)
+    monkeypatch.setattr(access_control, 'load', load_snapshot)
+    monkeypatch.setattr(access_control, '_loaded_at', None)
+    monkeypatch.setattr(bot_module, 'statuses', statuses, raising=False)
+    return bot_module
+
+
+@pytest.fixture
+def api(bot_module, monkeypatch):
+    from aiogram import Bot, Dispatcher
+    from benchmarks.harness import FakeBotAPI
+
+    api = FakeBotAPI()
+    monkeypatch.setattr(bot_module.bot, 'request', api.request)
+    Bot.set_current(bot_module.bot)
+    Dispatcher.set_current(bot_module.dp)
+    return api
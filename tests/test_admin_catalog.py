@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from benchmarks.harness import UpdateFactory
+from data.catalogs import DEFAULT_CATEGORIES
+from data.config import ADMINS
+
+ADMIN_ID = ADMINS[0]
+
+
+class FakeCatalogDB:
+    """Таблица categories в памяти: id -> name"""
+
+    def __init__(self, names):
+        self.rows = dict(enumerate(names, 1))
+        self.queries = []
+
+    async def fetch(self, query, *args):
+        return [{'id': item_id, 'name': name} for item_id, name in sorted(self.rows.items())]
+
+    async def execute(self, query, *args):
+        self.queries.append((query, args))
+        if query.startswith('UPDATE categories'):
+            self.rows[args[1]] = args[0]
+        elif query.startswith('DELETE FROM categories'):
+            del self.rows[args[0]]
+
+
+@pytest.fixture
+def catalog(bot_module, monkeypatch):
+    fake = FakeCatalogDB(DEFAULT_CATEGORIES)
+    monkeypatch.setattr(bot_module, 'db', fake)
+    monkeypatch.setattr(bot_module.categories_index, 'db', fake)
+    bot_module.categories_changed()
+    bot_module.statuses[ADMIN_ID] = 'approved'
+    yield fake
+    bot_module.categories_changed()
+
+
+def run(bot_module, api, steps):
+    updates = UpdateFactory()
+
+    async def feed(update):
+        await bot_module.dp.process_updates([update])
+
+    async def press(data):
+        message, buttons = api.find_button(ADMIN_ID, data, exact=True)
+        assert buttons, f'no {data} button'
+        await feed(updates.callback(ADMIN_ID, message, data))
+
+    async def send(text):
+        await feed(updates.message(ADMIN_ID, text=text))
+
+    asyncio.run(steps(send, press))
+
+
+def test_admin_buttons_use_ids(bot_module, api, catalog):
+    item_id = DEFAULT_CATEGORIES.index('Аренда техника и инструменты') + 1
+
+    async def steps(send, press):
+        await send('/edit_category')
+        buttons = [button['callback_data'] for row in api.chats[ADMIN_ID][-1]['reply_markup']['inline_keyboard']
+                   for button in row]
+        assert len(buttons) == len(DEFAULT_CATEGORIES)
+        assert max(len(data.encode()) for data in buttons) <= 64
+        _, name, stamp = (await bot_module.categories_index.items())[item_id - 1]
+        await press(bot_module.edit_category_cb.new(id=item_id, v=stamp))
+        await send('Аренда техники')
+
+    run(bot_module, api, steps)
+    assert catalog.queries == [('UPDATE categories SET name=$1 WHERE id=$2', ('Аренда техники', item_id))]
+    assert catalog.rows[item_id] == 'Аренда техники'
+
+
+def test_stale_admin_button_is_refused(bot_module, api, catalog):
+    async def steps(send, press):
+        await send('/del_category')
+        _, name, stamp = (await bot_module.categories_index.items())[0]
+        # Пока админ выбирал, категорию переименовали
+        catalog.rows[1] = 'Мижозлардан тушум'
+        bot_module.categories_changed()
+        await press(bot_module.del_category_cb.new(id=1, v=stamp))
+
+    run(bot_module, api, steps)
+    assert catalog.queries == []
+    assert api.calls['answerCallbackQuery'] == 1
+    assert api.calls['editMessageReplyMarkup'] == 1
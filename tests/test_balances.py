@@ -0,0 +1,90 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from utils.db_api.balances import RunningBalances, format_amount, parse_sheet_number
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1 234 567', Decimal('1234567')),
+    ('$1,234.50', Decimal('1234.50')),
+    ('-12,5', Decimal('-12.5')),
+    ('1.234.567,89', Decimal('1234567.89')),
+    ('1,234,567', Decimal('1234567')),
+    ('1 234,50 so\'m', Decimal('1234.50')),
+    ('0', Decimal('0')),
+])
+def test_parse_sheet_number(text, expected):
+    assert parse_sheet_number(text) == expected
+
+
+@pytest.mark.parametrize('text', ['#REF!', '#N/A', 'Loading...', '', None, '12abc34'])
+def test_parse_sheet_number_rejects_garbage(text):
+    with pytest.raises(ValueError):
+        parse_sheet_number(text)
+
+
+@pytest.mark.parametrize('amount, expected', [
+    (Decimal('1234567'), '1 234 567'),
+    (Decimal('1234.50'), '1 234.50'),
+    (Decimal('0.125'), '0.125'),
+    (Decimal('-1000.0001'), '-1 000.0001'),
+])
+def test_format_amount_keeps_all_digits(amount, expected):
+    assert format_amount(amount) == expected
+
+
+class FakeSheetBalances:
+    def __init__(self, values):
+        self.values = values
+
+    async def get(self):
+        return self.values
+
+
+class FakeDB:
+    def __init__(self):
+        self.writes = 0
+
+    async def fetch(self, query, *args):
+        return []
+
+    async def fetchval(self, query, *args):
+        return 0
+
+    def transaction(self):
+        self.writes += 1
+        raise AssertionError('balances must not be written')
+
+
+def test_bad_sheet_read_does_not_overwrite_balances():
+    db = FakeDB()
+    balances = RunningBalances(db)
+    with pytest.raises(ValueError):
+        asyncio.run(balances.seed_if_empty(FakeSheetBalances(('#REF!', '1 000'))))
+    with pytest.raises(ValueError):
+        asyncio.run(balances.reset_from_sheet(FakeSheetBalances(('100', 'Loading...'))))
+    assert db.writes == 0
+
+
+def test_drift_is_reported_once_per_change_and_when_cleared(monkeypatch):
+    dollar = {'Dollar': (Decimal('100'), Decimal('90'))}
+    both = {**dollar, 'Sum': (Decimal('5'), Decimal('0'))}
+    checks = [{}, dollar, dollar, dollar, dollar, both, both, both, {}, {}, dollar]
+    reported = []
+    balances = RunningBalances(FakeDB())
+
+    async def reconcile(sheet_balances):
+        if not checks:
+            raise asyncio.CancelledError
+        return checks.pop(0)
+
+    async def on_drift(drift):
+        reported.append(drift)
+
+    monkeypatch.setattr(balances, 'reconcile', reconcile)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(balances._reconcile_loop(None, 0, on_drift))
+    # Последнее расхождение видели только одну проверку — о нём ещё не сообщаем
+    assert reported == [dollar, both, {}]
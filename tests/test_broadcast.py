@@ -0,0 +1,68 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from aiogram.utils.exceptions import BadRequest, RetryAfter
+
+from utils.broadcast import Broadcaster
+
+
+class FakeDB:
+    def __init__(self):
+        self.attempts = 0
+        self.status = 'pending'
+
+    async def fetchval(self, query, *args):
+        self.attempts += 1
+        return self.attempts
+
+    async def execute(self, query, *args):
+        if "status='failed'" in query:
+            self.status = 'failed'
+        elif "status='sent'" in query:
+            self.status = 'sent'
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield self
+
+
+class FakeSender:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def send_message(self, chat_id, text, retry_flood=True):
+        assert retry_flood is False
+        self.calls.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def test_failed_send_is_retried_after_a_pause():
+    db = FakeDB()
+    sender = FakeSender([BadRequest('boom'), BadRequest('boom')])
+    broadcaster = Broadcaster(db, sender, rate=1000, max_attempts=3, retry_base=0.1)
+    asyncio.run(broadcaster._deliver(1, 42, 'salom'))
+    assert db.status == 'sent'
+    assert sender.calls[1] - sender.calls[0] >= 0.1
+    assert sender.calls[2] - sender.calls[1] >= 0.2
+
+
+def test_failed_send_gives_up_after_max_attempts():
+    db = FakeDB()
+    sender = FakeSender([BadRequest('boom')] * 3)
+    broadcaster = Broadcaster(db, sender, rate=1000, max_attempts=2, retry_base=0.01)
+    asyncio.run(broadcaster._deliver(1, 42, 'salom'))
+    assert db.status == 'failed'
+    assert len(sender.calls) == 2
+
+
+def test_retry_after_pauses_the_broadcast():
+    db = FakeDB()
+    sender = FakeSender([RetryAfter(1)])
+    broadcaster = Broadcaster(db, sender, rate=1000)
+    asyncio.run(broadcaster._deliver(1, 42, 'salom'))
+    assert db.status == 'sent'
+    assert db.attempts == 0
+    assert sender.calls[1] - sender.calls[0] >= 1
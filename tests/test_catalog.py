@@ -0,0 +1,47 @@
+import asyncio
+
+from utils.db_api.catalog import CatalogIndex, name_stamp
+
+
+class FakeDB:
+    def __init__(self, names):
+        self.names = names
+        self.reads = 0
+        self.release = None
+
+    async def fetch(self, query, *args):
+        self.reads += 1
+        rows = [{'id': item_id, 'name': name} for item_id, name in enumerate(self.names, 1)]
+        if self.release is not None:
+            await self.release.wait()
+        return rows
+
+
+def test_index_is_read_once():
+    async def scenario():
+        db = FakeDB(['Oziq-ovqat', 'Transport'])
+        index = CatalogIndex(db, 'categories')
+        await asyncio.gather(*(index.items() for _ in range(5)))
+        assert db.reads == 1
+        assert await index.resolve(2, name_stamp('Transport')) == 'Transport'
+        assert await index.resolve(2, name_stamp('Taksi')) is None
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_during_load_discards_stale_index():
+    async def scenario():
+        db = FakeDB(['Oziq-ovqat'])
+        db.release = asyncio.Event()
+        index = CatalogIndex(db, 'categories')
+        loading = asyncio.ensure_future(index.items())
+        await asyncio.sleep(0)
+        # Категорию переименовали, пока индекс читался по старым данным
+        db.names = ['Ovqat']
+        index.invalidate()
+        db.release.set()
+        assert [name for _, name, _ in await loading] == ['Oziq-ovqat']
+        assert [name for _, name, _ in await index.items()] == ['Ovqat']
+        assert db.reads == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.exceptions import BadRequest
+
+from benchmarks.harness import FakeBotAPI
+
+
+def keyboard(callback_data):
+    return InlineKeyboardMarkup().add(InlineKeyboardButton('x', callback_data=callback_data)).as_json()
+
+
+def test_fake_api_rejects_long_callback_data():
+    api = FakeBotAPI()
+
+    async def scenario():
+        message = await api.request('sendMessage', {'chat_id': 1, 'text': 'ok',
+                                                    'reply_markup': keyboard('edit_category_1')})
+        # 67 байт, как у кнопки с названием категории вместо id
+        with pytest.raises(BadRequest):
+            await api.request('sendMessage', {'chat_id': 1, 'text': 'x',
+                                              'reply_markup': keyboard('edit_category_Аренда техника и инструменты')})
+        with pytest.raises(BadRequest):
+            await api.request('editMessageReplyMarkup', {'chat_id': 1, 'message_id': message['message_id'],
+                                                         'reply_markup': keyboard('d' * 65)})
+        # Отклонённая правка не меняет сообщение
+        assert api.find_button(1, 'edit_category_1', exact=True)[1]
+
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+import asyncio
+
+from keyboards.inline.registry import KeyboardRegistry
+
+
+def test_markup_is_built_once():
+    builds = []
+
+    async def build():
+        builds.append(1)
+        return f'markup {len(builds)}'
+
+    async def scenario():
+        registry = KeyboardRegistry()
+        registry.register('categories', build)
+        assert await asyncio.gather(*(registry.get('categories') for _ in range(5))) == ['markup 1'] * 5
+        registry.invalidate('categories')
+        assert await registry.get('categories') == 'markup 2'
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_during_build_discards_stale_markup():
+    source = {'name': 'old'}
+    release = None
+
+    async def build():
+        name = source['name']
+        await release.wait()
+        return name
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        registry = KeyboardRegistry()
+        registry.register('categories', build)
+        building = asyncio.ensure_future(registry.get('categories'))
+        await asyncio.sleep(0)
+        # Админ поменял справочник, пока клавиатура собиралась по старым данным
+        source['name'] = 'new'
+        registry.invalidate()
+        release.set()
+        assert await building == 'old'
+        assert await registry.get('categories') == 'new'
+
+    asyncio.run(scenario())
@@ -0,0 +1,65 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from utils.db_api.postgres import Database, db_op
+from utils.misc.metrics import InstrumentedBot, db_seconds, telegram_errors, telegram_seconds
+
+
+def count(histogram, label):
+    return histogram.snapshot().get((label,), (0, 0))[0]
+
+
+class FakeConn:
+    async def fetchval(self, query, *args):
+        return 1
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = Database()
+
+    @asynccontextmanager
+    async def acquire():
+        yield FakeConn()
+    monkeypatch.setattr(database, 'acquire', acquire)
+    return database
+
+
+def test_db_query_is_labelled_by_helper(database):
+    @db_op
+    async def get_user_status(user_id):
+        return await database.fetchval('SELECT status FROM users WHERE user_id=$1', user_id)
+
+    before = count(db_seconds, 'test_db_query_is_labelled_by_helper.<locals>.get_user_status')
+    fetchval_before = count(db_seconds, 'fetchval')
+    asyncio.run(get_user_status(1))
+    assert count(db_seconds, 'test_db_query_is_labelled_by_helper.<locals>.get_user_status') == before + 1
+    # Без хелпера — метка по методу asyncpg, как раньше
+    asyncio.run(database.fetchval('SELECT 1'))
+    assert count(db_seconds, 'fetchval') == fetchval_before + 1
+
+
+def test_every_bot_api_call_is_timed(monkeypatch):
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method == 'answerCallbackQuery':
+            raise RetryAfter(1)
+        return True
+    monkeypatch.setattr(Bot, 'request', request)
+    bot = InstrumentedBot(token=os.environ['BOT_TOKEN'])
+
+    async def scenario():
+        await bot.request('editMessageText', {'chat_id': 1, 'message_id': 1, 'text': 'x'})
+        with pytest.raises(RetryAfter):
+            await bot.request('answerCallbackQuery', {'callback_query_id': '1'})
+
+    edits = count(telegram_seconds, 'editMessageText')
+    answers = count(telegram_seconds, 'answerCallbackQuery')
+    asyncio.run(scenario())
+    assert count(telegram_seconds, 'editMessageText') == edits + 1
+    assert count(telegram_seconds, 'answerCallbackQuery') == answers + 1
+    assert telegram_errors._values[('answerCallbackQuery', 'RetryAfter')] >= 1
@@ -0,0 +1,117 @@
+import asyncio
+
+from utils.misc.operator_pool import OperatorPool
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_claim_takes_longest_idle_operator():
+    async def scenario():
+        pool = OperatorPool([1, 2, 3], claim_timeout=None)
+        assert [pool.claim(10), pool.claim(11)] == [1, 2]
+        pool.release(1)
+        # 3 свободен дольше, чем только что освободившийся 1
+        assert pool.claim(12) == 3
+        assert pool.claim(13) == 1
+        assert pool.claim(14) is None
+        assert pool.operator_of(13) == 1 and pool.user_of(1) == 13
+    run(scenario())
+
+
+def test_release_is_idempotent():
+    async def scenario():
+        pool = OperatorPool([1, 2], claim_timeout=None)
+        pool.claim(10)
+        pool.release(1)
+        pool.release(1)
+        assert pool.free == 2 and pool.busy == 0
+        assert pool.operator_of(10) is None
+    run(scenario())
+
+
+def test_released_operator_goes_to_first_waiter():
+    async def scenario():
+        pool = OperatorPool([1], claim_timeout=None)
+        pool.claim(10)
+        first = asyncio.ensure_future(pool.wait(20))
+        second = asyncio.ensure_future(pool.wait(21))
+        await asyncio.sleep(0)
+        assert (pool.position(20), pool.position(21), pool.waiting) == (1, 2, 2)
+        pool.release(1)
+        assert await first == 1
+        assert pool.operator_of(20) == 1 and pool.free == 0
+        assert pool.position(21) == 1
+        pool.release(1)
+        assert await second == 1
+    run(scenario())
+
+
+def test_waiter_cannot_jump_the_queue():
+    async def scenario():
+        pool = OperatorPool([1], claim_timeout=None)
+        pool.claim(10)
+        assert pool.enqueue(20) == 1
+        assert pool.enqueue(21) == 2
+        pool.release(1)
+        # Оператор уже закреплён за первым в очереди, второй продолжает ждать
+        assert pool.operator_of(20) == 1
+        assert await pool.wait(20) == 1
+        assert await pool.wait(21, timeout=0.01) is None
+    run(scenario())
+
+
+def test_wait_timeout_leaves_queue():
+    async def scenario():
+        pool = OperatorPool([1], claim_timeout=None)
+        pool.claim(10)
+        assert await pool.wait(20, timeout=0.01) is None
+        assert pool.waiting == 0 and pool.position(20) is None
+        pool.release(1)
+        # Истёкшее ожидание пропускается, оператор возвращается в пул
+        assert pool.is_free(1)
+    run(scenario())
+
+
+def test_cancelled_wait_passes_operator_on():
+    async def scenario():
+        pool = OperatorPool([1], claim_timeout=None)
+        pool.claim(10)
+        pool.enqueue(20)
+        pool.enqueue(21)
+        pool.release(1)  # достался 20, но тот отменяет ожидание
+        pool.cancel_wait(20)
+        assert pool.operator_of(21) == 1
+        assert await pool.wait(21) == 1
+    run(scenario())
+
+
+def test_unconfirmed_claim_expires():
+    expired = []
+
+    async def scenario():
+        pool = OperatorPool([1], claim_timeout=0.01, on_expire=lambda op, user: expired.append((op, user)))
+        pool.claim(10)
+        await asyncio.sleep(0.03)
+        assert pool.is_free(1)
+        assert expired == [(1, 10)]
+
+        pool.claim(11)
+        pool.confirm(1)
+        await asyncio.sleep(0.03)
+        assert pool.user_of(1) == 11
+    run(scenario())
+
+
+def test_removed_operator_is_not_handed_out():
+    async def scenario():
+        pool = OperatorPool([1, 2], claim_timeout=None)
+        pool.claim(10)
+        pool.remove_operator(1)
+        pool.release(1)
+        assert not pool.is_free(1)
+        assert pool.claim(11) == 2
+        pool.add_operator(1)
+        assert pool.is_free(1)
+    run(scenario())
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+from utils.sheets import QuotaExceeded, SheetsOutbox
+
+
+class FakeOutboxDB:
+    """Таблица sheet_outbox в памяти; захват и снятие захвата разбираются по тексту запроса"""
+
+    def __init__(self, count):
+        self.rows = {outbox_id: {'id': outbox_id, 'row': json.dumps([outbox_id]), 'status': 'pending',
+                                 'attempts': 0, 'locked': False, 'last_error': None}
+                     for outbox_id in range(1, count + 1)}
+
+    async def fetch(self, query, *args):
+        if 'RETURNING id, row, attempts' in query:
+            limit = args[0]
+            claimed = [row for row in self.rows.values() if row['status'] == 'pending' and not row['locked']]
+            claimed = sorted(claimed, key=lambda row: row['id'])[:limit]
+            for row in claimed:
+                row['locked'] = True
+            return [dict(row) for row in claimed]
+        ids, error, give_up, max_attempts = args
+        for outbox_id in ids:
+            row = self.rows[outbox_id]
+            row.update(attempts=row['attempts'] + 1, last_error=error, locked=False)
+            if give_up and row['attempts'] >= max_attempts:
+                row['status'] = 'failed'
+        return [{'id': outbox_id, 'status': self.rows[outbox_id]['status']} for outbox_id in ids]
+
+    async def execute(self, query, *args):
+        if query.startswith("UPDATE sheet_outbox SET status='pending'"):
+            failed = [row for row in self.rows.values() if row['status'] == 'failed']
+            for row in failed:
+                row.update(status='pending', attempts=0, locked=False)
+            return f'UPDATE {len(failed)}'
+        for outbox_id in args[0]:
+            self.rows[outbox_id]['locked'] = False
+
+    async def executemany(self, query, args):
+        for outbox_id, sheet_row in args:
+            self.rows[outbox_id].update(status='sent', attempts=self.rows[outbox_id]['attempts'] + 1,
+                                        locked=False)
+
+
+class FakeWriter:
+    """Пишет строки в «лист»; строки из broken отвергает, как лист с ошибкой валидации"""
+
+    def __init__(self, broken=(), error=ValueError):
+        self.broken = set(broken)
+        self.error = error
+        self.written = []
+
+    async def append(self, row):
+        if row[0] in self.broken:
+            raise self.error(f'row {row[0]} rejected')
+        self.written.append(row[0])
+        return len(self.written)
+
+
+async def drain(outbox, rounds=20):
+    """Гоняет deliver_pending, как воркер, пока очередь не опустеет; ошибки глотает, как _run"""
+    for _ in range(rounds):
+        try:
+            if not await outbox.deliver_pending():
+                return
+        except Exception:
+            pass
+
+
+def test_poison_row_is_failed_and_the_rest_are_delivered():
+    db = FakeOutboxDB(5)
+    writer = FakeWriter(broken={2})
+    alerts = []
+    outbox = SheetsOutbox(db, writer, batch_size=10, max_attempts=3,
+                          on_failed=lambda outbox_id, error: alerts.append(outbox_id))
+    asyncio.run(drain(outbox))
+    assert db.rows[2]['status'] == 'failed'
+    assert db.rows[2]['attempts'] == 3
+    assert db.rows[2]['last_error'] == 'row 2 rejected'
+    assert alerts == [2]
+    # Строки за сломанной доставлены, по порядку id
+    assert [row['status'] for outbox_id, row in db.rows.items() if outbox_id != 2] == ['sent'] * 4
+    assert writer.written == [1, 3, 4, 5]
+
+
+def test_transient_errors_never_fail_a_row():
+    db = FakeOutboxDB(2)
+    outbox = SheetsOutbox(db, FakeWriter(broken={1, 2}, error=QuotaExceeded), max_attempts=2,
+                          on_failed=lambda *args: pytest.fail('transient error must not fail a row'))
+    asyncio.run(drain(outbox))
+    assert [row['status'] for row in db.rows.values()] == ['pending', 'pending']
+    assert db.rows[1]['attempts'] > 2
+
+
+def test_failed_rows_can_be_requeued():
+    db = FakeOutboxDB(1)
+    writer = FakeWriter(broken={1})
+    outbox = SheetsOutbox(db, writer, max_attempts=1)
+    asyncio.run(drain(outbox))
+    assert db.rows[1]['status'] == 'failed'
+    writer.broken.clear()
+    assert asyncio.run(outbox.requeue_failed()) == 1
+    asyncio.run(drain(outbox))
+    assert db.rows[1]['status'] == 'sent'
+    assert writer.written == [1]
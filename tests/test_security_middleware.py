@@ -0,0 +1,39 @@
+import asyncio
+
+from benchmarks.harness import UpdateFactory
+
+USER_ID = 700001
+
+
+def test_security_middleware_is_registered(bot_module):
+    from tgbotmuvofiqiyat.middlewares.security_middleware import SecurityMiddleware
+    assert any(isinstance(m, SecurityMiddleware) for m in bot_module.dp.middleware.applications)
+
+
+def test_unapproved_user_can_register(bot_module, api):
+    updates = UpdateFactory()
+
+    def texts():
+        return [message['text'] for message in api.chats[USER_ID]]
+
+    async def scenario():
+        dp = bot_module.dp
+        try:
+            await dp.process_updates([updates.message(USER_ID, text='/start')])
+            assert texts()[-1] == 'Ismingizni kiriting:'
+
+            await dp.process_updates([updates.message(USER_ID, text='Ali')])
+            assert texts()[-1] == 'Telefon raqamingizni yuboring:'
+
+            await dp.process_updates([updates.message(USER_ID, contact='+998901234567')])
+            assert texts()[-1].startswith('⏳ Arizangiz adminga yuborildi')
+            assert bot_module.statuses[USER_ID] == 'pending'
+            assert not any('Доступ запрещён' in text for text in texts())
+
+            # Вне регистрации неодобренного пользователя middleware по-прежнему не пускает
+            await dp.process_updates([updates.message(USER_ID, text='salom')])
+            assert 'Доступ запрещён' in texts()[-1]
+        finally:
+            await bot_module.sender.close()
+
+    asyncio.run(scenario())
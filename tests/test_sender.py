@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+from utils.sender import MessageScheduler
+
+
+def test_chat_limiter_survives_drained_queue():
+    async def scenario():
+        sender = MessageScheduler(bot=None, global_rate=1000, chat_rate=1.0, chat_burst=2)
+
+        async def send():
+            return True
+
+        await asyncio.gather(sender.submit(1, send), sender.submit(1, send))
+        assert 1 not in sender._queues
+        limiter = sender._chat_limiters.get(1)
+        assert limiter is not None
+
+        # Всплеск исчерпан: следующая пачка в тот же чат ждёт токен, а не получает новый bucket
+        started = time.monotonic()
+        await sender.submit(1, send)
+        assert time.monotonic() - started >= 0.5
+        assert sender._chat_limiters.get(1) is limiter
+
+    asyncio.run(scenario())
+
+
+def test_chat_limiters_are_bounded():
+    async def scenario():
+        sender = MessageScheduler(bot=None, global_rate=1000, chat_rate=100, chat_burst=10,
+                                  max_chat_limiters=3)
+
+        async def send():
+            return True
+
+        await asyncio.gather(*(sender.submit(chat_id, send) for chat_id in range(10)))
+        assert len(sender._chat_limiters) == 3
+
+    asyncio.run(scenario())
+
+
+def flaky(timeout, failures=1):
+    calls = []
+
+    async def send():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise RetryAfter(timeout)
+        return True
+    return send, calls
+
+
+def test_retry_after_in_one_chat_keeps_global_limiter():
+    async def scenario():
+        sender = MessageScheduler(bot=None, global_rate=1000, chat_rate=100, chat_burst=10)
+        send, calls = flaky(1)
+        future = sender.submit(1, send)
+        await asyncio.sleep(0.05)
+
+        async def other():
+            return time.monotonic()
+
+        # Чужой чат не ждёт паузы первого
+        sent_at = await sender.submit(2, other)
+        assert sent_at - calls[0] < 0.5
+        assert await future is True
+        assert calls[1] - calls[0] >= 1
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_in_several_chats_pauses_global_limiter():
+    async def scenario():
+        sender = MessageScheduler(bot=None, global_rate=1000, chat_rate=100, chat_burst=10)
+        first, first_calls = flaky(1)
+        second, second_calls = flaky(1)
+        futures = [sender.submit(1, first), sender.submit(2, second)]
+        await asyncio.sleep(0.05)
+
+        async def third():
+            return time.monotonic()
+
+        # Два чата подряд упёрлись в RetryAfter — пауза общая для всех чатов
+        sent_at = await sender.submit(3, third)
+        assert sent_at - second_calls[0] >= 1
+        assert await asyncio.gather(*futures) == [True, True]
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_is_passed_through_when_asked():
+    async def scenario():
+        sender = MessageScheduler(bot=None, global_rate=1000, chat_rate=100, chat_burst=10)
+        send, calls = flaky(5)
+        with pytest.raises(RetryAfter):
+            await sender.submit(1, send, retry_flood=False)
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
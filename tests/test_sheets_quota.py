@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from utils.sheets import QuotaExceeded, SheetsQuota
+from utils.sheets import quota as quota_module
+from utils.sheets.quota import WINDOW
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(quota_module.time, 'monotonic', clock)
+    return clock
+
+
+def test_rate_limited_pauses_and_halves_limits(clock):
+    quota = SheetsQuota(reads_per_minute=60, writes_per_minute=40)
+    quota.on_rate_limited()
+    usage = quota.usage()
+    assert usage['paused_for'] == 2
+    assert usage['read']['limit'] == 30 and usage['write']['limit'] == 20
+    # Подряд идущие 429 удваивают паузу, Retry-After от Google важнее своей оценки
+    quota.on_rate_limited()
+    assert quota.usage()['paused_for'] == 4
+    quota.on_rate_limited(retry_after=30)
+    assert quota.usage()['paused_for'] == 30
+    assert quota.rate_limited == 3
+
+
+def test_backoff_is_capped_and_limits_have_a_floor(clock):
+    quota = SheetsQuota(reads_per_minute=60, max_backoff=8, min_scale=0.1)
+    for _ in range(10):
+        quota.on_rate_limited()
+    assert quota.usage()['paused_for'] == 8
+    assert quota.scale == 0.1
+    assert quota.usage()['read']['limit'] == 6
+
+
+def test_limits_recover_after_successes(clock):
+    quota = SheetsQuota(reads_per_minute=60, recovery_step=0.25)
+    quota.on_rate_limited()
+    quota.on_rate_limited()
+    assert quota.scale == 0.25
+    quota.on_success()
+    assert quota.scale == 0.5
+    # Успех сбрасывает серию 429: следующая пауза снова начинается с 2 секунд
+    quota.on_rate_limited()
+    assert quota.usage()['paused_for'] == 4  # прежняя пауза ещё не истекла
+    clock.now += 4
+    quota.on_success()
+    quota.on_rate_limited()
+    assert quota.usage()['paused_for'] == 2
+    for _ in range(10):
+        quota.on_success()
+    assert quota.scale == 1.0
+
+
+def test_calls_wait_for_the_pause():
+    quota = SheetsQuota(max_wait=5)
+    quota.on_rate_limited(retry_after=0.2)
+    started = time.monotonic()
+    quota.acquire('write')
+    assert time.monotonic() - started >= 0.2
+
+
+def test_reads_yield_to_waiting_writes():
+    quota = SheetsQuota(reads_per_minute=60, writes_per_minute=1, max_wait=5)
+    # Минутный слот записи освободится через 0.3 с
+    quota._calls['write'].append(time.monotonic() - WINDOW + 0.3)
+    order = []
+
+    def call(kind, priority=False):
+        quota.acquire(kind, priority)
+        order.append((kind, priority))
+
+    writer = threading.Thread(target=call, args=('write',))
+    writer.start()
+    time.sleep(0.05)
+    assert quota.usage()['write']['waiting'] == 1
+    # Чтение остатков ждёт, пока запись стоит в очереди, а служебное чтение — нет
+    reader = threading.Thread(target=call, args=('read',))
+    reader.start()
+    call('read', priority=True)
+    writer.join()
+    reader.join()
+    assert order == [('read', True), ('write', False), ('read', False)]
+
+
+def test_no_slot_within_deadline_fails_fast():
+    quota = SheetsQuota(reads_per_minute=1, max_wait=10)
+    quota.acquire('read')
+    started = time.monotonic()
+    # Слот освободится только через минуту — ждать max_wait бессмысленно
+    with pytest.raises(QuotaExceeded):
+        quota.acquire('read')
+    assert time.monotonic() - started < 1
+
+
+def test_pause_longer_than_deadline_fails_fast():
+    quota = SheetsQuota(max_wait=0.5)
+    quota.on_rate_limited(retry_after=30)
+    with pytest.raises(QuotaExceeded):
+        quota.acquire('write')
@@ -0,0 +1,47 @@
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from utils.sheets import SheetsSession
+
+
+class BlockingQuota:
+    """Квота, которая держит вызывающий поток, пока тест не отпустит"""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def acquire(self, kind, priority=False):
+        self.entered.set()
+        assert self.release.wait(5)
+
+
+class FakeSpreadsheet:
+    def worksheet(self, name):
+        return f'worksheet {name}'
+
+
+def open_session(quota):
+    session = SheetsSession('credentials.json', 'sheet-id', 'Kirim/chiqim', scopes=[], quota=quota)
+    session._creds = SimpleNamespace(valid=True, expiry=datetime.utcnow() + timedelta(hours=1))
+    session._spreadsheet = FakeSpreadsheet()
+    session._worksheets = {'Kirim/chiqim': 'worksheet Kirim/chiqim'}
+    return session
+
+
+def test_waiting_for_quota_does_not_hold_the_session_lock():
+    quota = BlockingQuota()
+    session = open_session(quota)
+    opened = []
+    opener = threading.Thread(target=lambda: opened.append(session.worksheet('Hisobot')))
+    opener.start()
+    assert quota.entered.wait(5)
+    # Один поток ждёт квоту на новый лист — уже открытый лист доступен без ожидания
+    done = threading.Event()
+    threading.Thread(target=lambda: (session.worksheet(), done.set())).start()
+    assert done.wait(1)
+    quota.release.set()
+    opener.join()
+    assert opened == ['worksheet Hisobot']
+    assert session.worksheet('Hisobot') == 'worksheet Hisobot'
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from benchmarks.harness import UpdateFactory
+from data.config import ADMINS
+from utils.misc.operator_pool import OperatorPool
+
+USER_ID = 700101
+OTHER_ID = 700102
+OPERATOR_ID = ADMINS[0]
+
+
+@pytest.fixture
+def pool(bot_module, monkeypatch):
+    import keyboards.inline.support as support_keyboards
+
+    pool = OperatorPool([OPERATOR_ID], claim_timeout=None)
+    monkeypatch.setattr(bot_module, 'operator_pool', pool)
+    monkeypatch.setattr(support_keyboards, 'operator_pool', pool)
+    monkeypatch.setattr(bot_module.support_sessions, 'pool', pool)
+    monkeypatch.setattr(bot_module.support_sessions, '_peers', {})
+    bot_module.statuses.update({USER_ID: 'approved', OTHER_ID: 'approved', OPERATOR_ID: 'approved'})
+    return pool
+
+
+def test_support_session_relays_messages(bot_module, api, pool):
+    updates = UpdateFactory()
+    dp = bot_module.dp
+    sessions = bot_module.support_sessions
+
+    async def feed(update):
+        await dp.process_updates([update])
+        # Уведомления второй стороне уходят через очередь отправки
+        await bot_module.sender.close()
+
+    async def press(user_id, prefix):
+        message, buttons = api.find_button(user_id, prefix)
+        assert buttons, f'no {prefix} button for {user_id}'
+        await feed(updates.callback(user_id, message, buttons[0]['callback_data']))
+
+    async def scenario():
+        await feed(updates.message(USER_ID, text='/support'))
+        assert pool.operator_of(USER_ID) == OPERATOR_ID
+
+        await press(OPERATOR_ID, 'ask_support')
+        assert sessions.peer(USER_ID) == OPERATOR_ID
+        assert sessions.peer(OPERATOR_ID) == USER_ID
+
+        await feed(updates.message(USER_ID, text='salom'))
+        await feed(updates.message(OPERATOR_ID, text='salom, qanday yordam kerak?'))
+        assert api.calls['copyMessage'] == 2
+
+        # Оператор занят: второй пользователь встаёт в очередь, его сообщения не пересылаются
+        await feed(updates.message(OTHER_ID, text='/support'))
+        assert "navbatdasiz: 1-o'rin" in api.chats[OTHER_ID][-1]['text']
+        assert pool.position(OTHER_ID) == 1
+        assert api.calls['copyMessage'] == 2
+
+        await press(USER_ID, 'cancel_support')
+        assert USER_ID not in sessions and OPERATOR_ID not in sessions
+        state = dp.current_state(chat=USER_ID, user=USER_ID)
+        assert await state.get_state() is None
+
+        # Освободившийся оператор сразу достаётся первому в очереди и получает его запрос
+        assert pool.operator_of(OTHER_ID) == OPERATOR_ID
+        await asyncio.sleep(0)
+        await bot_module.sender.close()
+        message, buttons = api.find_button(OPERATOR_ID, 'ask_support')
+        assert buttons[0]['callback_data'] == f'ask_support:{OTHER_ID}'
+
+        await feed(updates.message(USER_ID, text='rahmat'))
+        assert api.calls['copyMessage'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_operator_can_decline(bot_module, api, pool):
+    updates = UpdateFactory()
+
+    async def scenario():
+        await bot_module.dp.process_updates([updates.message(USER_ID, text='/support')])
+        await bot_module.sender.close()
+        message, buttons = api.find_button(OPERATOR_ID, 'cancel_support')
+        await bot_module.dp.process_updates([updates.callback(OPERATOR_ID, message, buttons[0]['callback_data'])])
+        await bot_module.sender.close()
+        assert pool.is_free(OPERATOR_ID)
+        assert pool.operator_of(USER_ID) is None
+        assert USER_ID not in bot_module.support_sessions
+
+    asyncio.run(scenario())
+
+
+def test_process_without_operators_does_not_queue(bot_module, api, pool, monkeypatch):
+    empty = OperatorPool([], claim_timeout=None)
+    monkeypatch.setattr(bot_module, 'operator_pool', empty)
+    updates = UpdateFactory()
+
+    async def scenario():
+        await bot_module.dp.process_updates([updates.message(USER_ID, text='/support')])
+        await bot_module.sender.close()
+        assert "ishlamayapti" in api.chats[USER_ID][-1]['text']
+        assert empty.position(USER_ID) is None
+        assert not bot_module.support_waits
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from utils.db_api.postgres import Database
+from utils.misc.support_sessions import SUPPORT_LOCK, SupportAlreadyRunning, claim_support_process
+
+
+class FakeServer:
+    """Advisory-блокировки сервера Postgres, общие для всех процессов"""
+
+    def __init__(self):
+        self.locks = {}
+
+
+class FakeConn:
+    def __init__(self, server, pid):
+        self.server = server
+        self.pid = pid
+
+    async def fetchval(self, query, key):
+        assert 'pg_try_advisory_lock' in query
+        return self.server.locks.setdefault(key, self.pid) == self.pid
+
+    async def execute(self, query, key):
+        assert 'pg_advisory_unlock' in query
+        if self.server.locks.get(key) == self.pid:
+            del self.server.locks[key]
+
+
+class FakePool:
+    def __init__(self, server, pid):
+        self.conn = FakeConn(server, pid)
+        self.released = 0
+
+    async def acquire(self, timeout=None):
+        return self.conn
+
+    async def release(self, conn):
+        self.released += 1
+
+
+def process(server, pid):
+    database = Database()
+    database.pool = FakePool(server, pid)
+    return database
+
+
+def test_second_process_with_support_refuses_to_start():
+    server = FakeServer()
+    first, second = process(server, 1), process(server, 2)
+
+    async def scenario():
+        await claim_support_process(first)
+        with pytest.raises(SupportAlreadyRunning):
+            await claim_support_process(second)
+        # Проигравший процесс соединение вернул, победитель держит своё
+        assert second.pool.released == 1
+        assert first.pool.released == 0
+        # После остановки первого процесса поддержку может взять другой
+        await first.release_lock(SUPPORT_LOCK)
+        await claim_support_process(second)
+
+    asyncio.run(scenario())
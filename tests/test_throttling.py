@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.dispatcher.handler import CancelHandler
+
+from middlewares import throttling
+from middlewares.throttling import SlidingWindowBuckets, ThrottlingMiddleware
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttling.time, 'monotonic', clock)
+    return clock
+
+
+def test_window_allows_calls_then_warns_once(clock):
+    buckets = SlidingWindowBuckets()
+    assert [buckets.hit('u', 3, 10.0) for _ in range(3)] == [None, None, None]
+    assert buckets.hit('u', 3, 10.0) is True
+    assert buckets.hit('u', 3, 10.0) is False
+
+
+def test_window_slides(clock):
+    buckets = SlidingWindowBuckets()
+    buckets.hit('u', 2, 10.0)
+    clock.now += 6
+    buckets.hit('u', 2, 10.0)
+    assert buckets.hit('u', 2, 10.0) is True
+    # Первое событие выпало из окна — место освободилось, и предупреждение снова разрешено
+    clock.now += 4.5
+    assert buckets.hit('u', 2, 10.0) is None
+    assert buckets.hit('u', 2, 10.0) is True
+
+
+def test_keys_are_lru_bounded(clock):
+    buckets = SlidingWindowBuckets(maxsize=2)
+    buckets.hit('a', 2, 10.0)
+    buckets.hit('b', 2, 10.0)
+    # Обращение к 'a' делает давно не использованным 'b'
+    buckets.hit('a', 2, 10.0)
+    buckets.hit('c', 2, 10.0)
+    assert list(buckets._buckets) == ['a', 'c']
+    # Окно 'a' сохранилось: третий вызов уже сверх лимита
+    assert buckets.hit('a', 2, 10.0) is True
+
+
+class FakeCall:
+    def __init__(self, user_id):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text=None, *args, **kwargs):
+        self.answers.append(text)
+
+
+def test_every_throttled_callback_is_answered(clock):
+    middleware = ThrottlingMiddleware(user_calls=1, user_window=10.0)
+    calls = [FakeCall(1) for _ in range(3)]
+
+    async def press(call):
+        try:
+            await middleware.on_process_callback_query(call, {})
+        except CancelHandler:
+            return False
+        return True
+
+    async def scenario():
+        return [await press(call) for call in calls]
+
+    assert asyncio.run(scenario()) == [True, False, False]
+    assert calls[0].answers == []
+    assert calls[1].answers == [throttling.THROTTLED_TEXT]
+    assert calls[2].answers == [None]
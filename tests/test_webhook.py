@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from data import config
+from utils.webhook import secret_matches
+
+
+def test_secret_matches(monkeypatch):
+    monkeypatch.setattr(config, 'WEBHOOK_SECRET', 's3cret')
+    assert secret_matches('s3cret')
+    assert not secret_matches('s3cre')
+    assert not secret_matches(None)
+    assert not secret_matches('сикрет')
+
+
+def import_config(**env):
+    return subprocess.run([sys.executable, '-c', 'import data.config'], env={**os.environ, **env},
+                          capture_output=True, text=True)
+
+
+@pytest.mark.parametrize('host', ['', 'bot.example.com'])
+def test_webhook_mode_needs_public_host(host):
+    result = import_config(BOT_MODE='webhook', WEBHOOK_HOST=host)
+    assert result.returncode != 0
+    assert 'WEBHOOK_HOST' in result.stderr
+
+
+def test_webhook_mode_with_host_starts():
+    assert import_config(BOT_MODE='webhook', WEBHOOK_HOST='https://bot.example.com').returncode == 0
@@ -5,6 +5,9 @@ from utils.db_api.security_db import check_user_access, check_group_access, is_a
 from utils.logger import log_security_event, log_group_event
 from data.config import SECURITY_ENABLED, AUTO_LEAVE_GROUPS
 
+# Состояния регистрации: их проходит ещё не одобренный пользователь
+REGISTRATION_STATES = {'register_name', 'register_phone'}
+
 class SecurityMiddleware(BaseMiddleware):
     """
     Middleware для проверки безопасности пользователей и групп
@@ -28,19 +31,24 @@ class SecurityMiddleware(BaseMiddleware):
         
         # Проверка в приватных чатах
         if chat_type == 'private':
-            await self._check_private_chat(message)
+            await self._check_private_chat(message, data)
         
         # Проверка в группах
         elif chat_type in ['group', 'supergroup']:
             await self._check_group_chat(message)
     
-    async def _check_private_chat(self, message: types.Message):
+    async def _check_private_chat(self, message: types.Message, data: dict):
         """Проверка доступа в приватном чате"""
         user_id = message.from_user.id
         
         # Разрешаем команду /start для незарегистрированных
         if message.text and message.text.startswith('/start'):
             return
+
+        # Имя и контакт при регистрации присылает ещё не одобренный пользователь.
+        # raw_state кладёт в data фильтр состояния хендлера — лишнего чтения FSM нет
+        if data.get('raw_state') in REGISTRATION_STATES:
+            return
         
         if not await check_user_access(user_id):
             log_security_event("ACCESS_DENIED", user_id, "Попытка использования бота без регистрации")
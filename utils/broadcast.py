@@ -0,0 +1,134 @@
+import asyncio
+import logging
+
+from aiogram.utils.exceptions import ChatNotFound, RetryAfter, Unauthorized
+
+from utils.db_api.postgres import db_op
+from utils.misc.token_bucket import TokenBucket
+
+
+class Broadcaster:
+    """
+    Фоновая рассылка сообщения всем одобренным пользователям.
+
+    Прогресс по каждому получателю хранится в broadcast_recipients, поэтому
+    после рестарта незаконченная рассылка продолжается с того же места.
+    Сообщения идут через общий MessageScheduler, а собственный token bucket
+    оставляет часть общего лимита для ответов пользователям.
+    RetryAfter планировщик не повторяет, а отдаёт сюда: на паузу встаёт вся
+    рассылка. Прочие ошибки повторяются с растущей паузой, а пользователи,
+    заблокировавшие бота, помечаются в users.bot_blocked_at и в следующие
+    рассылки не попадают.
+    """
+
+    def __init__(self, db, sender, rate=20, concurrency=10, max_attempts=3, batch_size=200,
+                 retry_base=2.0, retry_max=60.0):
+        self.db = db
+        self.sender = sender
+        self.limiter = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._tasks = {}
+
+    @db_op
+    async def start(self, kind, text):
+        """Запускает рассылку в фоне; незаконченная рассылка того же вида продолжается, а не дублируется"""
+        job_id = await self.db.fetchval(
+            "SELECT id FROM broadcast_jobs WHERE kind=$1 AND status='running' ORDER BY id LIMIT 1", kind)
+        if job_id is None:
+            async with self.db.transaction() as conn:
+                job_id = await conn.fetchval(
+                    "INSERT INTO broadcast_jobs (kind, text) VALUES ($1, $2) RETURNING id", kind, text)
+                await conn.execute(
+                    "INSERT INTO broadcast_recipients (job_id, user_id) "
+                    "SELECT $1, user_id FROM users WHERE status='approved' AND bot_blocked_at IS NULL", job_id)
+        self._spawn(job_id)
+        return job_id
+
+    @db_op
+    async def resume(self):
+        """Продолжает все незаконченные рассылки (вызывается при старте)"""
+        for row in await self.db.fetch("SELECT id FROM broadcast_jobs WHERE status='running'"):
+            self._spawn(row['id'])
+
+    def _spawn(self, job_id):
+        if job_id in self._tasks:
+            return
+        task = asyncio.ensure_future(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    @db_op
+    async def _run(self, job_id):
+        text = await self.db.fetchval('SELECT text FROM broadcast_jobs WHERE id=$1', job_id)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(user_id):
+            async with semaphore:
+                await self._deliver(job_id, user_id, text)
+
+        try:
+            while True:
+                rows = await self.db.fetch(
+                    "SELECT user_id FROM broadcast_recipients WHERE job_id=$1 AND status='pending' "
+                    "ORDER BY user_id LIMIT $2", job_id, self.batch_size)
+                if not rows:
+                    break
+                await asyncio.gather(*(deliver(row['user_id']) for row in rows))
+            await self.db.execute(
+                "UPDATE broadcast_jobs SET status='done', finished_at=now() WHERE id=$1", job_id)
+            stats = await self.db.fetch(
+                'SELECT status, COUNT(*) AS n FROM broadcast_recipients WHERE job_id=$1 GROUP BY status', job_id)
+            logging.info(f"Broadcast {job_id} finished: {dict((row['status'], row['n']) for row in stats)}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Broadcast {job_id} interrupted, will resume on next start: {e}")
+
+    @db_op
+    async def _deliver(self, job_id, user_id, text):
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.sender.send_message(user_id, text, retry_flood=False)
+            except RetryAfter as e:
+                # Telegram просит подождать — притормаживаем всю рассылку
+                self.limiter.pause(e.timeout)
+                continue
+            except (Unauthorized, ChatNotFound) as e:
+                async with self.db.transaction() as conn:
+                    await conn.execute(
+                        "UPDATE broadcast_recipients SET status='blocked', error=$3 WHERE job_id=$1 AND user_id=$2",
+                        job_id, user_id, str(e))
+                    await conn.execute('UPDATE users SET bot_blocked_at=now() WHERE user_id=$1', user_id)
+                return
+            except Exception as e:
+                attempts = await self.db.fetchval(
+                    "UPDATE broadcast_recipients SET attempts=attempts+1, error=$3 "
+                    "WHERE job_id=$1 AND user_id=$2 RETURNING attempts", job_id, user_id, str(e))
+                if attempts >= self.max_attempts:
+                    await self.db.execute(
+                        "UPDATE broadcast_recipients SET status='failed' WHERE job_id=$1 AND user_id=$2",
+                        job_id, user_id)
+                    return
+                await asyncio.sleep(min(self.retry_base * 2 ** (attempts - 1), self.retry_max))
+                continue
+            await self.db.execute(
+                "UPDATE broadcast_recipients SET status='sent', sent_at=now() WHERE job_id=$1 AND user_id=$2",
+                job_id, user_id)
+            return
+
+    @db_op
+    async def unblock(self, user_id):
+        """Пользователь снова написал боту — значит, больше не блокирует его"""
+        await self.db.execute(
+            'UPDATE users SET bot_blocked_at=NULL WHERE user_id=$1 AND bot_blocked_at IS NOT NULL', user_id)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import re
+from decimal import Decimal, InvalidOperation
+
+from utils.db_api.postgres import db_op
+
+
+CURRENCIES = ('Dollar', 'Sum')
+
+# Сумма ещё не доставленных в лист операций (в очереди или брошенных после ошибок):
+# их нет в C1/D1, но они уже есть в локальных остатках
+PENDING_DELTAS_SQL = '''
+    SELECT t.currency, SUM(CASE WHEN t.type = 'Kirim' THEN t.amount ELSE -t.amount END) AS delta
+    FROM transactions t JOIN sheet_outbox o USING (dedupe_key)
+    WHERE o.status IN ('pending', 'failed')
+    GROUP BY t.currency
+'''
+
+
+# Число в ячейке: цифры с разделителями разрядов и дробной части
+NUMBER_RE = re.compile(r"-?\d[\d\s\u00a0.,']*")
+
+
+def parse_sheet_number(text):
+    """
+    '1 234 567', '$1,234.50', '-12,5', '1.234.567,89' -> Decimal.
+
+    Всё, что не похоже на одно число (ошибки формул вроде '#REF!', 'Loading...',
+    пустая ячейка), — ValueError: такой ответ листа нельзя принимать за остаток.
+    """
+    text = str(text or '').strip()
+    numbers = NUMBER_RE.findall(text)
+    if text.startswith('#') or len(numbers) != 1:
+        raise ValueError(f"Not a number in the sheet: {text!r}")
+    cleaned = re.sub(r"[\s\u00a0']", '', numbers[0]).rstrip('.,')
+    if ',' in cleaned and '.' in cleaned:
+        # Дробный разделитель — последний из двух, другой разделяет разряды
+        thousands = ',' if cleaned.rfind('.') > cleaned.rfind(',') else '.'
+        cleaned = cleaned.replace(thousands, '').replace(',', '.')
+    elif re.fullmatch(r'-?\d+,\d{1,2}', cleaned):
+        cleaned = cleaned.replace(',', '.')
+    elif cleaned.count('.') > 1:
+        cleaned = cleaned.replace('.', '')
+    else:
+        cleaned = cleaned.replace(',', '')
+    try:
+        return Decimal(cleaned)
+    except InvalidOperation:
+        raise ValueError(f"Not a number in the sheet: {text!r}") from None
+
+
+def format_amount(amount):
+    if amount == amount.to_integral_value():
+        text = f"{amount:,.0f}"
+    else:
+        # Суммы хранятся без округления: показываем все знаки, но не меньше двух
+        digits = max(2, -amount.normalize().as_tuple().exponent)
+        text = f"{amount:,.{digits}f}"
+    return text.replace(',', ' ')
+
+
+class RunningBalances:
+    """
+    Остатки по валютам, которые бот ведёт сам в таблице balances.
+
+    Меняются в той же транзакции, что и запись в transactions, поэтому
+    сообщение об остатках не требует обращения к Google Sheets.
+    Периодическая сверка с C1/D1 листа сообщает о расхождениях.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._task = None
+
+    async def apply(self, conn, currency, delta):
+        """Атомарно прибавляет delta; вызывается внутри транзакции операции"""
+        await conn.execute(
+            'INSERT INTO balances (currency, amount) VALUES ($1, $2) '
+            'ON CONFLICT (currency) DO UPDATE SET amount = balances.amount + EXCLUDED.amount, updated_at = now()',
+            currency, delta)
+
+    @db_op
+    async def get(self):
+        rows = await self.db.fetch('SELECT currency, amount FROM balances')
+        result = {currency: Decimal('0') for currency in CURRENCIES}
+        result.update({row['currency']: row['amount'] for row in rows})
+        return result
+
+    @db_op
+    async def _expected_from_sheet(self, sheet_balances):
+        dollar_text, sum_text = await sheet_balances.get()
+        expected = {'Dollar': parse_sheet_number(dollar_text), 'Sum': parse_sheet_number(sum_text)}
+        for row in await self.db.fetch(PENDING_DELTAS_SQL):
+            expected[row['currency']] = expected.get(row['currency'], Decimal('0')) + row['delta']
+        return expected
+
+    @db_op
+    async def reset_from_sheet(self, sheet_balances):
+        """Берёт C1/D1 листа (плюс недоставленные операции) за текущие остатки"""
+        expected = await self._expected_from_sheet(sheet_balances)
+        async with self.db.transaction() as conn:
+            for currency, amount in expected.items():
+                await conn.execute(
+                    'INSERT INTO balances (currency, amount) VALUES ($1, $2) '
+                    'ON CONFLICT (currency) DO UPDATE SET amount = EXCLUDED.amount, updated_at = now()',
+                    currency, amount)
+        return expected
+
+    @db_op
+    async def seed_if_empty(self, sheet_balances):
+        if await self.db.fetchval('SELECT COUNT(*) FROM balances') == 0:
+            expected = await self.reset_from_sheet(sheet_balances)
+            logging.info(f"Running balances seeded from sheet: {expected}")
+
+    async def reconcile(self, sheet_balances):
+        """Возвращает {валюта: (локально, по листу)} для валют с расхождением"""
+        expected = await self._expected_from_sheet(sheet_balances)
+        local = await self.get()
+        return {
+            currency: (local.get(currency, Decimal('0')), amount)
+            for currency, amount in expected.items()
+            if local.get(currency, Decimal('0')) != amount
+        }
+
+    async def _reconcile_loop(self, sheet_balances, interval, on_drift):
+        """
+        Сверяет остатки каждые interval секунд.
+
+        on_drift(drift) вызывается только когда подтверждённое расхождение
+        меняется; когда оно исчезает — один раз on_drift({}).
+        """
+        previous = {}
+        reported = {}
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                drift = await self.reconcile(sheet_balances)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Balance reconciliation skipped: {e}")
+                continue
+            # Строка могла попасть в лист, но ещё не быть отмечена в outbox —
+            # сообщаем только о расхождении, которое повторилось две проверки подряд
+            if drift and drift == previous and drift != reported:
+                logging.warning(f"Balance drift detected: {drift}")
+                await on_drift(drift)
+                reported = drift
+            elif not drift and reported:
+                logging.info('Balance drift cleared')
+                await on_drift({})
+                reported = {}
+            previous = drift
+
+    def start_reconciliation(self, sheet_balances, interval, on_drift):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._reconcile_loop(sheet_balances, interval, on_drift))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
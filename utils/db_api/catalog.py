@@ -0,0 +1,95 @@
+import asyncio
+import zlib
+
+from utils.db_api.postgres import db_op
+
+
+def name_stamp(name):
+    """Короткая метка версии названия: меняется при переименовании записи"""
+    return format(zlib.crc32(name.encode('utf-8')) & 0xffffff, 'x')
+
+
+class CatalogIndex:
+    """
+    In-memory индекс id -> name для справочника (categories, pay_types).
+
+    В callback_data кладём id и метку версии названия, а не само название:
+    так кнопка укладывается в 64 байта Telegram, а устаревшая кнопка
+    (запись удалена или переименована) распознаётся, а не пишет в лист
+    чужое название.
+    """
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self._by_id = None
+        self._lock = asyncio.Lock()
+        self._generation = 0
+
+    @db_op
+    async def _ensure_loaded(self):
+        if self._by_id is not None:
+            return self._by_id
+        async with self._lock:
+            if self._by_id is not None:
+                return self._by_id
+            generation = self._generation
+            rows = await self.db.fetch(f'SELECT id, name FROM {self.table} ORDER BY id')
+            by_id = {row['id']: row['name'] for row in rows}
+            # Если пока читали был invalidate() — список уже устарел, не кэшируем
+            if generation == self._generation:
+                self._by_id = by_id
+            return by_id
+
+    async def items(self):
+        """[(id, name, stamp)] в порядке id"""
+        by_id = await self._ensure_loaded()
+        return [(item_id, name, name_stamp(name)) for item_id, name in by_id.items()]
+
+    async def resolve(self, item_id, stamp):
+        """Название по id, или None, если кнопка устарела"""
+        by_id = await self._ensure_loaded()
+        name = by_id.get(int(item_id))
+        if name is None or name_stamp(name) != stamp:
+            return None
+        return name
+
+    def invalidate(self):
+        self._generation += 1
+        self._by_id = None
+
+
+class CatalogSync:
+    """Результат синхронизации справочника: что добавлено и что удалено"""
+
+    def __init__(self, added, removed):
+        self.added = added
+        self.removed = removed
+
+    @property
+    def changed(self):
+        return bool(self.added or self.removed)
+
+    def summary(self):
+        lines = [f'➕ Добавлено: {len(self.added)}', f'➖ Удалено: {len(self.removed)}']
+        if self.added:
+            lines.append('\nДобавлены:\n' + '\n'.join(f'• {name}' for name in self.added))
+        if self.removed:
+            lines.append('\nУдалены:\n' + '\n'.join(f'• {name}' for name in self.removed))
+        return '\n'.join(lines)
+
+
+async def sync_catalog(conn, table, names):
+    """
+    Приводит справочник к списку names: удаляет лишние и добавляет недостающие
+    записи двумя запросами. Уже существующие записи не трогаются и сохраняют id.
+    Вызывать внутри транзакции.
+    """
+    names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+    removed = await conn.fetch(
+        f'DELETE FROM {table} WHERE name IS NULL OR name <> ALL($1::text[]) RETURNING name', names)
+    # WITH ORDINALITY — чтобы новые записи получили id в порядке списка
+    added = await conn.fetch(
+        f'INSERT INTO {table} (name) SELECT name FROM unnest($1::text[]) WITH ORDINALITY AS t(name, pos) '
+        f'ORDER BY pos ON CONFLICT (name) DO NOTHING RETURNING name', names)
+    return CatalogSync([row['name'] for row in added], [row['name'] for row in removed if row['name']])
@@ -0,0 +1,190 @@
+import asyncio
+import copy
+import json
+import logging
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.storage import BaseStorage
+
+from utils.db_api.postgres import db_op
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в таблице fsm_storage.
+
+    Переживает рестарт и позволяет запускать несколько процессов бота.
+    Изменения состояния и данных копятся в памяти и пишутся одним запросом
+    после обработки апдейта (см. FSMFlushMiddleware). Сессии, к которым
+    не обращались дольше ttl секунд, удаляются.
+    """
+
+    def __init__(self, db, ttl=7 * 24 * 3600, cleanup_interval=3600, flush_interval=1.0):
+        self.db = db
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.flush_interval = flush_interval
+        self._records = {}  # (chat, user) -> {'state', 'data', 'bucket'}
+        self._loading = {}  # (chat, user) -> future загрузки записи
+        self._dirty = set()
+        self._tasks = []
+
+    @staticmethod
+    def _key(chat, user):
+        return str(chat), str(user)
+
+    async def _get_record(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        key = self._key(chat, user)
+        record = self._records.get(key)
+        if record is not None:
+            return key, record
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key))
+            self._loading[key] = future
+            future.add_done_callback(lambda _: self._loading.pop(key, None))
+        record = await asyncio.shield(future)
+        return key, self._records.setdefault(key, record)
+
+    @db_op
+    async def _load(self, key):
+        row = await self.db.fetchrow(
+            'SELECT state, data, bucket FROM fsm_storage WHERE chat_id=$1 AND user_id=$2', *key)
+        if row is None:
+            return {'state': None, 'data': {}, 'bucket': {}}
+        return {'state': row['state'], 'data': json.loads(row['data']), 'bucket': json.loads(row['bucket'])}
+
+    def _touch(self, key):
+        self._dirty.add(key)
+
+    @db_op
+    async def flush(self):
+        """Пишет все изменённые сессии: одним upsert и одним delete для завершённых"""
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in dirty:
+            record = self._records.get(key)
+            if record is None:
+                continue
+            if record['state'] is None and not record['data'] and not record['bucket']:
+                deletes.append(key)
+            else:
+                upserts.append((*key, record['state'], json.dumps(record['data'], ensure_ascii=False, default=str),
+                                json.dumps(record['bucket'], ensure_ascii=False, default=str)))
+        try:
+            if upserts or deletes:
+                async with self.db.transaction() as conn:
+                    if upserts:
+                        await conn.executemany(
+                            'INSERT INTO fsm_storage (chat_id, user_id, state, data, bucket, updated_at) '
+                            'VALUES ($1, $2, $3, $4, $5, now()) '
+                            'ON CONFLICT (chat_id, user_id) DO UPDATE SET state=EXCLUDED.state, data=EXCLUDED.data, '
+                            'bucket=EXCLUDED.bucket, updated_at=now()', upserts)
+                    if deletes:
+                        await conn.executemany('DELETE FROM fsm_storage WHERE chat_id=$1 AND user_id=$2', deletes)
+        except Exception:
+            self._dirty |= dirty
+            raise
+        # Между апдейтами в памяти ничего не держим: другой процесс мог изменить сессию
+        for key in [key for key in self._records if key not in self._dirty]:
+            del self._records[key]
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        _, record = await self._get_record(chat, user)
+        return record['state'] or self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        _, record = await self._get_record(chat, user)
+        return copy.deepcopy(record['data'] or default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key, record = await self._get_record(chat, user)
+        record['state'] = self.resolve_state(state)
+        self._touch(key)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key, record = await self._get_record(chat, user)
+        record['data'] = copy.deepcopy(data or {})
+        self._touch(key)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key, record = await self._get_record(chat, user)
+        record['data'].update(data or {}, **kwargs)
+        self._touch(key)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        _, record = await self._get_record(chat, user)
+        return copy.deepcopy(record['bucket'] or default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key, record = await self._get_record(chat, user)
+        record['bucket'] = copy.deepcopy(bucket or {})
+        self._touch(key)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key, record = await self._get_record(chat, user)
+        record['bucket'].update(bucket or {}, **kwargs)
+        self._touch(key)
+
+    @db_op
+    async def find_state(self, state):
+        """Все сохранённые сессии в состоянии state: список пар (user_id, data)"""
+        rows = await self.db.fetch('SELECT user_id, data FROM fsm_storage WHERE state=$1', state)
+        return [(row['user_id'], json.loads(row['data'])) for row in rows]
+
+    @db_op
+    async def expire(self):
+        """Удаляет сессии, к которым не обращались дольше ttl"""
+        result = await self.db.execute(
+            'DELETE FROM fsm_storage WHERE updated_at < now() - make_interval(secs => $1)', float(self.ttl))
+        logging.info(f"FSM storage cleanup: {result}")
+
+    async def _periodic(self, interval, func):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"FSM storage {func.__name__} failed: {e}")
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                # Страховка для изменений, сделанных вне обработки апдейта
+                asyncio.ensure_future(self._periodic(self.flush_interval, self.flush)),
+                asyncio.ensure_future(self._periodic(self.cleanup_interval, self.expire)),
+            ]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Сохраняет изменения FSM одним запросом после обработки каждого апдейта"""
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+
+    async def on_post_process_update(self, update, result, data):
+        try:
+            await self.storage.flush()
+        except Exception as e:
+            logging.error(f"FSM storage flush failed, will retry: {e}")
@@ -0,0 +1,211 @@
+"""
+Версионированные миграции схемы PostgreSQL.
+
+Каждая миграция применяется один раз, в своей транзакции, и записывается
+в schema_migrations. Миграции запускаются явно:
+
+    python -m utils.db_api.migrations           # применить недостающие
+    python -m utils.db_api.migrations --status  # показать версию базы
+
+При старте бот только сверяет версию базы одним запросом (check_schema).
+"""
+import argparse
+import asyncio
+import logging
+
+import asyncpg
+
+from data.catalogs import DEFAULT_CATEGORIES, DEFAULT_PAY_TYPES
+from utils.db_api.catalog import sync_catalog
+
+# Любое число: общий ключ advisory-блокировки, чтобы два процесса не мигрировали одновременно
+MIGRATIONS_LOCK = 7214501
+
+
+class SchemaOutdated(Exception):
+    """Версия схемы в базе старше, чем нужна этому коду"""
+
+
+async def initial_schema(conn):
+    # IF NOT EXISTS: базы, созданные до миграций прежним init_db, принимаются как есть
+    await conn.execute('''CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT UNIQUE,
+        name TEXT,
+        phone TEXT,
+        status TEXT,
+        reg_date TEXT
+    )''')
+    await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS bot_blocked_at TIMESTAMPTZ')
+    await conn.execute('''CREATE TABLE IF NOT EXISTS pay_types (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE
+    )''')
+    await conn.execute('''CREATE TABLE IF NOT EXISTS categories (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE
+    )''')
+    await conn.execute('''CREATE TABLE IF NOT EXISTS fsm_storage (
+        chat_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        state TEXT,
+        data JSONB NOT NULL DEFAULT '{}',
+        bucket JSONB NOT NULL DEFAULT '{}',
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (chat_id, user_id)
+    )''')
+    await conn.execute('CREATE INDEX IF NOT EXISTS fsm_storage_updated_idx ON fsm_storage (updated_at)')
+    await conn.execute('''CREATE TABLE IF NOT EXISTS sheet_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        dedupe_key TEXT UNIQUE NOT NULL,
+        row JSONB NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INT NOT NULL DEFAULT 0,
+        last_error TEXT,
+        sheet_row INT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        sent_at TIMESTAMPTZ
+    )''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS sheet_outbox_pending_idx ON sheet_outbox (id) WHERE status = 'pending'")
+    await conn.execute('''CREATE TABLE IF NOT EXISTS transactions (
+        id BIGSERIAL PRIMARY KEY,
+        dedupe_key TEXT UNIQUE NOT NULL,
+        user_id BIGINT,
+        type TEXT NOT NULL,
+        category TEXT,
+        currency TEXT NOT NULL,
+        amount NUMERIC(20, 2) NOT NULL,
+        pay_type TEXT,
+        comment TEXT,
+        created_at TIMESTAMP NOT NULL
+    )''')
+    await conn.execute('CREATE INDEX IF NOT EXISTS transactions_date_idx ON transactions (created_at)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS transactions_category_date_idx ON transactions (category, created_at)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS transactions_user_date_idx ON transactions (user_id, created_at)')
+    await conn.execute('''CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        finished_at TIMESTAMPTZ
+    )''')
+    await conn.execute('''CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        job_id BIGINT NOT NULL REFERENCES broadcast_jobs (id) ON DELETE CASCADE,
+        user_id BIGINT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INT NOT NULL DEFAULT 0,
+        error TEXT,
+        sent_at TIMESTAMPTZ,
+        PRIMARY KEY (job_id, user_id)
+    )''')
+    await conn.execute('''CREATE TABLE IF NOT EXISTS balances (
+        currency TEXT PRIMARY KEY,
+        amount NUMERIC(20, 2) NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )''')
+
+
+async def seed_catalogs(conn):
+    # Только в пустые справочники: правки админов не перезаписываем
+    if not await conn.fetchval('SELECT EXISTS (SELECT 1 FROM pay_types)'):
+        await sync_catalog(conn, 'pay_types', DEFAULT_PAY_TYPES)
+    if not await conn.fetchval('SELECT EXISTS (SELECT 1 FROM categories)'):
+        await sync_catalog(conn, 'categories', DEFAULT_CATEGORIES)
+
+
+async def authorized_groups(conn):
+    await conn.execute('''CREATE TABLE IF NOT EXISTS authorized_groups (
+        chat_id BIGINT PRIMARY KEY,
+        title TEXT,
+        added_by BIGINT,
+        added_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )''')
+
+
+async def outbox_lease(conn):
+    # Захват строки воркером: несколько процессов не отправляют одну строку дважды
+    await conn.execute('ALTER TABLE sheet_outbox ADD COLUMN IF NOT EXISTS locked_until TIMESTAMPTZ')
+
+
+async def unscaled_amounts(conn):
+    # NUMERIC(20, 2) молча округлял суммы с тремя и более знаками после точки,
+    # а в лист уходит сумма как есть — остатки бота и листа расходились.
+    # Снятие ограничения масштаба не переписывает таблицу: старые значения уже точные.
+    await conn.execute('ALTER TABLE transactions ALTER COLUMN amount TYPE NUMERIC')
+    await conn.execute('ALTER TABLE balances ALTER COLUMN amount TYPE NUMERIC')
+
+
+# (версия, название, функция); новые миграции — только в конец, применённые не меняются
+MIGRATIONS = [
+    (1, 'initial schema', initial_schema),
+    (2, 'seed default catalogs', seed_catalogs),
+    (3, 'authorized groups', authorized_groups),
+    (4, 'outbox delivery lease', outbox_lease),
+    (5, 'unscaled amounts', unscaled_amounts),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def current_version(db):
+    """Версия схемы в базе; 0 — миграции ещё не запускались"""
+    try:
+        return await db.fetchval('SELECT max(version) FROM schema_migrations') or 0
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def check_schema(db):
+    """Проверка при старте: один запрос, без изменений в базе"""
+    version = await current_version(db)
+    if version < LATEST_VERSION:
+        raise SchemaOutdated(f"Database schema is at version {version}, code needs {LATEST_VERSION}. "
+                             f"Run: python -m utils.db_api.migrations")
+    if version > LATEST_VERSION:
+        logging.warning(f"Database schema version {version} is newer than this code ({LATEST_VERSION})")
+    return version
+
+
+async def migrate(db):
+    """Применяет недостающие миграции по порядку; возвращает список применённых версий"""
+    applied = []
+    async with db.transaction() as conn:
+        await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATIONS_LOCK)
+        await conn.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )''')
+    for version, name, apply in MIGRATIONS:
+        async with db.transaction() as conn:
+            await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATIONS_LOCK)
+            # Проверяем под блокировкой: параллельный запуск мог уже применить эту версию
+            if await conn.fetchval('SELECT 1 FROM schema_migrations WHERE version=$1', version):
+                continue
+            await apply(conn)
+            await conn.execute('INSERT INTO schema_migrations (version, name) VALUES ($1, $2)', version, name)
+        logging.info(f"Applied migration {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+async def main(args):
+    from utils.db_api.postgres import db
+    await db.create()
+    try:
+        if args.status:
+            print(f"Schema version: {await current_version(db)} (latest: {LATEST_VERSION})")
+            return
+        applied = await migrate(db)
+        if applied:
+            print(f"Applied migrations: {', '.join(map(str, applied))}")
+        print(f"Schema version: {await current_version(db)}")
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--status', action='store_true', help='только показать версию схемы')
+    asyncio.run(main(parser.parse_args()))
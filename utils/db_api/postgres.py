@@ -0,0 +1,169 @@
+import contextvars
+import functools
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from data import config
+from utils.misc.metrics import db_errors, db_seconds, track
+
+
+# Ошибки, после которых соединение считается «мёртвым»
+RETRYABLE_ERRORS = (
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    ConnectionError,
+    OSError,
+)
+
+# Хелпер, ради которого идёт запрос: метка op в bot_db_seconds/bot_db_errors
+_current_op = contextvars.ContextVar('db_op', default=None)
+
+
+def db_op(func):
+    """
+    Подписывает запросы внутри func её именем (get_user_status, BalanceCache.get, ...).
+    Без декоратора метка — метод asyncpg (fetch, execute, transaction).
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _current_op.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _current_op.reset(token)
+    return wrapper
+
+
+class Database:
+    """
+    Общий асинхронный пул соединений PostgreSQL (asyncpg).
+
+    Все запросы бота идут через один пул: соединения переиспользуются,
+    а ожидание ответа БД не блокирует event loop aiogram.
+    """
+
+    def __init__(self, min_size=config.DB_POOL_MIN_SIZE, max_size=config.DB_POOL_MAX_SIZE,
+                 acquire_timeout=config.DB_ACQUIRE_TIMEOUT, command_timeout=config.DB_COMMAND_TIMEOUT,
+                 health_check_interval=config.DB_HEALTH_CHECK_INTERVAL,
+                 max_inactive_lifetime=config.DB_MAX_INACTIVE_LIFETIME):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.command_timeout = command_timeout
+        self.health_check_interval = health_check_interval
+        self.max_inactive_lifetime = max_inactive_lifetime
+        self.pool = None
+        # pid серверного процесса -> время последнего возврата соединения в пул
+        self._last_used = {}
+        self._held_locks = {}  # ключ advisory-блокировки -> соединение, которое её держит
+
+    async def create(self):
+        if self.pool is not None:
+            return
+        self.pool = await asyncpg.create_pool(
+            database=config.POSTGRES_DB,
+            user=config.POSTGRES_USER,
+            password=config.POSTGRES_PASSWORD,
+            host=config.POSTGRES_HOST,
+            port=config.POSTGRES_PORT,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            command_timeout=self.command_timeout,
+            max_inactive_connection_lifetime=self.max_inactive_lifetime,
+            setup=self._health_check,
+        )
+        logging.info(f"DB pool created: min={self.min_size}, max={self.max_size}")
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self._last_used.clear()
+            self._held_locks.clear()
+
+    async def _health_check(self, conn):
+        # Пингуем только соединения, которые долго простаивали в пуле,
+        # чтобы не платить лишний round trip на каждом запросе.
+        pid = conn.get_server_pid()
+        last_used = self._last_used.get(pid)
+        if last_used is None or time.monotonic() - last_used > self.health_check_interval:
+            await conn.fetchval('SELECT 1', timeout=self.acquire_timeout)
+
+    async def _acquire_healthy(self):
+        # Одна повторная попытка, если проверка соединения не прошла (рестарт БД, сеть):
+        # asyncpg закрывает такое соединение, и следующее будет открыто заново.
+        for attempt in (1, 2):
+            try:
+                return await self.pool.acquire(timeout=self.acquire_timeout)
+            except RETRYABLE_ERRORS as e:
+                if attempt == 2:
+                    raise
+                logging.warning(f"DB connection health check failed, reconnecting: {e}")
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self.pool is None:
+            raise RuntimeError('Database pool is not created, call "await db.create()" first')
+        conn = await self._acquire_healthy()
+        try:
+            yield conn
+        finally:
+            self._last_used[conn.get_server_pid()] = time.monotonic()
+            await self.pool.release(conn)
+
+    async def try_hold_lock(self, key):
+        """
+        Берёт сессионную advisory-блокировку на отдельном соединении и держит её
+        до release_lock() или закрытия пула. False — блокировку держит другой процесс.
+        """
+        if self.pool is None:
+            raise RuntimeError('Database pool is not created, call "await db.create()" first')
+        conn = await self._acquire_healthy()
+        if await conn.fetchval('SELECT pg_try_advisory_lock($1)', key):
+            self._held_locks[key] = conn
+            return True
+        await self.pool.release(conn)
+        return False
+
+    async def release_lock(self, key):
+        conn = self._held_locks.pop(key, None)
+        if conn is not None:
+            try:
+                await conn.execute('SELECT pg_advisory_unlock($1)', key)
+            finally:
+                await self.pool.release(conn)
+
+    @asynccontextmanager
+    async def transaction(self):
+        with track(db_seconds, db_errors, _current_op.get() or 'transaction'):
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    yield conn
+
+    async def _run(self, method, query, *args):
+        with track(db_seconds, db_errors, _current_op.get() or method):
+            async with self.acquire() as conn:
+                return await getattr(conn, method)(query, *args)
+
+    async def execute(self, query, *args):
+        return await self._run('execute', query, *args)
+
+    async def executemany(self, query, args):
+        return await self._run('executemany', query, args)
+
+    async def fetch(self, query, *args):
+        return await self._run('fetch', query, *args)
+
+    async def fetchrow(self, query, *args):
+        return await self._run('fetchrow', query, *args)
+
+    async def fetchval(self, query, *args):
+        return await self._run('fetchval', query, *args)
+
+
+db = Database()
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+
+from data import config
+from utils.db_api.postgres import db, db_op
+from utils.misc.cache import TTLCache
+
+
+class AccessControl:
+    """
+    Проверки доступа для SecurityMiddleware без запроса к БД на каждый апдейт.
+
+    В памяти держится снимок: одобренные пользователи и авторизованные группы
+    (админы — из конфига). Одобрение, блокировка и авторизация группы сразу
+    меняют снимок (user_status_changed / group_*), а раз в refresh_interval
+    снимок перечитывается в фоне — чтобы увидеть изменения других процессов.
+    Группа, которой нет в снимке, один раз проверяется в БД, и отказ
+    запоминается на negative_ttl секунд.
+    """
+
+    def __init__(self, db, admins=(), refresh_interval=300.0, negative_ttl=60.0, negative_size=1000):
+        self.db = db
+        self.admins = frozenset(admins)
+        self.refresh_interval = refresh_interval
+        self._approved = frozenset()
+        self._groups = frozenset()
+        self._denied_groups = TTLCache(maxsize=negative_size, ttl=negative_ttl)
+        self._loaded_at = None
+        self._loading = None
+
+    @db_op
+    async def load(self):
+        users = await self.db.fetch("SELECT user_id FROM users WHERE status='approved'")
+        groups = await self.db.fetch('SELECT chat_id FROM authorized_groups')
+        # Наборы заменяются целиком: проверки никогда не видят наполовину загруженный снимок
+        self._approved = frozenset(row['user_id'] for row in users)
+        self._groups = frozenset(row['chat_id'] for row in groups)
+        self._denied_groups.clear()
+        self._loaded_at = time.monotonic()
+        logging.info(f"Access snapshot loaded: {len(self._approved)} users, {len(self._groups)} groups")
+
+    async def _reload(self):
+        try:
+            await self.load()
+        except Exception as e:
+            logging.error(f"Could not refresh access snapshot, keeping the old one: {e}")
+
+    async def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self.load() if self._loaded_at is None else self._reload())
+        if self._loaded_at is None:
+            # Первый раз ждём загрузки; дальше устаревший снимок обновляется в фоне
+            await asyncio.shield(self._loading)
+
+    async def is_admin(self, user_id):
+        return user_id in self.admins
+
+    async def check_user_access(self, user_id):
+        if user_id in self.admins:
+            return True
+        await self._ensure_loaded()
+        return user_id in self._approved
+
+    @db_op
+    async def check_group_access(self, chat_id):
+        await self._ensure_loaded()
+        if chat_id in self._groups:
+            return True
+        if chat_id in self._denied_groups:
+            return False
+        # Группу могли авторизовать в другом процессе уже после загрузки снимка
+        if await self.db.fetchval('SELECT 1 FROM authorized_groups WHERE chat_id=$1', chat_id):
+            self._groups = self._groups | {chat_id}
+            return True
+        self._denied_groups.set(chat_id, True)
+        return False
+
+    def user_status_changed(self, user_id, status):
+        if status == 'approved':
+            self._approved = self._approved | {user_id}
+        else:
+            self._approved = self._approved - {user_id}
+
+    def group_authorized(self, chat_id):
+        self._groups = self._groups | {chat_id}
+        self._denied_groups.invalidate(chat_id)
+
+    def group_revoked(self, chat_id):
+        self._groups = self._groups - {chat_id}
+
+
+access_control = AccessControl(db, admins=config.ADMINS, refresh_interval=config.SECURITY_REFRESH_INTERVAL,
+                               negative_ttl=config.SECURITY_NEGATIVE_TTL)
+
+
+async def is_admin(user_id):
+    return await access_control.is_admin(user_id)
+
+
+async def check_user_access(user_id):
+    return await access_control.check_user_access(user_id)
+
+
+async def check_group_access(chat_id):
+    return await access_control.check_group_access(chat_id)
@@ -0,0 +1,13 @@
+import logging
+
+security_logger = logging.getLogger('security')
+
+
+def log_security_event(event, user_id, details=''):
+    """Событие безопасности, связанное с пользователем (отказ в доступе и т.п.)"""
+    security_logger.warning('%s user=%s %s', event, user_id, details)
+
+
+def log_group_event(event, chat_id, details=''):
+    """Событие безопасности, связанное с группой"""
+    security_logger.warning('%s chat=%s %s', event, chat_id, details)
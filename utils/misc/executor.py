@@ -0,0 +1,45 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorBusy(Exception):
+    """Очередь пула переполнена, задача не принята"""
+
+
+class BoundedExecutor:
+    """
+    Отдельный пул потоков для блокирующего I/O (gspread и т.п.).
+
+    Одновременно выполняется не больше max_workers задач, ещё max_queue ждут
+    своей очереди; сверх этого run() сразу бросает ExecutorBusy, а не копит
+    бесконечную очередь. Event loop при этом не блокируется.
+    """
+
+    def __init__(self, max_workers=4, max_queue=50, name='executor'):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._semaphore = None
+        self.pending = 0  # выполняются + ждут в очереди
+
+    @property
+    def queued(self):
+        return max(0, self.pending - self.max_workers)
+
+    async def run(self, func, *args, **kwargs):
+        if self.pending >= self.max_workers + self.max_queue:
+            raise ExecutorBusy(f"{self.name}: queue is full ({self.pending} pending)")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
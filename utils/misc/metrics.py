@@ -0,0 +1,251 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from aiogram import Bot
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+
+# Границы корзин гистограмм в секундах: от быстрых запросов к БД до медленных вызовов Google
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    """Счётчик событий с метками"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Gauge:
+    """Текущее значение, которое читается функцией в момент запроса метрик"""
+
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def render(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge',
+                f'{self.name} {_format_value(self.func())}']
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с метками.
+
+    Кроме корзин Prometheus отдаёт оценку p50/p95/p99 (линейная интерполяция
+    внутри корзины) отдельной метрикой <name>_quantile — чтобы смотреть
+    перцентили без PromQL. Запись потокобезопасна: Sheets вызывается из потоков.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [counts по корзинам (+Inf последней), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self):
+        """{labels: (count, sum)} — для сравнения до/после (бенчмарки)"""
+        with self._lock:
+            return {labels: (total, total_sum) for labels, (_, total_sum, total) in self._series.items()}
+
+    def _quantile(self, counts, total, q):
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets + (float('inf'),), counts):
+            if count and cumulative + count >= rank:
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = upper
+        return lower
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        quantile_lines = [f'# HELP {self.name}_quantile Estimated p50/p95/p99 of {self.name}',
+                          f'# TYPE {self.name}_quantile gauge']
+        with self._lock:
+            series = sorted((labels, (list(counts), total_sum, total)) for labels, (counts, total_sum, total)
+                            in self._series.items())
+        for labels, (counts, total_sum, total) in series:
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [('le', _format_value(upper))])
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {_format_value(total_sum)}')
+            lines.append(f'{self.name}_count{label_str} {total}')
+            for q in QUANTILES:
+                q_labels = _format_labels(self.labelnames, labels, [('quantile', q)])
+                quantile_lines.append(f'{self.name}_quantile{q_labels} {_format_value(self._quantile(counts, total, q))}')
+        return lines + quantile_lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, func):
+        return self.register(Gauge(name, documentation, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram('bot_handler_seconds', 'Time spent in aiogram handlers', ('handler',))
+handler_errors = registry.counter('bot_handler_errors_total', 'Exceptions raised by aiogram handlers',
+                                  ('handler', 'error'))
+db_seconds = registry.histogram('bot_db_seconds', 'Postgres query time including pool acquire', ('op',))
+db_errors = registry.counter('bot_db_errors_total', 'Failed Postgres queries', ('op', 'error'))
+sheets_seconds = registry.histogram('bot_sheets_seconds', 'Google Sheets API call time', ('op',))
+sheets_errors = registry.counter('bot_sheets_errors_total', 'Failed Google Sheets API calls', ('op', 'error'))
+telegram_seconds = registry.histogram('bot_telegram_seconds', 'Bot API request time', ('method',))
+telegram_errors = registry.counter('bot_telegram_errors_total', 'Failed Bot API requests', ('method', 'error'))
+
+
+@contextmanager
+def track(histogram, errors, label):
+    """Пишет длительность блока в histogram, а исключение — в errors с его классом"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        errors.inc(label, type(e).__name__)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, label)
+
+
+# Хендлер, который сейчас обрабатывает апдейт (для учёта ошибок в errors_handler)
+_current_handler_name = contextvars.ContextVar('metrics_handler_name', default=None)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого хендлера сообщений и callback-запросов"""
+
+    def _start(self, data):
+        handler = current_handler.get()
+        name = getattr(handler, '__name__', 'unknown')
+        _current_handler_name.set(name)
+        data['_metrics_started'] = (name, time.perf_counter())
+
+    def _finish(self, data):
+        started = data.pop('_metrics_started', None)
+        if started is not None:
+            name, started_at = started
+            handler_seconds.observe(time.perf_counter() - started_at, name)
+
+    async def on_process_message(self, message, data):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        self._finish(data)
+
+    async def on_process_callback_query(self, call, data):
+        self._start(data)
+
+    async def on_post_process_callback_query(self, call, results, data):
+        self._finish(data)
+
+
+class InstrumentedBot(Bot):
+    """
+    Bot, который пишет время и ошибки каждого вызова Bot API в bot_telegram_seconds.
+    Через request() проходят все вызовы: очередь MessageScheduler, msg.answer(),
+    edit_text(), call.answer() — поэтому меряем здесь, а не в местах вызова.
+    """
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        with track(telegram_seconds, telegram_errors, method):
+            return await super().request(method, data, files, **kwargs)
+
+
+def record_handler_error(exception):
+    """Вызывается из errors_handler: относит исключение к хендлеру, в котором оно возникло"""
+    handler_errors.inc(_current_handler_name.get() or 'unknown', type(exception).__name__)
+
+
+async def _metrics_view(request):
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8',
+                        headers={'Cache-Control': 'no-cache'})
+
+
+async def start_metrics_server(host, port, path='/metrics'):
+    """Отдельный HTTP-сервер с метриками в формате Prometheus; возвращает runner для остановки"""
+    app = web.Application()
+    app.router.add_get(path, _metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
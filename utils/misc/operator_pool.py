@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from data import config
+
+
+class OperatorPool:
+    """
+    Пул операторов поддержки: кто свободен, кто занят и кто ждёт оператора.
+
+    Свободные операторы лежат в OrderedDict в порядке освобождения, поэтому
+    claim() за O(1) отдаёт того, кто дольше всех без пользователя, а release()
+    за O(1) возвращает оператора в конец. Между проверкой и захватом нет await,
+    так что двое пользователей, пришедших одновременно, не получат одного
+    оператора. Если свободных нет, пользователь может встать в очередь (wait()):
+    освободившийся оператор сразу передаётся первому из ждущих.
+    Захват, за которым за claim_timeout секунд не последовало confirm()
+    (пользователь не начал сессию), снимается, и оператор снова свободен;
+    on_expire(operator_id, user_id), если задан, сообщает об этом.
+
+    Пул живёт в памяти процесса: два процесса со своими пулами отдали бы
+    одного оператора двум пользователям. Поэтому поддержку обслуживает один
+    процесс (claim_support_process() при старте), а у остальных процессов
+    пул пуст (SUPPORT_IDS=) и /support в них не ставит в очередь.
+    """
+
+    def __init__(self, operator_ids=(), claim_timeout=300.0, on_expire=None):
+        self.claim_timeout = claim_timeout
+        self.on_expire = on_expire
+        self._operators = set(operator_ids)
+        self._free = OrderedDict.fromkeys(operator_ids)
+        self._busy = {}  # operator_id -> user_id
+        self._users = {}  # user_id -> operator_id, обратный индекс к _busy
+        self._timers = {}  # operator_id -> таймер неподтверждённого захвата
+        self._waiting = deque()  # (user_id, future) в порядке прихода
+        self._waiters = {}  # user_id -> future, для отмены за O(1)
+
+    @property
+    def free(self):
+        return len(self._free)
+
+    @property
+    def busy(self):
+        return len(self._busy)
+
+    @property
+    def waiting(self):
+        return sum(1 for future in self._waiters.values() if not future.done())
+
+    def __len__(self):
+        """Сколько операторов на смене"""
+        return len(self._operators)
+
+    def __contains__(self, operator_id):
+        return operator_id in self._operators
+
+    def is_free(self, operator_id):
+        return operator_id in self._free
+
+    def user_of(self, operator_id):
+        """За каким пользователем сейчас закреплён оператор"""
+        return self._busy.get(operator_id)
+
+    def operator_of(self, user_id):
+        """Какой оператор сейчас закреплён за пользователем"""
+        return self._users.get(user_id)
+
+    def peek(self):
+        """Кому написать разовое сообщение: дольше всех свободный оператор, без захвата"""
+        if self._free:
+            return next(iter(self._free))
+        return next(iter(self._operators), None)
+
+    def _assign(self, operator_id, user_id):
+        self._busy[operator_id] = user_id
+        self._users[user_id] = operator_id
+        if self.claim_timeout:
+            loop = asyncio.get_event_loop()
+            self._timers[operator_id] = loop.call_later(self.claim_timeout, self._expire, operator_id, user_id)
+        return operator_id
+
+    def _expire(self, operator_id, user_id):
+        self._timers.pop(operator_id, None)
+        if self._busy.get(operator_id) == user_id:
+            logging.info(f"Support claim of operator {operator_id} by {user_id} expired")
+            self.release(operator_id)
+            if self.on_expire is not None:
+                self.on_expire(operator_id, user_id)
+
+    def claim(self, user_id):
+        """Занимает свободного оператора для user_id; None — свободных нет"""
+        if not self._free:
+            return None
+        operator_id, _ = self._free.popitem(last=False)
+        return self._assign(operator_id, user_id)
+
+    def confirm(self, operator_id):
+        """Сессия началась: захват больше не истекает, оператор занят до release()"""
+        timer = self._timers.pop(operator_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def mark_busy(self, operator_id, user_id):
+        """Оператор уже в сессии (например, восстановленной после рестарта)"""
+        self._free.pop(operator_id, None)
+        if operator_id in self._operators:
+            self._busy[operator_id] = user_id
+            self._users[user_id] = operator_id
+
+    def release(self, operator_id):
+        """Оператор освободился: отдаём его первому ждущему или возвращаем в пул"""
+        self.confirm(operator_id)
+        user_id = self._busy.pop(operator_id, None)
+        if user_id is None and operator_id in self._free:
+            return
+        if self._users.get(user_id) == operator_id:
+            del self._users[user_id]
+        if operator_id not in self._operators:
+            return
+        while self._waiting:
+            user_id, future = self._waiting.popleft()
+            if future.done():
+                # Ожидание отменено или истекло — запись осталась в очереди
+                continue
+            future.set_result(self._assign(operator_id, user_id))
+            return
+        self._free[operator_id] = None
+
+    def enqueue(self, user_id):
+        """Ставит пользователя в очередь (если его там нет) и возвращает место в ней"""
+        if user_id not in self._waiters:
+            future = asyncio.get_event_loop().create_future()
+            self._waiters[user_id] = future
+            self._waiting.append((user_id, future))
+        return self.position(user_id)
+
+    async def wait(self, user_id, timeout=None):
+        """
+        Занимает оператора, а если свободных нет — ждёт в очереди.
+        Возвращает айди оператора или None, если за timeout никто не освободился.
+        """
+        future = self._waiters.get(user_id)
+        if future is None:
+            # Вне очереди можно сразу взять свободного; стоящий в очереди ждёт своей очереди
+            operator_id = self.claim(user_id)
+            if operator_id is not None:
+                return operator_id
+            self.enqueue(user_id)
+            future = self._waiters[user_id]
+        try:
+            operator_id = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.cancel_wait(user_id)
+            return None
+        except asyncio.CancelledError:
+            self.cancel_wait(user_id)
+            raise
+        self._waiters.pop(user_id, None)
+        return operator_id
+
+    def cancel_wait(self, user_id):
+        future = self._waiters.pop(user_id, None)
+        if future is None:
+            return
+        if future.done() and not future.cancelled():
+            # Оператор достался в момент отмены — передаём его следующему
+            self.release(future.result())
+        else:
+            future.cancel()
+
+    def position(self, user_id):
+        """Место пользователя в очереди (с 1) или None"""
+        future = self._waiters.get(user_id)
+        if future is None:
+            return None
+        position = 0
+        for waiting_id, waiting_future in self._waiting:
+            if not waiting_future.done():
+                position += 1
+            if waiting_id == user_id and waiting_future is future:
+                return position
+        return None
+
+    def add_operator(self, operator_id):
+        """Оператор вышел на смену"""
+        if operator_id not in self._operators:
+            self._operators.add(operator_id)
+            self.release(operator_id)
+
+    def remove_operator(self, operator_id):
+        """Оператор ушёл со смены; текущую сессию он может довести до конца"""
+        self._operators.discard(operator_id)
+        self._free.pop(operator_id, None)
+
+
+operator_pool = OperatorPool(config.SUPPORT_IDS, claim_timeout=config.SUPPORT_CLAIM_TIMEOUT)
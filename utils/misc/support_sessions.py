@@ -0,0 +1,113 @@
+from aiogram import Dispatcher
+
+from utils.misc.operator_pool import operator_pool
+
+SUPPORT_STATE = "in_support"
+# Ключ advisory-блокировки Postgres: поддержку обслуживает ровно один процесс бота
+SUPPORT_LOCK = 7214502
+
+
+class SupportAlreadyRunning(Exception):
+    """Поддержку уже обслуживает другой процесс бота"""
+
+
+async def claim_support_process(db):
+    """
+    Вызывается при старте: второй процесс с включённой поддержкой не запускается.
+    Индекс сессий и пул операторов живут в памяти процесса, и второй процесс
+    не видел бы чужих сессий и раздавал бы тех же операторов.
+    """
+    if not await db.try_hold_lock(SUPPORT_LOCK):
+        raise SupportAlreadyRunning(
+            "Another bot process is already serving support: support sessions and the operator pool "
+            "live in process memory, so only one process may run with support enabled. "
+            "Run a single process (one webhook worker) or start the others with SUPPORT_IDS= (empty).")
+
+
+class SupportSessions:
+    """
+    Индекс активных сессий поддержки в памяти: пользователь <-> оператор.
+
+    SupportMiddleware смотрит сюда на каждое сообщение, поэтому обычный трафик
+    не читает FSM-хранилище, а пересылка находит собеседника без get_data().
+    Состояние "in_support" и индекс меняются вместе — через open()/close();
+    после рестарта индекс восстанавливается из сохранённых состояний (restore()).
+    Индекс живёт в памяти процесса, поэтому поддержку обслуживает ровно один
+    процесс бота: при старте он берёт блокировку claim_support_process(), и второй
+    процесс с включённой поддержкой (например, ещё один webhook-воркер) не запустится.
+    Занятость операторов ведёт pool: открытие сессии подтверждает захват
+    оператора, закрытие — освобождает его.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool
+        self._peers = {}  # user_id -> second_id, обе стороны сессии
+
+    def __len__(self):
+        # Каждая сессия записана дважды — за пользователя и за оператора
+        return len(self._peers) // 2
+
+    def __contains__(self, user_id):
+        return user_id in self._peers
+
+    def peer(self, user_id):
+        return self._peers.get(user_id)
+
+    def _operator(self, user_id, second_id):
+        if self.pool is None:
+            return None
+        if second_id in self.pool:
+            return second_id
+        if user_id in self.pool:
+            return user_id
+        return None
+
+    def add(self, user_id, second_id):
+        self._peers[user_id] = second_id
+        self._peers[second_id] = user_id
+        operator_id = self._operator(user_id, second_id)
+        if operator_id is not None:
+            self.pool.mark_busy(operator_id, user_id if operator_id == second_id else second_id)
+            self.pool.confirm(operator_id)
+
+    def discard(self, user_id):
+        """Убирает сессию из индекса и возвращает собеседника (или None)"""
+        second_id = self._peers.pop(user_id, None)
+        if second_id is not None and self._peers.get(second_id) == user_id:
+            del self._peers[second_id]
+            operator_id = self._operator(user_id, second_id)
+            if operator_id is not None:
+                self.pool.release(operator_id)
+        return second_id
+
+    def restore(self, records):
+        """records — пары (user_id, data) из FSM-хранилища с состоянием "in_support" """
+        for user_id, data in records:
+            second_id = data.get("second_id")
+            if second_id is not None:
+                self._peers[int(user_id)] = int(second_id)
+        for user_id, second_id in self._peers.items():
+            operator_id = self._operator(user_id, second_id)
+            if operator_id == second_id:
+                self.pool.mark_busy(operator_id, user_id)
+
+    async def open(self, user_id, second_id):
+        """Соединяет пользователя с оператором: состояние, данные и индекс"""
+        dp = Dispatcher.get_current()
+        for first, second in ((user_id, second_id), (second_id, user_id)):
+            state = dp.current_state(chat=first, user=first)
+            await state.set_state(SUPPORT_STATE)
+            await state.update_data(second_id=second)
+        self.add(user_id, second_id)
+
+    async def close(self, user_id):
+        """Завершает сессию для обеих сторон; возвращает айди собеседника"""
+        second_id = self.discard(user_id)
+        dp = Dispatcher.get_current()
+        for chat_id in (user_id, second_id):
+            if chat_id is not None:
+                await dp.current_state(chat=chat_id, user=chat_id).reset_state()
+        return second_id
+
+
+support_sessions = SupportSessions(operator_pool)
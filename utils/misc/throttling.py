@@ -1,14 +1,16 @@
-def rate_limit(limit: int, key=None):
+def rate_limit(limit: float, key=None, calls: int = 1):
     """
     Decorator for configuring rate limit and key in different functions.
 
-    :param limit:
-    :param key:
+    :param limit: sliding window length in seconds
+    :param key: bucket name, handlers with the same key share one limit
+    :param calls: how many calls are allowed within the window
     :return:
     """
 
     def decorator(func):
         setattr(func, 'throttling_rate_limit', limit)
+        setattr(func, 'throttling_calls', calls)
         if key:
             setattr(func, 'throttling_key', key)
         return func
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.utils.exceptions import NetworkError, RetryAfter
+
+from utils.misc.cache import TTLCache
+from utils.misc.token_bucket import TokenBucket
+
+
+class MessageScheduler:
+    """
+    Единая очередь исходящих сообщений.
+
+    Сообщения в один чат уходят строго по порядку, в разные чаты — параллельно.
+    Общий лимит бота и лимит на чат соблюдаются token bucket'ами, RetryAfter
+    выдерживается и отправка повторяется. Лимитер чата переживает паузы между
+    пачками сообщений: он хранится в LRU/TTL-кэше ещё limiter_ttl секунд после
+    последней отправки. Если RetryAfter приходит сразу из разных чатов, значит
+    превышен общий лимит бота, и на паузу встаёт общий лимитер. Хендлер ставит
+    сообщение в очередь и сразу продолжает работу; при необходимости можно
+    дождаться результата, сделав await возвращённого future.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1.0, chat_burst=3, max_retries=5,
+                 max_chat_limiters=10000, limiter_ttl=60.0):
+        self.bot = bot
+        self.global_limiter = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._queues = {}  # chat_id -> deque[(factory, method, future)]
+        # Лимитер, простоявший дольше chat_burst / chat_rate, всё равно полон — хранить дольше незачем
+        self._chat_limiters = TTLCache(maxsize=max_chat_limiters, ttl=max(limiter_ttl, chat_burst / chat_rate))
+        self._workers = {}
+        self._last_flood = (None, 0.0)  # (chat_id, до какого времени) последнего RetryAfter
+
+    def submit(self, chat_id, factory, retry_flood=True):
+        """
+        factory — функция без аргументов, возвращающая корутину запроса к Bot API.
+        retry_flood=False — RetryAfter не повторяется, а уходит вызывающему (рассылка
+        сама решает, когда слать дальше); паузу лимитеров планировщик ставит всё равно.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Если результат никто не ждёт, ошибка уже залогирована — не ругаемся на «never retrieved»
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._queues.setdefault(chat_id, deque()).append((factory, retry_flood, future))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.ensure_future(self._worker(chat_id))
+        return future
+
+    def send_message(self, chat_id, text, retry_flood=True, **kwargs):
+        return self.submit(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), retry_flood)
+
+    @property
+    def queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _chat_limiter(self, chat_id):
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            limiter = TokenBucket(self.chat_rate, self.chat_burst)
+        # set() продлевает срок жизни: лимитер живёт, пока в чат пишут
+        self._chat_limiters.set(chat_id, limiter)
+        return limiter
+
+    async def _worker(self, chat_id):
+        queue = self._queues[chat_id]
+        limiter = self._chat_limiter(chat_id)
+        try:
+            while queue:
+                factory, retry_flood, future = queue.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    result = await self._send(chat_id, limiter, factory, retry_flood)
+                except Exception as e:
+                    logging.error(f"Could not send message to {chat_id}: {e}")
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            # Воркер живёт, только пока у чата есть очередь; лимитер остаётся в кэше
+            self._workers.pop(chat_id, None)
+            if not queue:
+                self._queues.pop(chat_id, None)
+            self._chat_limiters.set(chat_id, limiter)
+
+    def _on_flood(self, chat_id, timeout):
+        is_global = False
+        now = time.monotonic()
+        last_chat, last_until = self._last_flood
+        if last_chat != chat_id and now < last_until:
+            # Второй чат получил RetryAfter, пока не истёк первый, — это общий лимит бота
+            self.global_limiter.pause(timeout)
+            is_global = True
+        self._last_flood = (chat_id, max(last_until, now + timeout))
+        return is_global
+
+    async def _send(self, chat_id, limiter, factory, retry_flood=True):
+        for attempt in range(1, self.max_retries + 1):
+            await limiter.acquire()
+            await self.global_limiter.acquire()
+            try:
+                # Время запроса пишет InstrumentedBot.request
+                return await factory()
+            except RetryAfter as e:
+                limiter.pause(e.timeout)
+                if self._on_flood(chat_id, e.timeout):
+                    logging.warning(f"Flood control for the whole bot, all sends paused for {e.timeout}s")
+                else:
+                    logging.warning(f"Flood control for {chat_id}, retry in {e.timeout}s")
+                if not retry_flood or attempt == self.max_retries:
+                    raise
+            except NetworkError:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def close(self, timeout=10.0):
+        """Дожидается отправки уже поставленных сообщений"""
+        workers = list(self._workers.values())
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
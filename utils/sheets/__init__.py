@@ -0,0 +1,5 @@
+from .quota import QuotaExceeded, SheetsQuota
+from .session import SheetsSession
+from .writer import SheetsWriteQueue
+from .outbox import SheetsOutbox
+from .balances import BalanceCache
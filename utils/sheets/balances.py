@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+
+class BalanceCache:
+    """
+    Остатки из строки итогов листа (C1:D1), читаемые одним запросом.
+
+    Значение живёт ttl секунд и сбрасывается после каждой нашей записи в лист.
+    Одновременные запросы разделяют одно чтение, а не делают каждый своё.
+    """
+
+    def __init__(self, session, executor, balance_range='C1:D1', ttl=2.0):
+        self.session = session
+        self.executor = executor
+        self.balance_range = balance_range
+        self.ttl = ttl
+        self._value = None
+        self._expires_at = 0.0
+        self._generation = 0
+        self._inflight = None
+        self._inflight_generation = None
+
+    def invalidate(self):
+        self._generation += 1
+        self._value = None
+
+    def _read(self):
+        values = self.session.get_range(self.balance_range)
+        first_row = values[0] if values else []
+        dollar_balance = first_row[0] if len(first_row) > 0 and first_row[0] else '0'
+        sum_balance = first_row[1] if len(first_row) > 1 and first_row[1] else '0'
+        return dollar_balance, sum_balance
+
+    async def _load(self, generation):
+        value = await self.executor.run(self._read)
+        # Если пока читали была новая запись — результат уже устарел, не кэшируем
+        if generation == self._generation:
+            self._value = value
+            self._expires_at = time.monotonic() + self.ttl
+        return value
+
+    async def get(self):
+        """Возвращает (dollar_balance, sum_balance) как строки из листа"""
+        if self._value is not None and time.monotonic() < self._expires_at:
+            return self._value
+        if self._inflight is None or self._inflight.done() or self._inflight_generation != self._generation:
+            self._inflight_generation = self._generation
+            self._inflight = asyncio.ensure_future(self._load(self._generation))
+        return await asyncio.shield(self._inflight)
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+
+from utils.db_api.postgres import db_op
+from utils.misc.executor import ExecutorBusy
+from .quota import QuotaExceeded
+from .session import RATE_LIMITED_STATUS, RECONNECT_STATUS_CODES, api_error_status
+
+
+def is_transient(error):
+    """Ошибки, которые проходят сами (сеть, 5xx, 429, квота): из-за них строку не бросаем"""
+    if isinstance(error, (QuotaExceeded, ExecutorBusy, OSError, asyncio.TimeoutError)):
+        return True
+    status = api_error_status(error)
+    return status == RATE_LIMITED_STATUS or status in RECONNECT_STATUS_CODES
+
+
+class SheetsOutbox:
+    """
+    Надёжная доставка строк в Google Sheets через таблицу sheet_outbox.
+
+    Подтверждённая операция сначала коммитится в Postgres, а фоновый воркер
+    отправляет её в лист по порядку id, с экспоненциальной паузой при ошибках.
+    Доставка «как минимум один раз»: строка помечается sent только после
+    успешной записи. Повторное подтверждение с тем же dedupe_key не создаёт
+    второй строки.
+    Перед отправкой строки захватываются (locked_until, FOR UPDATE SKIP LOCKED),
+    поэтому несколько процессов бота не отправят одну строку дважды. Захват
+    процесса, упавшего посреди отправки, истекает через lease секунд.
+    После ошибки строки идут по одной, чтобы найти ту, что ломает пачку.
+    Строка, которую лист отвергает max_attempts раз подряд не из-за сети или
+    квоты (удалённый лист, ошибка валидации), получает статус failed: о ней
+    сообщается через on_failed(outbox_id, error), а строки за ней идут дальше.
+    """
+
+    def __init__(self, db, writer, batch_size=50, poll_interval=5.0, retry_base=2.0, retry_max=300.0,
+                 lease=300.0, max_attempts=5, on_failed=None):
+        self.db = db
+        self.writer = writer
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.on_failed = on_failed
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._wakeup = None
+        self._task = None
+
+    @db_op
+    async def enqueue(self, row, dedupe_key, conn=None):
+        """
+        Сохраняет строку в outbox и возвращает её id.
+
+        Если передан conn (открытая транзакция), воркер не будим — вызывающий
+        должен вызвать wakeup() после коммита.
+        """
+        executor = conn or self.db
+        outbox_id = await executor.fetchval(
+            'INSERT INTO sheet_outbox (dedupe_key, row) VALUES ($1, $2) '
+            'ON CONFLICT (dedupe_key) DO NOTHING RETURNING id',
+            dedupe_key, json.dumps(row, ensure_ascii=False))
+        if outbox_id is None:
+            outbox_id = await executor.fetchval('SELECT id FROM sheet_outbox WHERE dedupe_key=$1', dedupe_key)
+        if conn is None:
+            self.wakeup()
+        return outbox_id
+
+    def wakeup(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @db_op
+    async def claim_pending(self):
+        """Атомарно захватывает до batch_size неотправленных строк, которые никто не отправляет"""
+        records = await self.db.fetch(
+            "UPDATE sheet_outbox SET locked_until = now() + make_interval(secs => $2) "
+            "WHERE id IN (SELECT id FROM sheet_outbox "
+            "             WHERE status='pending' AND (locked_until IS NULL OR locked_until < now()) "
+            "             ORDER BY id LIMIT $1 FOR UPDATE SKIP LOCKED) "
+            "RETURNING id, row, attempts", self.batch_size, float(self.lease))
+        return sorted(records, key=lambda record: record['id'])
+
+    @db_op
+    async def requeue_failed(self):
+        """Возвращает строки со статусом failed в очередь (после исправления листа); возвращает их число"""
+        result = await self.db.execute(
+            "UPDATE sheet_outbox SET status='pending', attempts=0, locked_until=NULL WHERE status='failed'")
+        self.wakeup()
+        return int(result.split()[-1])
+
+    @db_op
+    async def deliver_pending(self):
+        """Отправляет захваченную пачку; возвращает число строк, которые ушли из очереди (sent или failed)"""
+        records = await self.claim_pending()
+        if not records:
+            return 0
+        if records[0]['attempts'] and len(records) > 1:
+            # Первая строка уже падала — шлём её одну, остальных отпускаем до следующего круга
+            await self.db.execute('UPDATE sheet_outbox SET locked_until=NULL WHERE id = ANY($1::bigint[])',
+                                  [record['id'] for record in records[1:]])
+            records = records[:1]
+        # Все строки попадают в одну пачку SheetsWriteQueue и пишутся в порядке id
+        results = await asyncio.gather(
+            *(self.writer.append(json.loads(record['row'])) for record in records), return_exceptions=True)
+        sent, failed, error = [], [], None
+        for record, result in zip(records, results):
+            if isinstance(result, Exception):
+                failed.append(record['id'])
+                error = error or result
+            else:
+                sent.append((record['id'], result))
+        if sent:
+            await self.db.executemany(
+                "UPDATE sheet_outbox SET status='sent', sent_at=now(), sheet_row=$2, attempts=attempts+1, "
+                "locked_until=NULL WHERE id=$1", sent)
+        if failed:
+            # Бросаем только строку, отправленную одна: в пачке виновата могла быть соседняя
+            give_up = len(records) == 1 and not is_transient(error)
+            rows = await self.db.fetch(
+                # Снимаем захват: повторит любой процесс, а не только этот
+                "UPDATE sheet_outbox SET attempts=attempts+1, last_error=$2, locked_until=NULL, "
+                "status = CASE WHEN $3 AND attempts + 1 >= $4 THEN 'failed' ELSE status END "
+                "WHERE id = ANY($1::bigint[]) RETURNING id, status",
+                failed, str(error), give_up, self.max_attempts)
+            dead = [row['id'] for row in rows if row['status'] == 'failed']
+            if not dead:
+                raise error
+            for outbox_id in dead:
+                logging.error(f"Sheets outbox row {outbox_id} failed {self.max_attempts} times, giving up: {error}")
+                if self.on_failed is not None:
+                    self.on_failed(outbox_id, error)
+        return len(sent) + len(failed)
+
+    async def _run(self):
+        failures = 0
+        while True:
+            self._wakeup.clear()
+            try:
+                delivered = await self.deliver_pending()
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = min(self.retry_max, self.retry_base * 2 ** (failures - 1))
+                logging.error(f"Sheets outbox delivery failed (attempt {failures}), retry in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            if delivered:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
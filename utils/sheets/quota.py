@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import deque
+
+WINDOW = 60.0  # квоты Sheets API считаются по минутам
+
+
+class QuotaExceeded(Exception):
+    """Квота не освободится за допустимое время ожидания"""
+
+
+class SheetsQuota:
+    """
+    Общий для процесса регулятор квоты Google Sheets API.
+
+    Каждый вызов API сначала получает разрешение: отдельно для чтений
+    и записей, не больше reads/writes_per_minute за скользящую минуту.
+    Записи важнее — пока запись ждёт квоту, обычные чтения (остатки)
+    не выполняются. После 429 все вызовы ставятся на паузу по Retry-After
+    (или с экспоненциальной паузой), а лимиты уменьшаются вдвое и плавно
+    возвращаются к настроенным после успешных вызовов.
+    Методы потокобезопасны: вызываются из потоков пула Sheets.
+    """
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, max_wait=60.0, min_scale=0.1,
+                 recovery_step=0.05, max_backoff=64.0):
+        self.limits = {'read': reads_per_minute, 'write': writes_per_minute}
+        self.max_wait = max_wait
+        self.min_scale = min_scale
+        self.recovery_step = recovery_step
+        self.max_backoff = max_backoff
+        self.scale = 1.0  # доля настроенных лимитов, уменьшается после 429
+        self.rate_limited = 0
+        self._calls = {'read': deque(), 'write': deque()}
+        self._waiting = {'read': 0, 'write': 0}
+        self._paused_until = 0.0
+        self._consecutive_429 = 0
+        self._cond = threading.Condition()
+
+    def _limit(self, kind):
+        return max(1, int(self.limits[kind] * self.scale))
+
+    def _wait_time(self, kind, priority, now):
+        if self._paused_until > now:
+            return self._paused_until - now
+        if kind == 'read' and not priority and self._waiting['write']:
+            # Уступаем ждущим записям; проснёмся, когда они пройдут
+            return WINDOW
+        calls = self._calls[kind]
+        while calls and calls[0] <= now - WINDOW:
+            calls.popleft()
+        if len(calls) < self._limit(kind):
+            return 0.0
+        return calls[len(calls) - self._limit(kind)] + WINDOW - now
+
+    def acquire(self, kind, priority=False):
+        """
+        Блокирует поток, пока вызов kind ('read' / 'write') не уложится в квоту.
+        priority — служебные чтения (открытие таблицы), которые нужны и записям.
+        """
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            self._waiting[kind] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(kind, priority, now)
+                    if wait <= 0:
+                        self._calls[kind].append(now)
+                        return
+                    # Ожидание за ждущими записями заранее неизвестно, остальное — известно точно
+                    if now >= deadline or (now + wait > deadline and wait < WINDOW):
+                        raise QuotaExceeded(f"Sheets {kind} quota: no slot within {self.max_wait:.0f}s")
+                    self._cond.wait(min(wait, deadline - now))
+            finally:
+                self._waiting[kind] -= 1
+                self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._consecutive_429 = 0
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + self.recovery_step)
+
+    def on_rate_limited(self, retry_after=None):
+        """Вызов получил 429: пауза для всех и снижение лимитов"""
+        with self._cond:
+            self.rate_limited += 1
+            self._consecutive_429 += 1
+            pause = retry_after if retry_after else min(self.max_backoff, 2 ** self._consecutive_429)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self.scale = max(self.min_scale, self.scale / 2)
+            self._cond.notify_all()
+        logging.warning(f"Google Sheets quota exceeded (429), pausing for {pause:.0f}s, "
+                        f"limits scaled to {self.scale:.0%}")
+
+    def usage(self):
+        """Текущее использование: вызовов за последнюю минуту, лимиты, пауза, ждущие вызовы"""
+        with self._cond:
+            now = time.monotonic()
+            usage = {}
+            for kind, calls in self._calls.items():
+                while calls and calls[0] <= now - WINDOW:
+                    calls.popleft()
+                usage[kind] = {'used': len(calls), 'limit': self._limit(kind), 'waiting': self._waiting[kind]}
+            usage['scale'] = self.scale
+            usage['paused_for'] = max(0.0, self._paused_until - now)
+            usage['rate_limited'] = self.rate_limited
+            return usage
@@ -0,0 +1,149 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import gspread
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+from utils.misc.metrics import sheets_errors, sheets_seconds, track
+from .quota import SheetsQuota
+
+
+# HTTP-коды, после которых имеет смысл переподключиться и повторить запрос
+RECONNECT_STATUS_CODES = {401, 500, 502, 503, 504}
+RATE_LIMITED_STATUS = 429
+
+
+def api_error_status(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def retry_after(error):
+    """Retry-After из ответа 429 в секундах, если Google его прислал"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class SheetsSession:
+    """
+    Долгоживущее подключение к Google Sheets.
+
+    Авторизуется один раз, заранее обновляет токен, кэширует таблицу и листы
+    и прозрачно переподключается при ошибках авторизации и 5xx.
+    Каждый запрос к API проходит через quota (SheetsQuota), а после 429
+    повторяется, когда квота освободится.
+    Методы синхронные (gspread) и потокобезопасные.
+    """
+
+    def __init__(self, credentials_file, sheet_id, sheet_name, scopes, refresh_margin=300, quota=None,
+                 max_rate_limited_retries=3):
+        self.credentials_file = credentials_file
+        self.sheet_id = sheet_id
+        self.sheet_name = sheet_name
+        self.scopes = scopes
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._lock = threading.RLock()
+        self._creds = None
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self.quota = quota or SheetsQuota()
+        self.max_rate_limited_retries = max_rate_limited_retries
+
+    def _connect(self):
+        self._creds = Credentials.from_service_account_file(self.credentials_file, scopes=self.scopes)
+        self._client = gspread.authorize(self._creds)
+        self._spreadsheet = self._client.open_by_key(self.sheet_id)
+        self._worksheets = {}
+        logging.info(f"Google Sheets session opened: {self.sheet_id}")
+
+    def _refresh_token(self):
+        # Обновляем токен заранее, а не ловим 401 посреди записи.
+        # expiry у google-auth — naive datetime в UTC.
+        expiry = self._creds.expiry
+        if not self._creds.valid or expiry is None or expiry - datetime.utcnow() < self.refresh_margin:
+            self._creds.refresh(Request())
+
+    def reset(self):
+        with self._lock:
+            self._creds = None
+            self._client = None
+            self._spreadsheet = None
+            self._worksheets = {}
+
+    def worksheet(self, name=None):
+        name = name or self.sheet_name
+        while True:
+            with self._lock:
+                if self._spreadsheet is not None:
+                    self._refresh_token()
+                    ws = self._worksheets.get(name)
+                    if ws is not None:
+                        return ws
+            # Квоту ждём без замка: потоки, чьи листы уже открыты, не стоят за нами.
+            # Метаданные нужны и записям, поэтому эти чтения не уступают им очередь
+            self.quota.acquire('read', priority=True)
+            with self._lock:
+                if self._spreadsheet is None:
+                    # Слот квоты ушёл на открытие таблицы; за листом — следующий круг
+                    self._connect()
+                    continue
+                ws = self._worksheets.get(name)
+                if ws is None:
+                    self._refresh_token()
+                    ws = self._spreadsheet.worksheet(name)
+                    self._worksheets[name] = ws
+                return ws
+
+    def run(self, func, sheet_name=None, op='call', kind='read'):
+        """
+        Выполняет func(worksheet) в пределах квоты kind ('read' / 'write').
+        При обрыве авторизации или 5xx переподключается и повторяет один раз,
+        после 429 ждёт, пока квота освободится, и повторяет до max_rate_limited_retries раз.
+        """
+        reconnected = False
+        rate_limited = 0
+        while True:
+            try:
+                worksheet = self.worksheet(sheet_name)
+                self.quota.acquire(kind)
+                with track(sheets_seconds, sheets_errors, op):
+                    result = func(worksheet)
+            except gspread.exceptions.APIError as e:
+                status = api_error_status(e)
+                if status == RATE_LIMITED_STATUS and rate_limited < self.max_rate_limited_retries:
+                    rate_limited += 1
+                    self.quota.on_rate_limited(retry_after(e))
+                    continue
+                if reconnected or status not in RECONNECT_STATUS_CODES:
+                    raise
+                logging.warning(f"Google Sheets API error {status}, reconnecting: {e}")
+                reconnected = True
+                self.reset()
+            except RequestsConnectionError as e:
+                if reconnected:
+                    raise
+                logging.warning(f"Google Sheets connection error, reconnecting: {e}")
+                reconnected = True
+                self.reset()
+            else:
+                self.quota.on_success()
+                return result
+
+    def append_row(self, row, **kwargs):
+        return self.run(lambda ws: ws.append_row(row, **kwargs), op='append_row', kind='write')
+
+    def append_rows(self, rows, **kwargs):
+        return self.run(lambda ws: ws.append_rows(rows, **kwargs), op='append_rows', kind='write')
+
+    def acell(self, label):
+        return self.run(lambda ws: ws.acell(label), op='acell')
+
+    def get_range(self, range_name):
+        return self.run(lambda ws: ws.get(range_name), op='get_range')
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import re
+
+
+def first_row_number(response):
+    """Номер первой добавленной строки из ответа append_rows ('Лист'!A10:K12 -> 10)"""
+    updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+    match = re.search(r'![A-Z]+(\d+)', updated_range)
+    return int(match.group(1)) if match else None
+
+
+class SheetsWriteQueue:
+    """
+    Write-behind очередь перед листом.
+
+    Строки от одновременных подтверждений собираются в течение max_delay
+    секунд (или пока не наберётся max_batch) и уходят одним append_rows.
+    Каждый вызывающий получает свой результат — номер своей строки в листе,
+    либо исключение, если запись пачки не удалась.
+    on_flush вызывается после каждой успешной записи (например, сброс кэша остатков).
+    """
+
+    def __init__(self, session, executor, max_batch=50, max_delay=0.3, on_flush=None):
+        self.session = session
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self._pending = []  # [(row, future)]
+        self._timer = None
+        self._lock = None
+        self._tasks = set()
+
+    async def append(self, row):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._schedule_flush)
+        return await future
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._schedule_flush)
+
+    async def _flush(self, batch):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Пачки пишутся строго по очереди, чтобы строки в листе шли в порядке подтверждений
+        async with self._lock:
+            rows = [row for row, _ in batch]
+            try:
+                response = await self.executor.run(self.session.append_rows, rows)
+            except Exception as e:
+                logging.error(f"Google Sheets batch of {len(rows)} rows failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            if self.on_flush is not None:
+                self.on_flush()
+            first = first_row_number(response)
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(first + i if first else None)
+
+    async def close(self):
+        """Дописывает всё, что осталось в очереди"""
+        if self._pending:
+            self._schedule_flush()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
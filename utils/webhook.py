@@ -0,0 +1,45 @@
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+
+from data import config
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Апдейты, которые ещё обрабатываются в фоне
+_pending_updates = set()
+
+
+def secret_matches(header):
+    """Сравнение за постоянное время: по времени ответа секрет не подобрать"""
+    return hmac.compare_digest((header or '').encode(), config.WEBHOOK_SECRET.encode())
+
+
+class BackgroundWebhookHandler(WebhookRequestHandler):
+    """
+    Принимает апдейт, проверяет секретный токен и сразу отвечает Telegram 200,
+    а сам апдейт обрабатывается в отдельной задаче. Так медленный хендлер
+    не задерживает доставку следующих апдейтов, и они идут параллельно.
+    """
+
+    async def post(self):
+        if config.WEBHOOK_SECRET and not secret_matches(self.request.headers.get(SECRET_TOKEN_HEADER)):
+            raise web.HTTPForbidden()
+        self.validate_ip()
+        dispatcher = self.get_dispatcher()
+        update = await self.parse_update(dispatcher.bot)
+        task = asyncio.ensure_future(dispatcher.process_updates([update]))
+        _pending_updates.add(task)
+        task.add_done_callback(_pending_updates.discard)
+        return web.Response(text='ok')
+
+
+async def wait_pending_updates(timeout=10.0):
+    """Даёт фоновым апдейтам доработать перед остановкой"""
+    if _pending_updates:
+        done, pending = await asyncio.wait(set(_pending_updates), timeout=timeout)
+        if pending:
+            logging.warning(f"{len(pending)} updates were still in progress at shutdown")